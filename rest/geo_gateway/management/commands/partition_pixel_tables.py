@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+
+from modules.db_handler import DBHandler
+from modules.db_schema import (PARTITIONED_TABLES, SUMMARY_TABLES, add_partitions, create_summary_views,
+                               is_partitioned, list_partitions, partition_table, refresh_summary_views)
+
+
+class Command(BaseCommand):
+    help = ("Convert pixel_sector / pixel_agg into tables partitioned by (scenario_optim, year, scenario_traffic) "
+            "and build the per-partition summary views of pixel_agg. Already partitioned tables get partitions "
+            "for the scenarios that were loaded into their default partition.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='iprism-postgres')
+        parser.add_argument('--port', type=int, default=5432)
+        parser.add_argument('--user', default='postgres')
+        parser.add_argument('--password', default='smacap')
+        parser.add_argument('--dbname', default='geospatial')
+        parser.add_argument('--tables', nargs='+', default=PARTITIONED_TABLES, choices=PARTITIONED_TABLES)
+        parser.add_argument('--drop-old', action='store_true',
+                            help='Drop the original table instead of keeping it as <table>_unpartitioned')
+        parser.add_argument('--refresh-summaries', action='store_true',
+                            help='Only refresh the materialized summary views')
+
+    def handle(self, *args, **options):
+        db = DBHandler(host=options['host'], port=options['port'], user=options['user'], password=options['password'],
+                       dbname=options['dbname'])
+        try:
+            for table in options['tables']:
+                if options['refresh_summaries']:
+                    if table in SUMMARY_TABLES:
+                        refresh_summary_views(db, table)
+                        self.stdout.write(f"{table}: summary views refreshed")
+                    continue
+
+                if is_partitioned(db, table):
+                    created = add_partitions(db, table)
+                    self.stdout.write(f"{table}: already partitioned, {len(created)} new partition(s) {', '.join(created)}")
+                else:
+                    created = partition_table(db, table, drop_old=options['drop_old'])
+                    kept = '' if options['drop_old'] else f", original kept as {table}_unpartitioned"
+                    self.stdout.write(f"{table}: {len(created)} partition(s) + default{kept}")
+
+                if table in SUMMARY_TABLES:
+                    views = create_summary_views(db, table)
+                    self.stdout.write(f"{table}: {len(views)} summary view(s), query them through {table}_summary")
+                self.stdout.write(f"{table}: {len(list_partitions(db, table))} partition(s) in total")
+        finally:
+            db.close()
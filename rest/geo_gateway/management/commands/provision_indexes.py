@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+
+from modules.db_handler import DBHandler
+from modules import db_queries as queries
+from modules.db_schema import PIXEL_INDEXES, create_indexes, explain
+
+
+class Command(BaseCommand):
+    help = ("Create the composite/covering indexes used by db_fetcher and dt_geosimulator on pixel_sector and pixel_agg "
+            "and report the planner cost of the main queries before and after.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='iprism-postgres')
+        parser.add_argument('--port', type=int, default=5432)
+        parser.add_argument('--user', default='postgres')
+        parser.add_argument('--password', default='smacap')
+        parser.add_argument('--dbname', default='geospatial')
+        parser.add_argument('--dry-run', action='store_true', help='Only print the CREATE INDEX statements')
+        parser.add_argument('--no-concurrently', action='store_true',
+                            help='Plain CREATE INDEX (faster, but blocks writes to the table while it runs)')
+
+    def handle(self, *args, **options):
+        db = DBHandler(host=options['host'], port=options['port'], user=options['user'], password=options['password'],
+                       dbname=options['dbname'])
+        try:
+            probes = self._probe_queries(db)
+            before = {name: self._explain(db, *probe) for name, probe in probes.items()}
+
+            statements = create_indexes(db, PIXEL_INDEXES, concurrently=not options['no_concurrently'],
+                                        dry_run=options['dry_run'])
+            for statement in statements:
+                self.stdout.write(statement)
+            if options['dry_run']:
+                return
+
+            after = {name: self._explain(db, *probe) for name, probe in probes.items()}
+            self.stdout.write('\nEXPLAIN total cost (before -> after)')
+            self.stdout.write('-' * 60)
+            for name in probes:
+                cost_before, _, scans_before = before[name]
+                cost_after, _, scans_after = after[name]
+                self.stdout.write(f"{name.ljust(22)} {cost_before:>14.1f} -> {cost_after:<14.1f} "
+                                  f"x{cost_before / max(cost_after, 1e-9):.1f}")
+                self.stdout.write(f"{''.ljust(22)} {', '.join(scans_before)} -> {', '.join(scans_after)}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _explain(db, query_def, params, identifiers=None):
+        return explain(db, query_def, params, **(identifiers or {}))
+
+    @staticmethod
+    def _probe_queries(db):
+        # Representative parameters are taken from the data itself: the first scenario and a few of its sites/sectors
+        scenario_row = db.execute("SELECT scenario_traffic, scenario_optim, year FROM pixel_sector LIMIT 1")
+        if not scenario_row:
+            return {}
+        scenario_traffic, scenario_optim, year = scenario_row[0]
+        scenario = dict(scenario_traffic=float(scenario_traffic), scenario_optim=scenario_optim, year=year)
+        ranges = dict(rsrp_min=-130, rsrp_max=-50, cqi_min=5, cqi_max=13)
+        sample = db.execute(
+            "SELECT site_id, sector_id, index FROM pixel_sector WHERE scenario_optim = %s AND year = %s LIMIT 3",
+            params=(scenario_optim, year))
+        site_ids = [row[0] for row in sample]
+        sector_ids = [row[1] for row in sample]
+        indices = [row[2] for row in sample]
+
+        return {
+            'affected_indices': (queries.AFFECTED_INDICES, dict(scenario, site_ids=site_ids)),
+            'sectors_by_index': (queries.SECTORS_BY_INDEX, dict(scenario, indices=indices)),
+            'pixel_agg_slice': (queries.PIXEL_AGG_SLICE, dict(scenario, **ranges), {'kpi': 'geo_user_tput_dl'}),
+            'coverage_data_pix': (queries.COVERAGE_DATA_PIX, dict(scenario, **ranges), {'kpi': 'geo_user_tput_dl'}),
+            'sector_data_pix': (queries.SECTOR_DATA_PIX, dict(scenario, sector_ids=sector_ids, **ranges), {'kpi': 'geo_user_tput_dl'}),
+            'site_data_pix_ext': (queries.SITE_DATA_PIX_EXT, dict(scenario, site_ids=site_ids, **ranges), {'kpi': 'geo_user_tput_dl'}),
+            'bestserver_data_pix': (queries.BESTSERVER_DATA_PIX, scenario),
+        }
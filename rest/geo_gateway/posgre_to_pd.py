@@ -2,8 +2,11 @@ import psycopg2
 import pandas as pd
 import sys
 import math
+from contextlib import contextmanager
 from django.conf import settings
 
+from modules.db_handler import get_pool
+
 def connect():
     conn = None
     print(settings.DATABASES['default'])
@@ -18,6 +21,18 @@ def connect():
         sys.exit(1)
     return conn
 
+@contextmanager
+def pooled_connection():
+    # Checks a connection to the default django database out of the process-wide pool and returns it afterwards
+    db = settings.DATABASES['default']
+    pool = get_pool(host=db['HOST'], port=db.get('PORT') or 5432, user=db['USER'], password=db['PASSWORD'],
+                    dbname=db['NAME'])
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
 def sql_to_dataframe(conn, query):
     cursor = conn.cursor()
     try:
@@ -7,4 +7,9 @@ urlpatterns = [
     path('geodata', views.get_coverage),
     path('get-cells', views.get_cells),
     path('dismantle-site', views.dismantle_site),
+    path('dismantle-site-summary', views.dismantle_site_summary),
+    path('dismantle-site-batch', views.dismantle_site_batch),
+    path('dismantle-site-sweep', views.dismantle_site_sweep),
+    path('dismantle-site-optimize', views.dismantle_site_optimize),
+    path('dismantle-site-async', views.dismantle_site_async),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
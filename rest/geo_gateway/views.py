@@ -1,5 +1,14 @@
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from django.conf import settings
+from psycopg2.errors import QueryCanceled
+import asyncio
+import os
 # from geo.Geoserver import Geoserver
 import time
 from . import posgre_to_pd as ptp
@@ -7,10 +16,15 @@ import json
 import requests
 
 ### iPrism modules import
-from modules.db_handler import DBHandler
-from modules.vis_geomaps import raster_transform_django_test, get_visualization_params
+from modules.vis_geomaps import raster_transform_django_test, get_visualization_params, get_visualization_params_kpi
 from modules.dt_geosimulator import dt_geosimulator
 from modules.db_fetcher_geo import db_fetcher
+from modules.dt_geosimulator_async import dt_geosimulator_async
+from modules.db_fetcher_geo_async import db_fetcher_async
+from modules.db_handler_async import close_async_pools
+from modules.deadline import Deadline, DeadlineExceeded, client_disconnected
+from modules.dt_sweep import sweep_switch_off
+from modules.db_queries import PIXEL_KPI_COLUMNS, kpi_column
 
 # dev
 # geoserver_url = "http://localhost:8080/geoserver/rest"
@@ -25,26 +39,36 @@ password = "geoserver"
 #   /data/temp_rasters
 
 
+def endpoint_timeouts(endpoint):
+    """{'statement': seconds, 'request': seconds} for endpoint from settings.IPRISM_ENDPOINT_TIMEOUTS."""
+    return dict(settings.IPRISM_ENDPOINT_TIMEOUTS['default'], **settings.IPRISM_ENDPOINT_TIMEOUTS.get(endpoint, {}))
+
+
+def request_deadline(request, endpoint):
+    """Deadline of this request, aborted early when the client disconnects (detectable on gunicorn sync workers)."""
+    sock = request.META.get('gunicorn.socket')
+    abort_check = (lambda: client_disconnected(sock)) if sock is not None else None
+    return Deadline(endpoint_timeouts(endpoint)['request'], abort_check=abort_check)
+
+
 # Create your views here.
 
 @api_view(['GET'])
 def get_coverage(request):
-    conn = ptp.connect()
     query = """select geojson from geo_test.coverage_analytics ca where uid = '1'"""
-    cursor = conn.cursor()
-    cursor.execute(query)
-    tuples_list = cursor.fetchall()
+    with ptp.pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(query)
+        tuples_list = cursor.fetchall()
     response = json.dumps(tuples_list[0][0])
     return Response(json.loads(response))
 
 
 @api_view(['GET'])
 def get_cells(request):
-    conn = ptp.connect()
     query = """select geojson from geo_test.cells c where uid = '3'"""
-    cursor = conn.cursor()
-    cursor.execute(query)
-    tuples_list = cursor.fetchall()
+    with ptp.pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(query)
+        tuples_list = cursor.fetchall()
     response = json.dumps(tuples_list[0][0])
     return Response(json.loads(response))
 
@@ -54,6 +78,12 @@ def dismantle_site(request):
     # cells = request.GET.getlist('cells[]', [])
     sites = request.GET.getlist('sites[]', [])
     # AP: sites should be a list object with Site_IDs inside. Each site should be in the following format: Site_135, Site_136, etc.
+    # Optional client chosen editing session id: the switch-off is then updated from the previous site list of the
+    # session (per worker process, a request landing on another worker just computes the list in full)
+    session = request.GET.get('session')
+    # Optional tiled=1 for very large site lists / areas: the switch-off is run and rasterised tile by tile on the
+    # server (bounded worker memory), one kpi only
+    tiled = request.GET.get('tiled') in ('1', 'true')
 
     # creating layer name
     current_timestamp = time.time()
@@ -70,9 +100,6 @@ def dismantle_site(request):
     elif not isinstance(sites, list):
         print("Sites list is not a list")
 
-    db = DBHandler(password="smacap", dbname='geospatial')
-    dt_geo = dt_geosimulator(password="smacap", dbname='geospatial')
-
     # Hardcoded user GUI selection:
     selection_tab3 = "QoE"
 
@@ -96,25 +123,73 @@ def dismantle_site(request):
     else:
         print("Error in get_visualization_params")
 
-    cov_data = dt_geo.pix_data_site_switch_off(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario, optim_scenario,
-                                               year, kpi, sites)
+    # Optional kpis[]: one simulation, one published layer per KPI (layer name suffixed with the KPI), a KPI given
+    # twice is simulated and published once
+    kpis = list(dict.fromkeys(request.GET.getlist('kpis[]', [])))
+    for layer_kpi in kpis:
+        if get_visualization_params_kpi(layer_kpi) == "Invalid Selection":
+            return Response({'detail': f'Invalid kpi {layer_kpi!r}'}, status=400)
+    if kpis and tiled:
+        return Response({'detail': 'tiled=1 takes a single kpi, not kpis[]'}, status=400)
+    if kpis:
+        layers = {layer_kpi: (f"{layer_name}_{layer_kpi}", kpi_column(layer_kpi), get_visualization_params_kpi(layer_kpi))
+                  for layer_kpi in kpis}
+    else:
+        layers = {kpi: (layer_name, 'kpi', {'vmin': vmin, 'vmax': vmax, 'cmap': cmap})}
 
-    raster_cov_filter = db_fetcher().generate_raster(cov_data)
+    # Every statement is capped by the endpoint's statement timeout, the request deadline runs through all stages
+    # below and cancels the running query when it passes or the client disconnects
+    deadline = request_deadline(request, 'dismantle_site')
+    statement_timeout = endpoint_timeouts('dismantle_site')['statement']
+    try:
+        # The switch-off runs on the scenario's in-memory store (loaded once per worker and data version),
+        # the pooled connection is only used to load it
+        with dt_geosimulator(password="smacap", dbname='geospatial', pooled=True, cache=True,
+                             statement_timeout=statement_timeout, deadline=deadline) as dt_geo:
+            if tiled:
+                raster_cov_filter = dt_geo.pix_data_site_switch_off_tiled(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario,
+                                                                          optim_scenario, year, kpi, sites)
+            else:
+                cov_data = dt_geo.pix_data_site_switch_off(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario, optim_scenario,
+                                                           year, kpis or kpi, sites, engine='memory',
+                                                           session=(request.user.pk, session) if session else None)
+        if tiled and raster_cov_filter is None:
+            return Response({'detail': 'No pixel in the selected slice'}, status=404)
 
-    memfile_rgb, memfile_rgba, legend_dict_tab3, bounds_tab3 = raster_transform_django_test(
-        raster_cov_filter, vmin, vmax, cmap, 6, 0)
-    # Description of the output:
-    # memfile_rgb - in-memory file object
-    # memfile_rgba - in-memory file object
-    # output_rgb_file - file path to the RGB raster
-    # output_rgba_file - file path to the RGBA raster
-    # legend_dict_tab3 - legend dictionary
-    # bounds_tab3 - bounds list
+        for layer, column, params in layers.values():
+            if not tiled:
+                layer_data = cov_data if column == 'kpi' else cov_data[['index', 'latitude_50', 'longitude_50', column]].rename(columns={column: 'kpi'})
 
-    # We go with 4 channel memfile raster as the default output scenario:
+                # The raster stays in memory up to the colorisation (no temporary GeoTIFF in the working directory)
+                deadline.check('rasterisation')
+                with db_fetcher(password="smacap", dbname='geospatial', pooled=True) as fetcher:
+                    raster_cov_filter = fetcher.generate_raster_array(layer_data)
 
-    raster_data = memfile_rgba
+            deadline.check('colorisation')
+            try:
+                # Only the 4 channel raster is published, the 3 channel one is not encoded (memfile_rgb is None)
+                memfile_rgb, memfile_rgba, legend_dict_tab3, bounds_tab3 = raster_transform_django_test(
+                    raster_cov_filter, params['vmin'], params['vmax'], params['cmap'], 6, 0, outputs=('rgba',),
+                    image_format=settings.IPRISM_PUBLISH_RASTER_FORMAT)
+            finally:
+                if tiled and raster_cov_filter is not None:
+                    os.remove(raster_cov_filter)  # the tiled raster is only a file because it is written window by window
+            # Description of the output:
+            # memfile_rgb - in-memory file object
+            # memfile_rgba - in-memory file object
+            # output_rgb_file - file path to the RGB raster
+            # output_rgba_file - file path to the RGBA raster
+            # legend_dict_tab3 - legend dictionary
+            # bounds_tab3 - bounds list
 
+            # We go with 4 channel memfile raster as the default output scenario:
+            deadline.check('publishing')
+            publish_raster(memfile_rgba, workspace, layer, timeout=deadline.remaining())
+    except (DeadlineExceeded, QueryCanceled, requests.Timeout) as e:
+        print(f"dismantle_site aborted: {e}")
+        return Response({'detail': f'Request timed out: {e}'}, status=504)
+    finally:
+        deadline.close()
 
     ### iPrism code section END
 
@@ -124,8 +199,152 @@ def dismantle_site(request):
     # prod
     # file_data = open(r'/rest/rest/geo_gateway/static/raster_test_output_rgba.tif')
 
-    workspace = "dismantle"
-    datastore = "dismantle"
+    if kpis:
+        return Response({'workspace': workspace, 'layer': layers[kpis[0]][0],
+                         'layers': {layer_kpi: layer for layer_kpi, (layer, _, _) in layers.items()}})
+    return Response({'workspace': workspace, 'layer': layer_name})
+
+
+@api_view(['GET'])
+def dismantle_site_summary(request):
+    # Same simulation as dismantle_site, answered with the impact numbers only (no raster, colorisation nor publishing):
+    # ?sites[]=Site_135&sites[]=Site_136[&kpi=geo_user_tput_dl]
+    sites = request.GET.getlist('sites[]', [])
+    if not sites:
+        return Response({'detail': 'sites[] is required'}, status=400)
+    kpi = request.GET.get('kpi', 'geo_user_tput_dl')
+    if kpi not in PIXEL_KPI_COLUMNS:
+        return Response({'detail': f'Invalid kpi {kpi!r}'}, status=400)
+
+    # Same hardcoded GUI selection as dismantle_site
+    year = 0
+    traffic_scenario = 1.3
+    optim_scenario = 0
+    rsrp_min, rsrp_max = -130, -50
+    cqi_min, cqi_max = 5, 13
+
+    deadline = request_deadline(request, 'dismantle_site_summary')
+    try:
+        with dt_geosimulator(password="smacap", dbname='geospatial', pooled=True, cache=True,
+                             statement_timeout=endpoint_timeouts('dismantle_site_summary')['statement'],
+                             deadline=deadline) as dt_geo:
+            summary = dt_geo.pix_data_site_switch_off_batch(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario,
+                                                            optim_scenario, year, kpi, [sites], engine='memory',
+                                                            summary=True)[0]
+    except (DeadlineExceeded, QueryCanceled) as e:
+        print(f"dismantle_site_summary aborted: {e}")
+        return Response({'detail': f'Request timed out: {e}'}, status=504)
+    finally:
+        deadline.close()
+
+    return Response(dict(summary, kpi=kpi, year=year, traffic_scenario=traffic_scenario, optim_scenario=optim_scenario))
+
+
+@api_view(['GET'])
+def dismantle_site_batch(request):
+    # candidates[] - one dismantle candidate per value, its Site_IDs comma separated:
+    # ?candidates[]=Site_135,Site_136&candidates[]=Site_140
+    candidates = [[site.strip() for site in value.split(',') if site.strip()] for value in request.GET.getlist('candidates[]', [])]
+    if not candidates:
+        return Response({'detail': 'candidates[] is required'}, status=400)
+
+    # Same hardcoded GUI selection as dismantle_site
+    year = 0
+    traffic_scenario = 1.3
+    optim_scenario = 0
+    kpi = 'geo_user_tput_dl'
+    rsrp_min, rsrp_max = -130, -50
+    cqi_min, cqi_max = 5, 13
+
+    # All candidates share one scenario store and are evaluated in one vectorized pass, only the impact numbers are returned
+    deadline = request_deadline(request, 'dismantle_site_batch')
+    statement_timeout = endpoint_timeouts('dismantle_site_batch')['statement']
+    try:
+        with dt_geosimulator(password="smacap", dbname='geospatial', pooled=True, cache=True,
+                             statement_timeout=statement_timeout, deadline=deadline) as dt_geo:
+            summaries = dt_geo.pix_data_site_switch_off_batch(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario,
+                                                              optim_scenario, year, kpi, candidates, engine='memory',
+                                                              summary=True)
+    except (DeadlineExceeded, QueryCanceled) as e:
+        print(f"dismantle_site_batch aborted: {e}")
+        return Response({'detail': f'Request timed out: {e}'}, status=504)
+    finally:
+        deadline.close()
+
+    return Response({'kpi': kpi, 'year': year, 'traffic_scenario': traffic_scenario, 'optim_scenario': optim_scenario,
+                     'candidates': summaries})
+
+
+@api_view(['GET'])
+def dismantle_site_optimize(request):
+    # ?objective=geo_user_tput_dl|coverage&top=20&size=5 - top single sites by least impact and a greedy plan of size sites
+    objective = request.GET.get('objective', 'geo_user_tput_dl')
+    try:
+        top = int(request.GET.get('top', 20))
+        size = int(request.GET.get('size', 0))
+        pool = int(request.GET.get('pool', 200))
+    except ValueError as e:
+        return Response({'detail': f'Invalid parameter: {e}'}, status=400)
+
+    # Same hardcoded GUI selection as dismantle_site
+    year = 0
+    traffic_scenario = 1.3
+    optim_scenario = 0
+    rsrp_min, rsrp_max = -130, -50
+    cqi_min, cqi_max = 5, 13
+
+    deadline = request_deadline(request, 'dismantle_site_optimize')
+    try:
+        with dt_geosimulator(password="smacap", dbname='geospatial', pooled=True, cache=True,
+                             statement_timeout=endpoint_timeouts('dismantle_site_optimize')['statement'],
+                             deadline=deadline) as dt_geo:
+            ranking, plan = dt_geo.rank_dismantle_sites(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario,
+                                                        optim_scenario, year, objective=objective, top=top, size=size,
+                                                        pool=pool)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=400)
+    except (DeadlineExceeded, QueryCanceled) as e:
+        print(f"dismantle_site_optimize aborted: {e}")
+        return Response({'detail': f'Request timed out: {e}'}, status=504)
+    finally:
+        deadline.close()
+
+    return Response({'objective': objective, 'year': year, 'traffic_scenario': traffic_scenario,
+                     'optim_scenario': optim_scenario, 'ranking': ranking.to_dict('records'), 'plan': plan})
+
+
+@api_view(['GET'])
+def dismantle_site_sweep(request):
+    # sites[] as in dismantle_site, the grid axes default to the hardcoded selection of dismantle_site:
+    # ?sites[]=Site_135&years[]=0&years[]=1&years[]=2&traffic_scenarios[]=1.3&optim_scenarios[]=0
+    sites = request.GET.getlist('sites[]', [])
+    if not sites:
+        return Response({'detail': 'sites[] is required'}, status=400)
+    try:
+        years = [int(value) for value in request.GET.getlist('years[]', [])] or [0]
+        traffic_scenarios = [float(value) for value in request.GET.getlist('traffic_scenarios[]', [])] or [1.3]
+        optim_scenarios = [int(value) for value in request.GET.getlist('optim_scenarios[]', [])] or [0]
+    except ValueError as e:
+        return Response({'detail': f'Invalid grid value: {e}'}, status=400)
+
+    kpi = 'geo_user_tput_dl'
+    rsrp_min, rsrp_max = -130, -50
+    cqi_min, cqi_max = 5, 13
+
+    # Grid points run in parallel on the process pool of modules.dt_sweep, only their summaries come back
+    timeouts = endpoint_timeouts('dismantle_site_sweep')
+    try:
+        series = sweep_switch_off(dict(password="smacap", dbname='geospatial'), rsrp_min, rsrp_max, cqi_min, cqi_max, kpi,
+                                  sites, years, traffic_scenarios, optim_scenarios, timeout=timeouts['request'],
+                                  statement_timeout=timeouts['statement'])
+    except (TimeoutError, QueryCanceled) as e:
+        print(f"dismantle_site_sweep aborted: {e}")
+        return Response({'detail': f'Request timed out: {e}'}, status=504)
+
+    return Response({'kpi': kpi, 'sites': sites, 'series': series})
+
+
+def publish_raster(raster_data, workspace, layer_name, datastore="dismantle", timeout=None):
     headers = {
         'Content-type': 'image/tiff',
     }
@@ -135,7 +354,76 @@ def dismantle_site(request):
         coverage_store_url,
         auth=(username, password),
         headers=headers,
-        data=raster_data
+        data=raster_data,
+        timeout=timeout
     )
+    return response
 
-    return Response({'workspace': workspace, 'layer': layer_name})
+
+### Async views (psycopg 3 pool), served when the project runs under ASGI (rest/asgi.py).
+# DRF's @api_view is sync only, so token authentication is done here explicitly.
+# Under WSGI Django still serves them, each call in an event loop of its own: the view closes that loop's pools
+# (modules.db_handler_async) before returning, nothing is reused across requests there.
+
+async def authenticate_async(request):
+    """Token authentication for async views: returns None on success or the 401 JsonResponse."""
+    try:
+        result = await sync_to_async(TokenAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({'detail': str(e.detail)}, status=401)
+    if result is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    return None
+
+
+async def dismantle_site_async(request):
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    denied = await authenticate_async(request)
+    if denied is not None:
+        return denied
+
+    sites = request.GET.getlist('sites[]', [])
+    if not sites:
+        return JsonResponse({'detail': 'sites[] is required'}, status=400)
+    layer_name = sites[0] + str(time.time())
+    workspace = 'dismantle'
+
+    # Same hardcoded GUI selection as dismantle_site
+    year = 0
+    traffic_scenario = 1.3
+    optim_scenario = 0
+    kpi = 'geo_user_tput_dl'
+    rsrp_min, rsrp_max = -130, -50
+    cqi_min, cqi_max = 5, 13
+    folium_params_tab3 = get_visualization_params("QoE")
+
+    timeouts = endpoint_timeouts('dismantle_site')
+
+    async def pipeline():
+        async with dt_geosimulator_async(password="smacap", dbname='geospatial', cache=True,
+                                         statement_timeout=timeouts['statement']) as dt_geo:
+            cov_data = await dt_geo.pix_data_site_switch_off(rsrp_min, rsrp_max, cqi_min, cqi_max, traffic_scenario,
+                                                             optim_scenario, year, kpi, sites)
+
+        async with db_fetcher_async(password="smacap", dbname='geospatial') as fetcher:
+            raster_cov_filter = await fetcher.generate_raster_array(cov_data)
+
+        memfile_rgb, memfile_rgba, legend_dict_tab3, bounds_tab3 = await asyncio.to_thread(
+            raster_transform_django_test, raster_cov_filter, folium_params_tab3['vmin'], folium_params_tab3['vmax'],
+            folium_params_tab3['cmap'], 6, 0, outputs=('rgba',), image_format=settings.IPRISM_PUBLISH_RASTER_FORMAT)
+
+        # The upload is blocking I/O (requests), it waits in a worker thread while the loop serves other requests
+        await asyncio.to_thread(publish_raster, memfile_rgba, workspace, layer_name, timeout=timeouts['request'])
+
+    # Request deadline: on expiry the pipeline task is cancelled, psycopg cancels its running query on the server
+    try:
+        await asyncio.wait_for(pipeline(), timeout=timeouts['request'])
+    except asyncio.TimeoutError:
+        print(f"dismantle_site_async aborted: deadline of {timeouts['request']}s exceeded")
+        return JsonResponse({'detail': 'Request timed out'}, status=504)
+    finally:
+        if not isinstance(request, ASGIRequest):
+            await close_async_pools()  # WSGI: the loop ends with this request
+
+    return JsonResponse({'workspace': workspace, 'layer': layer_name})
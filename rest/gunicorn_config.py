@@ -1,4 +1,8 @@
 workers = 4
 bind = "0.0.0.0:8000"
 chdir = "/rest/"
-module = "rest.wsgi:application"
\ No newline at end of file
+module = "rest.wsgi:application"
+
+# Async views (dismantle-site-async) only overlap their I/O when served through ASGI:
+# worker_class = "uvicorn.workers.UvicornWorker"
+# module = "rest.asgi:application"
@@ -0,0 +1,177 @@
+#Version 0.1
+#Change log:
+#18.10.2026 Versioned, memory-bounded query result cache used by DBHandler(cache=True)
+
+# Results are keyed on the normalised query text plus its parameters and kept in an LRU bounded by bytes.
+# Every cached entry remembers the data version of the tables it was read from. A version is bumped when
+# DBHandler.df_to_sql / drop_table write a table and, across processes, through LISTEN/NOTIFY on
+# NOTIFY_CHANNEL: every DBHandler write sends pg_notify(NOTIFY_CHANNEL, table), external loaders can do the same
+# with  NOTIFY iprism_table_version, 'pixel_agg';
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from psycopg2 import OperationalError, InterfaceError
+
+
+CACHE_MAX_BYTES = int(float(os.environ.get('IPRISM_QUERY_CACHE_MB', 256)) * 1024 * 1024)
+NOTIFY_CHANNEL = 'iprism_table_version'
+
+_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][\w.]*)', re.IGNORECASE)
+
+
+def query_tables(query):
+    """Tables referenced after FROM / JOIN in a SQL statement (lower case, schema stripped)."""
+    return tuple(sorted({table.split('.')[-1].lower() for table in _TABLE_RE.findall(query)}))
+
+
+def normalise_query(query):
+    """Collapse whitespace so formatting differences do not produce separate cache entries."""
+    return ' '.join(query.split())
+
+
+def _freeze(value):
+    # Hashable, order-stable form of query parameters
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set, np.ndarray)):
+        items = [_freeze(item) for item in value]
+        return tuple(sorted(items)) if isinstance(value, set) else tuple(items)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class QueryCache:
+    """
+    LRU cache of query results for one database.
+
+    Entries are stored column by column as read-only NumPy arrays (the typed arrays produced by
+    DBHandler.fetch_df / fetch_query), get() hands out a fresh DataFrame so callers can modify it freely.
+    """
+
+    def __init__(self, connect_kwargs=None, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.connect_kwargs = connect_kwargs  # enables the LISTEN connection when given
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # key -> (tables, versions, columns, nbytes)
+        self._versions = {}  # table -> data version
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def key(self, query, params=None):
+        return normalise_query(query), _freeze(params)
+
+    def versions(self, tables):
+        """Snapshot of the data versions of tables, take it before running the query that fills the cache."""
+        self._poll()
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def get(self, key, tables):
+        self._poll()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] != tuple(self._versions.get(table, 0) for table in tables):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            columns = entry[2]
+        return pd.DataFrame({name: values.copy() for name, values in columns.items()}, copy=False)
+
+    def put(self, key, tables, versions, frame):
+        columns = {}
+        for name in frame.columns:
+            values = frame[name].to_numpy(copy=True)
+            values.flags.writeable = False
+            columns[name] = values
+        nbytes = int(frame.memory_usage(index=False, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            # The tables changed while the query was running: the result may already be stale
+            if versions != tuple(self._versions.get(table, 0) for table in tables):
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (tuple(tables), versions, columns, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def bump(self, table):
+        """Advance the data version of table and free the entries that read it."""
+        table = table.split('.')[-1].lower()
+        with self._lock:
+            self._versions[table] = self._versions.get(table, 0) + 1
+            for key in [key for key, entry in self._entries.items() if table in entry[0]]:
+                self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    def _poll(self):
+        # Non-blocking: drain notifications that arrived on the LISTEN connection since the last call
+        if self.connect_kwargs is None:
+            return
+        with self._listener_lock:
+            self._poll_listener()
+
+    def _poll_listener(self):
+        try:
+            if self._listener is None or self._listener.closed:
+                self._listener = psycopg2.connect(**self.connect_kwargs)
+                self._listener.autocommit = True
+                with self._listener.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Notifications may have been missed while we were not listening
+                self.clear()
+            self._listener.poll()
+            while self._listener.notifies:
+                self.bump(self._listener.notifies.pop(0).payload)
+        except (OperationalError, InterfaceError) as e:
+            print(f"Query cache listener lost ({e}), cache cleared")
+            self.clear()
+            if self._listener is not None:
+                self._listener.close()
+            self._listener = None
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+_caches_pid = os.getpid()
+
+
+def get_cache(host, port, user, password, dbname, create=True):
+    """Return the process-wide result cache for the given database (None if create=False and there is none)."""
+    global _caches_pid
+    key = (host, int(port), user, password, dbname)
+    with _caches_lock:
+        if _caches_pid != os.getpid():
+            _caches.clear()
+            _caches_pid = os.getpid()
+        cache = _caches.get(key)
+        if cache is None and create:
+            cache = QueryCache(dict(host=host, port=port, user=user, password=password, dbname=dbname))
+            _caches[key] = cache
+        return cache
@@ -1,21 +1,82 @@
 #Release history
 #01.03.2024: site_data_pix function added (copy of sector_data_pix)
+#18.10.2026: coverage_data_pix fetches through DBHandler.fetch_df (typed columns, no Decimal intermediate)
+#18.10.2026: all *_data_pix methods use prepared statements from modules.db_queries (bound parameters, whitelisted kpi)
+#18.10.2026: generate_raster* place the points with the NumPy grid rasterizer (rasterize_points), no GeoPandas / Shapely
+#18.10.2026: generate_raster_array: in-memory raster (RasterArray) for the colorisation stage, no temporary GeoTIFF
+#18.10.2026: generate_raster* raster_format='COG': Cloud-Optimized GeoTIFF with internal tiles and overviews
+#18.10.2026: COG_RESAMPLING defined here only, vis_geomaps imports it
+#18.10.2026: COG_RESAMPLING / RASTER_FILE_FORMATS / raster_file_options moved to modules.raster_formats
+#18.10.2026: *_data_pix fetches are read_only=True (may run on a read replica)
 
 
 from modules.db_handler import DBHandler
+from modules import db_queries as queries
+from modules.db_queries import as_list
+from modules.raster_formats import raster_file_options
 
 import pandas as pd
 import math
-import geopandas as gpd
+from collections import namedtuple
 import numpy as np
 import rasterio
 from rasterio.transform import from_origin
-from rasterio.features import rasterize
 import glob
 import os
 import time
 
 
+RASTER_CRS = "EPSG:4326"
+
+# Single band raster kept in memory between the raster stages (vis_geomaps.raster_transform* read it like a file)
+RasterArray = namedtuple('RasterArray', ['array', 'transform', 'crs'])
+
+
+def point_grid(bounds, resolution):
+    """(transform, rows, cols) of the north-up grid of the given resolution over bounds (xmin, ymin, xmax, ymax)."""
+    xmin, ymin, xmax, ymax = bounds
+    cols = int((xmax - xmin) / resolution)
+    rows = int((ymax - ymin) / resolution)
+    return from_origin(xmin, ymax, resolution, resolution), rows, cols
+
+
+def rasterize_points(lon, lat, values, transform, out_shape, offset=(0, 0), dtype='float32'):
+    """
+    Burn point values into a zero filled array of out_shape on the grid of transform (north-up, square cells).
+
+    Row / column of every point are computed arithmetically from its coordinates; points outside the array are dropped.
+    Points exactly on the west / north edge of the grid are kept (rasterio, through GDAL's inverse geotransform, can
+    round them just outside and drop them).
+    When several points fall into one cell the last one in input order wins (rasterio.features.rasterize's default).
+    offset (row, col) places the array inside a larger grid, e.g. a window of the full raster.
+    """
+    res = transform.a
+    row = np.floor((transform.f - np.asarray(lat, dtype=np.float64)) / res).astype(np.int64) - offset[0]
+    col = np.floor((np.asarray(lon, dtype=np.float64) - transform.c) / res).astype(np.int64) - offset[1]
+    inside = (row >= 0) & (row < out_shape[0]) & (col >= 0) & (col < out_shape[1])
+    cell = row[inside] * out_shape[1] + col[inside]
+    values = np.asarray(values)[inside]
+
+    # Last occurrence of every cell: first occurrence in the reversed order
+    _, first_reversed = np.unique(cell[::-1], return_index=True)
+    last = len(cell) - 1 - first_reversed
+    out_array = np.zeros(out_shape, dtype=dtype)
+    out_array.flat[cell[last]] = values[last]
+    return out_array
+
+
+def points_raster(lon, lat, kpi, resolution):
+    """
+    Raster of the kpi points with a value (rounded to 2 decimals), on a grid of the given resolution fitted to
+    their bounds. Returns (out_array, transform).
+    """
+    lon, lat, kpi = (np.asarray(column, dtype=np.float64) for column in (lon, lat, kpi))
+    valid = ~np.isnan(kpi)
+    lon, lat, kpi = lon[valid], lat[valid], np.round(kpi[valid], 2)
+    transform, rows, cols = point_grid((lon.min(), lat.min(), lon.max(), lat.max()), resolution)
+    return rasterize_points(lon, lat, kpi, transform, (rows, cols)), transform
+
+
 class db_fetcher(DBHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)  # Initializing the base class
@@ -23,56 +84,23 @@ class db_fetcher(DBHandler):
     def sector_data_pix(self, sector_id, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_optim, scenario_traffic, year, kpi):
         """Method to fetch data from pixel_sector table based on the given parameters."""
 
-        # If sector_id is a list or tuple with more than one value, format it appropriately
-        # Else, just enclose the single value in parenthesis
-        if isinstance(sector_id, (list, tuple)) and len(sector_id) > 1:
-            sector_id_str = str(tuple(sector_id))
-        else:
-            sector_id_str = f"('{sector_id[0]}')"
-
-        # Construct the SQL query
-        query = f"""
-        SELECT latitude_50, longitude_50, {kpi}
-        FROM pixel_sector
-        WHERE 
-            sector_ID IN {sector_id_str} AND 
-            scenario_optim = {scenario_optim} AND
-            ABS (scenario_traffic - {scenario_traffic}) < 0.0001 AND
-            year = {year} AND
-            geo_rsrp >= {rsrp_min} AND
-            geo_rsrp <= {rsrp_max} AND
-            geo_cqi >= {cqi_min} AND
-            geo_cqi <= {cqi_max}
-        """
-        # Execute the query and fetch data
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['latitude_50', 'longitude_50', 'kpi'])
+        # sector_id can be a single value or a list/tuple, it is bound as one array parameter
+        params = dict(sector_ids=as_list(sector_id), scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+
+        # Execute the prepared query and return the data as a DataFrame
+        df = self.fetch_query(queries.SECTOR_DATA_PIX, params, kpi=kpi, read_only=True)
 
         return df
 
     def coverage_data_pix(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi):
         """Method to fetch data from pixel_agg table based on the given parameters."""
 
-        # Construct the SQL query
-        query = f"""
-        SELECT latitude_50, longitude_50, geo_rsrp, geo_cqi, {kpi}
-        FROM pixel_agg
-        WHERE 
-            scenario_optim = {scenario_optim} AND
-            ABS (scenario_traffic - {scenario_traffic}) < 0.0001 AND
-            year = {year} AND
-            geo_rsrp >= {rsrp_min} AND
-            geo_rsrp <= {rsrp_max} AND
-            geo_cqi >= {cqi_min} AND
-            geo_cqi <= {cqi_max}
-        """
-        # Execute the query and fetch data
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi', 'kpi'])
+        params = dict(scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+
+        # Execute the prepared query and decode it straight into typed columns
+        df = self.fetch_query(queries.COVERAGE_DATA_PIX, params, kpi=kpi, read_only=True)
 
         return df
 
@@ -80,58 +108,26 @@ class db_fetcher(DBHandler):
         """Extended Method to fetch data from pixel_sector table based on the given parameters.
             includes RSRP, Traffic and CQI fields always (used in sector troubleshooting dashboard)"""
 
-        if isinstance(sector_id, (list, tuple)) and len(sector_id) > 1:
-            sector_id_str = str(tuple(sector_id))
-        else:
-            sector_id_str = f"('{sector_id[0]}')"
-
-        # Construct the SQL query
-        query = f"""
-        SELECT sector_ID, latitude_50, longitude_50, {kpi}, geo_rsrp, geo_cqi, geo_served_demand, geo_user_tput_dl, count_samples
-        FROM pixel_sector
-        WHERE 
-            sector_ID IN {sector_id_str} AND 
-            scenario_optim = {scenario_optim} AND
-            ABS (scenario_traffic - {scenario_traffic}) < 0.0001 AND
-            year = {year} AND
-            geo_rsrp >= {rsrp_min} AND
-            geo_rsrp <= {rsrp_max} AND
-            geo_cqi >= {cqi_min} AND
-            geo_cqi <= {cqi_max}
-        """
-        # Execute the query and fetch data
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['sector_id', 'latitude_50', 'longitude_50', 'kpi', 'geo_rsrp', 'geo_cqi', 'geo_served_demand', 'geo_user_tput_dl', 'count_samples'])
+        params = dict(sector_ids=as_list(sector_id), scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+
+        # Execute the prepared query and return the data as a DataFrame
+        df = self.fetch_query(queries.SECTOR_DATA_PIX_EXT, params, kpi=kpi, read_only=True)
 
         return df
 
 
     def site_data_pix_ext(self, site_id, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_optim, scenario_traffic, year, kpi):
-        """Same as sector_data_pix but works with sites as the input. Note: [Works with 1 site only so far]. it doesnt change sector granularity of the output.
+        """Same as sector_data_pix but works with sites as the input (a single site or a list of sites).
+            it doesnt change sector granularity of the output.
             it just select all sectors aligned with site_id inputs. Extended Method to fetch data from pixel_sector table based on the given parameters.
             includes RSRP, Traffic and CQI fields always (used in sector troubleshooting dashboard)"""
 
-        # Construct the SQL query
-        query = f"""
-        SELECT sector_ID, latitude_50, longitude_50, {kpi}, geo_rsrp, geo_cqi, geo_served_demand, geo_user_tput_dl, count_samples
-        FROM pixel_sector
-        WHERE 
-            site_id = '{site_id}' AND 
-            scenario_traffic = {scenario_traffic} AND
-            scenario_optim = {scenario_optim} AND           
-            year = {year} AND
-            geo_rsrp >= {rsrp_min} AND
-            geo_rsrp <= {rsrp_max} AND
-            geo_cqi >= {cqi_min} AND
-            geo_cqi <= {cqi_max}
-        """
-        # Execute the query and fetch data
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['sector_id', 'latitude_50', 'longitude_50', 'kpi', 'geo_rsrp', 'geo_cqi', 'geo_served_demand', 'geo_user_tput_dl', 'count_samples'])
+        params = dict(site_ids=as_list(site_id), scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+
+        # Execute the prepared query and return the data as a DataFrame
+        df = self.fetch_query(queries.SITE_DATA_PIX_EXT, params, kpi=kpi, read_only=True)
 
         return df
 
@@ -139,115 +135,45 @@ class db_fetcher(DBHandler):
     def compet_csp_data_pix(self, csp_name, band_category, roads, population_min, population_max, rsrp_min, rsrp_max, kpi):
         """Method to fetch competitive data from csp_details_pop table based on the given parameters."""
 
-        # Construct the SQL query
-        if roads == 0:
-            query = f"""
-            SELECT Latitude, Longitude, QOS_RSRP, population, {kpi}
-            FROM csp_details_pop
-            WHERE 
-                Connection_ServiceProviderBrandName = '{csp_name}' AND
-                band_category = '{band_category}' AND
-                population >= {population_min} AND
-                population <= {population_max} AND
-                QOS_RSRP >= {rsrp_min} AND
-                QOS_RSRP <= {rsrp_max}
-            """
-        else:
-            query = f"""
-            SELECT Latitude, Longitude, QOS_RSRP, population, {kpi}
-            FROM csp_details_pop
-            WHERE 
-                Connection_ServiceProviderBrandName = '{csp_name}' AND
-                band_category = '{band_category}' AND
-                roads_proximity = {roads} AND
-                population >= {population_min} AND
-                population <= {population_max} AND
-                QOS_RSRP >= {rsrp_min} AND
-                QOS_RSRP <= {rsrp_max}
-            """
-        # Execute the query and fetch data
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['Latitude', 'Longitude', 'QOS_RSRP', 'population', 'kpi'])
+        params = dict(csp_name=csp_name, band_category=band_category, roads=roads, population_min=population_min,
+                      population_max=population_max, rsrp_min=rsrp_min, rsrp_max=rsrp_max)
+
+        # roads == 0 means no roads_proximity filter, it is a separate statement so both variants keep their own plan
+        query_def = queries.COMPET_CSP_DATA_PIX if roads == 0 else queries.COMPET_CSP_DATA_PIX_ROADS
+        df = self.fetch_query(query_def, params, kpi=kpi, read_only=True)
 
         return df
 
     def compet_cat_data_pix(self, csp_name, band_category, cat_min, cat_max, roads, population_min, population_max, kpi):
         """Method to fetch competitive summary data from compet_cat_pop table based on the given parameters."""
 
-        # Construct the SQL query
-        if roads == 0:
-            query = f"""
-            SELECT Latitude, Longitude, population, {kpi}
-            FROM compet_cat_pop
-            WHERE
-                target_csp = '{csp_name}' AND
-                band_category = '{band_category}' AND
-                population >= {population_min} AND
-                population <= {population_max} AND
-                {kpi} >= {cat_min} AND
-                {kpi} <= {cat_max} AND
-                {kpi} > 0
-            """
-        else:
-            query = f"""
-            SELECT Latitude, Longitude, population, {kpi}
-            FROM compet_cat_pop
-            WHERE 
-                target_csp = '{csp_name}' AND
-                band_category = '{band_category}' AND
-                roads_proximity = {roads} AND
-                population >= {population_min} AND
-                population <= {population_max} AND
-                {kpi} >= {cat_min} AND
-                {kpi} <= {cat_max} AND
-                {kpi} > 0
-            """
-        # Execute the query and fetch data
-        #print(query)
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['Latitude', 'Longitude', 'population', 'kpi'])
+        params = dict(csp_name=csp_name, band_category=band_category, roads=roads, population_min=population_min,
+                      population_max=population_max, cat_min=cat_min, cat_max=cat_max)
+
+        query_def = queries.COMPET_CAT_DATA_PIX if roads == 0 else queries.COMPET_CAT_DATA_PIX_ROADS
+        df = self.fetch_query(query_def, params, kpi=kpi, read_only=True)
 
         return df
 
     def bestserver_data_pix(self, scenario_traffic, scenario_optim):
         """Method to fetch data from pixel_agg table based on the given parameters."""
 
-        # Construct the SQL query
-        query = f"""
-        SELECT latitude_50, longitude_50, best_server
-        FROM pixel_agg
-        WHERE 
-            scenario_optim = {scenario_optim} AND
-            ABS (scenario_traffic - {scenario_traffic}) < 0.0001 AND
-            year = 2
-        """
-        # Execute the query and fetch data
-        data = self.execute(query)
-
-        # Specify the column names and embed the results in a DataFrame and return
-        df = pd.DataFrame(data, columns=['latitude_50', 'longitude_50', 'best_server'])
+        # Best server map is always taken from year 2
+        df = self.fetch_query(queries.BESTSERVER_DATA_PIX, dict(scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=2),
+                              read_only=True)
 
         return df
 
-    def generate_raster(self, sector_df):
-        # Convert df_pixel to a GeoDataFrame
+    def generate_raster_array(self, sector_df):
+        """generate_raster without the file: the kpi raster as a RasterArray (array, transform, crs)."""
         # [Visualization lib]
-        geometry = gpd.points_from_xy(sector_df.longitude_50, sector_df.latitude_50)
-        gdf = gpd.GeoDataFrame(sector_df, geometry=geometry, crs="EPSG:4326")
-        gdf = gdf[gdf['kpi'].notna()]
-        gdf['kpi'] = gdf['kpi'].apply(lambda x: round(x, 2))
-        xmin, ymin, xmax, ymax = gdf.geometry.total_bounds
         res_lat = 56.0 / 111000 #raster size (TO FIX in the future, because it depends a lot on where the project is happening
-        cols = int((xmax - xmin) / res_lat)
-        rows = int((ymax - ymin) / res_lat)
+        out_array, transform = points_raster(sector_df.longitude_50, sector_df.latitude_50, sector_df['kpi'], res_lat)
+        return RasterArray(out_array, transform, RASTER_CRS)
 
-        shapes = [(geom, value) for geom, value in zip(gdf.geometry, gdf['kpi'])]
-        transform = from_origin(xmin, ymax, res_lat, res_lat)
-        out_array = rasterize(shapes=shapes, transform=transform, out_shape=(rows, cols), default_value=0)
+    def generate_raster(self, sector_df, raster_format='GTiff', overview_resampling=None):
+        # [Visualization lib]
+        out_array, transform, crs = self.generate_raster_array(sector_df)
 
         ### clearing recent files from the folder before adding new one
 
@@ -266,8 +192,8 @@ class db_fetcher(DBHandler):
         timestamp=time.time()
         raster_filename = f'sector_raster_switchoff_{timestamp}.tif'
 
-        with rasterio.open(raster_filename, 'w', driver='GTiff', height=rows, width=cols, count=1, dtype='float32',
-                           crs=gdf.crs, transform=transform, compress='deflate', tiled=True, predictor=2) as dst:
+        with rasterio.open(raster_filename, 'w', height=out_array.shape[0], width=out_array.shape[1], count=1, dtype='float32',
+                           crs=crs, transform=transform, **raster_file_options(raster_format, overview_resampling)) as dst:
             dst.write(out_array, 1)
 
         print('Raster is ready', raster_filename)
@@ -275,24 +201,13 @@ class db_fetcher(DBHandler):
 
 
 
-    def generate_raster_django_test(self, sector_df):
+    def generate_raster_django_test(self, sector_df, raster_format='GTiff', overview_resampling=None):
         # Temp copy of generate_raster function used in django test
         # It returnes both raster_as_a_file and raster_as_a_path
-        # Convert df_pixel to a GeoDataFrame
         # [Visualization lib]
 
-        geometry = gpd.points_from_xy(sector_df.longitude_50, sector_df.latitude_50)
-        gdf = gpd.GeoDataFrame(sector_df, geometry=geometry, crs="EPSG:4326")
-        gdf = gdf[gdf['kpi'].notna()]
-        gdf['kpi'] = gdf['kpi'].apply(lambda x: round(x, 2))
-        xmin, ymin, xmax, ymax = gdf.geometry.total_bounds
         res_lat = 56.0 / 111000 #raster size (TO FIX in the future, because it depends a lot on where the project is happening
-        cols = int((xmax - xmin) / res_lat)
-        rows = int((ymax - ymin) / res_lat)
-
-        shapes = [(geom, value) for geom, value in zip(gdf.geometry, gdf['kpi'])]
-        transform = from_origin(xmin, ymax, res_lat, res_lat)
-        out_array = rasterize(shapes=shapes, transform=transform, out_shape=(rows, cols), default_value=0)
+        out_array, transform = points_raster(sector_df.longitude_50, sector_df.latitude_50, sector_df['kpi'], res_lat)
 
         ### clearing recent files from the folder before adding new one
 
@@ -316,8 +231,8 @@ class db_fetcher(DBHandler):
 
 
         # Saving raster to the file in local folder
-        with rasterio.open(raster_filename, 'w', driver='GTiff', height=rows, width=cols, count=1, dtype='float32',
-                           crs=gdf.crs, transform=transform, compress='deflate', tiled=True, predictor=2) as dst:
+        with rasterio.open(raster_filename, 'w', height=out_array.shape[0], width=out_array.shape[1], count=1, dtype='float32',
+                           crs=RASTER_CRS, transform=transform, **raster_file_options(raster_format, overview_resampling)) as dst:
             dst.write(out_array, 1)
 
         # Preparing raster file object to be returned as the output of the function
@@ -328,22 +243,11 @@ class db_fetcher(DBHandler):
 
 
 
-    def generate_raster_compet(self, sector_df):
+    def generate_raster_compet(self, sector_df, raster_format='GTiff', overview_resampling=None):
         #this method creates a raster for competitive data visualization (300m)
-        # Convert df_pixel to a GeoDataFrame
         # [Geospatial]
-        geometry = gpd.points_from_xy(sector_df.Longitude, sector_df.Latitude)
-        gdf = gpd.GeoDataFrame(sector_df, geometry=geometry, crs="EPSG:4326")
-        gdf = gdf[gdf['kpi'].notna()]
-        gdf['kpi'] = gdf['kpi'].apply(lambda x: round(x, 2))
-        xmin, ymin, xmax, ymax = gdf.geometry.total_bounds
         res_lat = 315.0 / 111000 #raster size (TO FIX in the future, because it depends a lot on where the project is happening
-        cols = int((xmax - xmin) / res_lat)
-        rows = int((ymax - ymin) / res_lat)
-
-        shapes = [(geom, value) for geom, value in zip(gdf.geometry, gdf['kpi'])]
-        transform = from_origin(xmin, ymax, res_lat, res_lat)
-        out_array = rasterize(shapes=shapes, transform=transform, out_shape=(rows, cols), default_value=0)
+        out_array, transform = points_raster(sector_df.Longitude, sector_df.Latitude, sector_df['kpi'], res_lat)
 
         ### clearing recent files from the folder before adding new one
         files_compet = glob.glob('data/temp_rasters/compet_raster*.tif') + glob.glob('temp_rasters/compet_raster*.xml')
@@ -357,8 +261,8 @@ class db_fetcher(DBHandler):
         timestamp=time.time()
         raster_filename = f'data/temp_rasters/compet_raster{timestamp}.tif'
         
-        with rasterio.open(raster_filename, 'w', driver='GTiff', height=rows, width=cols, count=1, dtype='float32',
-                           crs=gdf.crs, transform=transform, compress='deflate', tiled=True, predictor=2) as dst:
+        with rasterio.open(raster_filename, 'w', height=out_array.shape[0], width=out_array.shape[1], count=1, dtype='float32',
+                           crs=RASTER_CRS, transform=transform, **raster_file_options(raster_format, overview_resampling)) as dst:
             dst.write(out_array, 1)
 
         #print('Raster is ready', raster_filename)
@@ -0,0 +1,75 @@
+#Release history
+#18.10.2026: async variant of db_fetcher on AsyncDBHandler (psycopg 3), raster generation runs in a worker thread
+#18.10.2026: generate_raster_array (in-memory raster)
+#18.10.2026: generate_raster* pass the output format options (raster_format, overview_resampling) through
+
+
+from modules.db_handler_async import AsyncDBHandler
+from modules.db_fetcher_geo import db_fetcher
+from modules import db_queries as queries
+from modules.db_queries import as_list
+
+import asyncio
+
+
+class db_fetcher_async(AsyncDBHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)  # Initializing the base class
+
+    async def sector_data_pix(self, sector_id, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_optim, scenario_traffic, year, kpi):
+        """Async db_fetcher.sector_data_pix"""
+        params = dict(sector_ids=as_list(sector_id), scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+        return await self.fetch_query(queries.SECTOR_DATA_PIX, params, kpi=kpi)
+
+    async def coverage_data_pix(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi):
+        """Async db_fetcher.coverage_data_pix"""
+        params = dict(scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+        return await self.fetch_query(queries.COVERAGE_DATA_PIX, params, kpi=kpi)
+
+    async def sector_data_pix_ext(self, sector_id, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_optim, scenario_traffic, year, kpi):
+        """Async db_fetcher.sector_data_pix_ext"""
+        params = dict(sector_ids=as_list(sector_id), scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+        return await self.fetch_query(queries.SECTOR_DATA_PIX_EXT, params, kpi=kpi)
+
+    async def site_data_pix_ext(self, site_id, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_optim, scenario_traffic, year, kpi):
+        """Async db_fetcher.site_data_pix_ext"""
+        params = dict(site_ids=as_list(site_id), scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+        return await self.fetch_query(queries.SITE_DATA_PIX_EXT, params, kpi=kpi)
+
+    async def compet_csp_data_pix(self, csp_name, band_category, roads, population_min, population_max, rsrp_min, rsrp_max, kpi):
+        """Async db_fetcher.compet_csp_data_pix"""
+        params = dict(csp_name=csp_name, band_category=band_category, roads=roads, population_min=population_min,
+                      population_max=population_max, rsrp_min=rsrp_min, rsrp_max=rsrp_max)
+        query_def = queries.COMPET_CSP_DATA_PIX if roads == 0 else queries.COMPET_CSP_DATA_PIX_ROADS
+        return await self.fetch_query(query_def, params, kpi=kpi)
+
+    async def compet_cat_data_pix(self, csp_name, band_category, cat_min, cat_max, roads, population_min, population_max, kpi):
+        """Async db_fetcher.compet_cat_data_pix"""
+        params = dict(csp_name=csp_name, band_category=band_category, roads=roads, population_min=population_min,
+                      population_max=population_max, cat_min=cat_min, cat_max=cat_max)
+        query_def = queries.COMPET_CAT_DATA_PIX if roads == 0 else queries.COMPET_CAT_DATA_PIX_ROADS
+        return await self.fetch_query(query_def, params, kpi=kpi)
+
+    async def bestserver_data_pix(self, scenario_traffic, scenario_optim):
+        """Async db_fetcher.bestserver_data_pix"""
+        # Best server map is always taken from year 2
+        return await self.fetch_query(queries.BESTSERVER_DATA_PIX, dict(scenario_optim=scenario_optim, scenario_traffic=scenario_traffic, year=2))
+
+    # Raster generation is CPU and file bound: the db_fetcher implementation runs in a worker thread
+    # so the event loop keeps serving other requests meanwhile
+
+    async def generate_raster_array(self, sector_df):
+        return await asyncio.to_thread(db_fetcher.generate_raster_array, self, sector_df)
+
+    async def generate_raster(self, sector_df, **kwargs):
+        return await asyncio.to_thread(db_fetcher.generate_raster, self, sector_df, **kwargs)
+
+    async def generate_raster_django_test(self, sector_df, **kwargs):
+        return await asyncio.to_thread(db_fetcher.generate_raster_django_test, self, sector_df, **kwargs)
+
+    async def generate_raster_compet(self, sector_df, **kwargs):
+        return await asyncio.to_thread(db_fetcher.generate_raster_compet, self, sector_df, **kwargs)
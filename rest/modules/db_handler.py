@@ -1,76 +1,673 @@
-#Version 0.15
+#Version 0.20
 #Change log:
 #30.01.2024 Execute function adjustent to eliminate 'idle in transaction' issues in postgres
 #15.02.2024 df_to_sql method added for dataframes uploading to SQL
+#18.10.2026 Process-wide connection pool (ConnectionPool/get_pool), DBHandler(pooled=True) checks connections out and close() returns them
+#18.10.2026 df_to_sql: COPY FROM STDIN bulk load (text/binary), cached engine per DSN, staging-then-swap mode
+#18.10.2026 fetch_df: server-side cursor fetch decoded batch by batch into typed NumPy columns
+#18.10.2026 fetch_query: modules.db_queries definitions PREPAREd once per connection and EXECUTEd with bound parameters
+#18.10.2026 DBHandler(cache=True): versioned result cache for fetch_df/fetch_query, df_to_sql/drop_table bump table versions
+#18.10.2026 df_to_sql COPY modes: if_exists='replace' truncates a partitioned table instead of dropping it
+#18.10.2026 Read replicas: read-only execute/fetch/fetch_df/fetch_query go round-robin to read_hosts with failover, writes stay on the primary
+#18.10.2026 statement_timeout per handler and request deadline (modules.deadline): statements are capped and cancelled when it passes
+#18.10.2026 sibling(): handler with the same settings on its own connection, for fetches running in parallel threads
+#18.10.2026 sibling(**settings): keyword overrides of the copied settings (switch-off store loaders use cache=False)
+#18.10.2026 Read replicas are opt-in: only fetch_df/fetch_query(read_only=True) go to read_hosts, execute/fetch and admin helpers stay on the primary
+#18.10.2026 Results read from a replica are not put in the result cache (it is versioned by the primary's writes)
+#18.10.2026 df_to_sql method='multi': if_exists='replace' truncates a partitioned table as the COPY modes do
 
 import psycopg2
-from psycopg2 import OperationalError
+from psycopg2 import OperationalError, InterfaceError, sql
+from psycopg2.errors import InvalidSqlStatementName, QueryCanceled
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+import io
+import itertools
+import os
+import re
+import struct
+import threading
 import traceback
 import time
+import numpy as np
 import pandas as pd
-from sqlalchemy.orm import sessionmaker  # for df_to_sql method
 from sqlalchemy import create_engine  # for df_to_sql method
+from sqlalchemy.engine import URL
+
+from modules.db_cache import get_cache, query_tables, NOTIFY_CHANNEL
+from modules.deadline import DeadlineExceeded
+
+
+# Pool sizing is per process (i.e. per gunicorn worker): workers * POOL_MAXCONN must stay below max_connections
+POOL_MAXCONN = int(os.environ.get('IPRISM_DB_POOL_MAX', 8))
+POOL_TIMEOUT = float(os.environ.get('IPRISM_DB_POOL_TIMEOUT', 30))  # seconds to wait for a free connection
+POOL_HEALTH_CHECK_AFTER = float(os.environ.get('IPRISM_DB_POOL_HEALTH_CHECK', 30))  # idle seconds before a checkout is pinged
+
+# Rows per round trip of the server-side cursor used by fetch_df
+FETCH_ITERSIZE = int(os.environ.get('IPRISM_DB_FETCH_ITERSIZE', 50000))
+
+# Read replicas (host or host:port, comma separated) used by every DBHandler that is not given read_hosts, for the
+# fetch_df / fetch_query calls made with read_only=True.
+# Replicas that fail are skipped for REPLICA_RETRY_AFTER seconds, when none is left reads go to the primary.
+READ_HOSTS = os.environ.get('IPRISM_DB_READ_HOSTS', '')
+REPLICA_RETRY_AFTER = float(os.environ.get('IPRISM_DB_REPLICA_RETRY_AFTER', 30))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('IPRISM_DB_REPLICA_CONNECT_TIMEOUT', 3))
+
+# NUMERIC columns decoded straight to float instead of Decimal (registered per fetch_df cursor only)
+_NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, 'NUMERIC_AS_FLOAT', lambda value, cursor: float(value) if value is not None else None)
+_cursor_names = itertools.count()
+
+
+class IPrismConnection(psycopg2.extensions.connection):
+    """psycopg2 connection remembering which statements are PREPAREd on its server session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def connect(host, port, user, password, dbname, **options):
+    """Open a psycopg2 connection, creating the database first if it does not exist (options go to libpq)."""
+    try:
+        return psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname,
+                                connection_factory=IPrismConnection, **options)
+    except OperationalError as e:
+        if dbname and "does not exist" in str(e):
+            # If database doesn't exist, connect to default DB and create the new one
+            connection = psycopg2.connect(
+                host=host,
+                port=port,
+                user=user,
+                password=password,
+                dbname="postgres"  # default database
+            )
+            connection.autocommit = True  # Required for executing CREATE DATABASE
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE DATABASE {dbname};")
+            connection.close()
+
+            # Reconnect to the new database
+            return psycopg2.connect(host=host, port=port, user=user, password=password, dbname=dbname,
+                                    connection_factory=IPrismConnection, **options)
+        raise e
+
+
+class ColumnDecoder:
+    """Collects batches of result rows as one NumPy array per column and assembles the DataFrame at the end."""
+
+    def __init__(self, names, dtypes):
+        self.names = names
+        self.dtypes = dtypes
+        self.column_dtypes = [dtypes.get(name, object) for name in names]
+        self.batches = [[] for _ in names]
+
+    def add(self, rows):
+        for values, dtype, batch in zip(zip(*rows), self.column_dtypes, self.batches):
+            batch.append(np.asarray(values, dtype=dtype))
+
+    def frame(self):
+        data = {}
+        for name, dtype, batch in zip(self.names, self.column_dtypes, self.batches):
+            values = np.concatenate(batch) if batch else np.empty(0, dtype=dtype)
+            data[name] = values if name in self.dtypes else pd.Series(values).infer_objects()
+        return pd.DataFrame(data, copy=False)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections to one database.
+
+    Connections are opened lazily up to maxconn. A connection that was idle for longer than
+    health_check_after seconds is pinged with SELECT 1 on checkout and transparently replaced
+    if the server dropped it. Returned connections are rolled back so they never stay 'idle in transaction'.
+    """
+
+    def __init__(self, connect_kwargs, maxconn=POOL_MAXCONN, timeout=POOL_TIMEOUT,
+                 health_check_after=POOL_HEALTH_CHECK_AFTER):
+        self.connect_kwargs = connect_kwargs
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._idle = []  # (connection, returned_at) pairs, most recently returned last
+        self._size = 0  # connections currently open, idle or checked out
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _open(self):
+        return connect(**self.connect_kwargs)
+
+    def _is_healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except (OperationalError, InterfaceError):
+            return False
+
+    def getconn(self, timeout=None):
+        """Check a connection out, waiting up to timeout seconds (pool default) for a free slot."""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    connection, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    connection, returned_at = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(f"No free connection to {self.connect_kwargs['dbname']!r} after {self.timeout}s "
+                                      f"(maxconn={self.maxconn})")
+                self._cond.wait(remaining)
+
+        # Opening and pinging happen outside the lock, the slot is already reserved for us
+        if connection is not None and self._is_healthy(connection, returned_at):
+            return connection
+        if connection is not None:
+            self._close_quietly(connection)
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, connection, discard=False):
+        """Return a checked out connection. Broken or discarded connections free their slot."""
+        if not discard and not connection.closed:
+            try:
+                if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                if connection.autocommit:
+                    connection.autocommit = False
+            except (OperationalError, InterfaceError):
+                discard = True
+
+        with self._cond:
+            if discard or connection.closed or self._closed:
+                self._size -= 1
+                self._close_quietly(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """Close idle connections and refuse further checkouts."""
+        with self._cond:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._close_quietly(connection)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def get_pool(host, port, user, password, dbname, connect_timeout=None, **pool_kwargs):
+    """Return the process-wide pool for the given DSN, creating it on first use."""
+    global _pools_pid
+    key = (host, int(port), user, password, dbname, connect_timeout)
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # We are in a forked worker: never reuse the parent's sockets
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            connect_kwargs = dict(host=host, port=port, user=user, password=password, dbname=dbname)
+            if connect_timeout is not None:
+                connect_kwargs['connect_timeout'] = connect_timeout
+            pool = ConnectionPool(connect_kwargs, **pool_kwargs)
+            _pools[key] = pool
+        return pool
+
+
+def parse_hosts(hosts, default_port=5432):
+    """'replica1,replica2:5433' or a list of such entries -> [(host, port), ...]"""
+    if isinstance(hosts, str):
+        hosts = hosts.split(',')
+    parsed = []
+    for entry in hosts or []:
+        if isinstance(entry, (tuple, list)):
+            parsed.append((entry[0], int(entry[1])))
+            continue
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.rpartition(':')
+        if not host or not port.isdigit():
+            host, port = entry, default_port
+        parsed.append((host, int(port)))
+    return parsed
+
+
+class ReplicaSet:
+    """Round-robin order over read replicas, skipping the ones that failed in the last REPLICA_RETRY_AFTER seconds."""
+
+    def __init__(self, hosts, retry_after=REPLICA_RETRY_AFTER):
+        self.hosts = hosts
+        self.retry_after = retry_after
+        self._next = itertools.count()
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        with self._lock:
+            start = next(self._next) % len(self.hosts)
+            now = time.monotonic()
+            ordered = self.hosts[start:] + self.hosts[:start]
+            return [host for host in ordered if self._down_until.get(host, 0) <= now]
+
+    def mark_down(self, host):
+        with self._lock:
+            self._down_until[host] = time.monotonic() + self.retry_after
+
+
+_replica_sets = {}
+_replica_sets_lock = threading.Lock()
+
+
+def get_replica_set(hosts):
+    """Process-wide ReplicaSet for the given [(host, port), ...], so round-robin and failures are shared by all handlers."""
+    key = tuple(hosts)
+    with _replica_sets_lock:
+        replicas = _replica_sets.get(key)
+        if replicas is None:
+            replicas = _replica_sets[key] = ReplicaSet(list(hosts))
+        return replicas
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(url):
+    """Return the process-wide SQLAlchemy engine for url (engines own their own connection pool)."""
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            engine = _engines[url] = create_engine(url)
+        return engine
+
+
+# COPY BINARY field layout per target column type (big-endian, see PostgreSQL COPY docs "Binary Format")
+_PGCOPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_PGCOPY_TRAILER = struct.pack('>h', -1)
+_PGCOPY_FIXED_TYPES = {
+    'double precision': '>f8',
+    'real': '>f4',
+    'bigint': '>i8',
+    'integer': '>i4',
+    'smallint': '>i2',
+    'boolean': '|b1',
+}
+_PGCOPY_TEXT_TYPES = ('text', 'character varying', 'character')
+
+
+def _pgcopy_binary(frame, pg_types):
+    """
+    Encode a DataFrame as one COPY ... (FORMAT binary) stream.
+
+    The whole chunk is laid out with NumPy scatter writes, no per-row Python objects are created
+    for numeric columns. pg_types lists the target column types in frame column order.
+    """
+    n_rows = len(frame)
+    columns = []  # (lengths int64 with -1 for NULL, payload uint8 array of the non-null values)
+    for name, pg_type in zip(frame.columns, pg_types):
+        col = frame[name]
+        is_null = col.isna().to_numpy()
+        base_type = pg_type.split('(')[0]
+        if base_type in _PGCOPY_FIXED_TYPES:
+            dtype = np.dtype(_PGCOPY_FIXED_TYPES[base_type])
+            if dtype.kind == 'b':
+                values = col.to_numpy(dtype=bool, na_value=False)
+            else:
+                values = col.to_numpy(dtype=dtype.newbyteorder('='), na_value=0).astype(dtype)
+            lengths = np.where(is_null, -1, dtype.itemsize)
+            payload = values[~is_null].view(np.uint8)
+        elif base_type in _PGCOPY_TEXT_TYPES:
+            encoded = [None if null else str(value).encode('utf-8') for value, null in zip(col.to_numpy(), is_null)]
+            lengths = np.array([-1 if b is None else len(b) for b in encoded], dtype=np.int64)
+            payload = np.frombuffer(b''.join(b for b in encoded if b is not None), dtype=np.uint8)
+        else:
+            raise ValueError(f"Column {name!r} of type {pg_type!r} is not supported by binary COPY, use method='copy'")
+        columns.append((lengths, payload))
+
+    # Row layout: int16 field count, then per field int32 length + data (no data for NULL)
+    field_sizes = [4 + np.maximum(lengths, 0) for lengths, _ in columns]
+    row_sizes = 2 + np.sum(field_sizes, axis=0) if field_sizes else np.full(n_rows, 2)
+    row_starts = np.zeros(n_rows, dtype=np.int64)
+    np.cumsum(row_sizes[:-1], out=row_starts[1:])
+    body = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+
+    def scatter(starts, chunk_bytes, width):
+        # Write width bytes per row at arbitrary (unaligned) offsets
+        body[starts[:, None] + np.arange(width)] = chunk_bytes.reshape(-1, width)
+
+    scatter(row_starts, np.full(n_rows, len(columns), dtype='>i2').view(np.uint8), 2)
+    field_starts = row_starts + 2
+    for (lengths, payload), size in zip(columns, field_sizes):
+        scatter(field_starts, lengths.astype('>i4').view(np.uint8), 4)
+        present = lengths > 0
+        data_lengths = lengths[present]
+        if data_lengths.size:
+            data_starts = field_starts[present] + 4
+            # Position of every payload byte: its field start plus its offset inside the value
+            offsets = np.arange(payload.size) - np.repeat(np.cumsum(data_lengths) - data_lengths, data_lengths)
+            body[np.repeat(data_starts, data_lengths) + offsets] = payload
+        field_starts = field_starts + size
+
+    return _PGCOPY_SIGNATURE + body.tobytes() + _PGCOPY_TRAILER
+
 
 class DBHandler:
 
-    def __init__(self, host="iprism-postgres", port=5432, user="postgres", password="smacap", dbname=""):
+    def __init__(self, host="iprism-postgres", port=5432, user="postgres", password="smacap", dbname="", pooled=False, cache=False,
+                 read_hosts=None, statement_timeout=None, deadline=None):
         # Storing the parameters as instance attributes
         self.host = host
         self.port = port
         self.user = user
         self.password = password
         self.dbname = dbname
-        
-        try:
-            self.connection = psycopg2.connect(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                dbname=self.dbname
-            )
-        except OperationalError as e:
-            if "does not exist" in str(e):
-                # If database doesn't exist, connect to default DB and create the new one
-                self.connection = psycopg2.connect(
-                    host=self.host,
-                    port=self.port,
-                    user=self.user,
-                    password=self.password,
-                    dbname="postgres"  # default database
-                )
-                self.connection.autocommit = True  # Required for executing CREATE DATABASE
-                with self.connection.cursor() as cursor:
-                    cursor.execute(f"CREATE DATABASE {self.dbname};")
-                self.connection.close()
-
-                # Reconnect to the new database
-                self.connection = psycopg2.connect(
-                    host=self.host,
-                    port=self.port,
-                    user=self.user,
-                    password=self.password,
-                    dbname=self.dbname
-                )
-            else:
-                raise e
 
+        # pooled=True checks a connection out of the process-wide pool, close() hands it back
+        self.pool = get_pool(host, port, user, password, dbname) if pooled else None
+        self.connection = self._acquire()
         self.cursor = self.connection.cursor()
-        
+
+        # cache=True serves repeated fetch_df/fetch_query results from the process-wide result cache
+        self.cache = get_cache(host, port, user, password, dbname) if cache else None
+
+        # read_hosts (default IPRISM_DB_READ_HOSTS): fetch_df / fetch_query with read_only=True go to these replicas,
+        # see _read()
+        self.read_hosts = read_hosts
+        replica_hosts = parse_hosts(READ_HOSTS if read_hosts is None else read_hosts, port)
+        self.replicas = get_replica_set(replica_hosts) if replica_hosts else None
+        self.primary_only = False  # set after the first write, so the handler reads its own writes
+
+        # statement_timeout (seconds) caps every statement, deadline (modules.deadline.Deadline) is the budget
+        # of the whole request: statements get at most its remaining time and are cancelled when it passes
+        self.statement_timeout = statement_timeout
+        self.deadline = deadline
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def sibling(self, **settings):
+        """
+        New handler of the same class and settings (database, pooling, cache, replicas, timeouts, deadline) on its own
+        connection: a psycopg2 connection runs one statement at a time, a fetch running in another thread needs its own.
+        settings override the copied ones, e.g. sibling(cache=False).
+        """
+        kwargs = dict(pooled=self.pool is not None, cache=self.cache is not None, read_hosts=self.read_hosts,
+                      statement_timeout=self.statement_timeout, deadline=self.deadline)
+        kwargs.update(settings)
+        return type(self)(self.host, self.port, self.user, self.password, self.dbname, **kwargs)
+
+    def _acquire(self):
+        if self.pool is not None:
+            return self.pool.getconn()
+        return connect(self.host, self.port, self.user, self.password, self.dbname)
+
     def fetch(self, query):
         """Predefined fetch operation."""
         try:
-            with self.connection.cursor() as cursor:
+            return self._on_primary(self._guarded(lambda connection: self._fetch(connection, query)))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"Error: {e}")
+
+    @staticmethod
+    def _fetch(connection, query):
+        try:
+            with connection.cursor() as cursor:
                 cursor.execute(query)
                 return cursor.fetchall()
-        except Exception as e:
-                print(f"Error: {e}")
-                db_engine.rollback()
-    
+        finally:
+            if not connection.closed:
+                connection.rollback()
+
     def execute(self, query, column_names=False, params=None):
-        """Custom query execution with error handling, commit and rollback."""
+        """Custom query execution with error handling, commit and rollback. Always runs on the primary."""
+        self.primary_only = True
+        return self._on_primary(self._guarded(lambda connection: self._execute(query, column_names, params, connection)), retry=False)
+
+    def check_deadline(self, stage=''):
+        """Raise DeadlineExceeded if this handler's request deadline passed (no-op without a deadline)."""
+        if self.deadline is not None:
+            self.deadline.check(stage)
+
+    def _guarded(self, run):
+        # SET LOCAL statement_timeout for the transaction run() works in and, with a deadline, cancel the
+        # running statement from the deadline's watchdog when the request runs out of time
+        if self.statement_timeout is None and self.deadline is None:
+            return run
+
+        def guarded(connection):
+            self.check_deadline()
+            timeouts = [t for t in (self.statement_timeout, self.deadline and self.deadline.remaining()) if t is not None]
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = %s", (max(1, int(min(timeouts) * 1000)),))
+            if self.deadline is None:
+                return run(connection)
+            with self.deadline.watch(connection):
+                try:
+                    return run(connection)
+                except QueryCanceled as e:
+                    if self.deadline.expired():
+                        raise DeadlineExceeded(f"Query cancelled, request {self.deadline.reason or 'deadline exceeded'}") from e
+                    raise
+        return guarded
+
+    def _on_primary(self, run, retry=True):
+        if self.connection.closed:
+            self.reconnect()
+        try:
+            return run(self.connection)
+        except (OperationalError, InterfaceError):
+            # Server dropped the connection (restart, idle kill): reconnect and retry reads once
+            if not self.connection.closed or not retry:
+                raise
+            print("Connection lost, reconnecting")
+            self.reconnect()
+            return run(self.connection)
+
+    def _select(self, run, read_only, served=None):
+        # Replicas are opt-in: whether a statement has side effects is not decided from its text (volatile functions)
+        if read_only:
+            return self._read(run, served)
+        return self._on_primary(self._guarded(run))
+
+    def _read(self, run, served=None):
+        """
+        Run run(connection) for a read-only statement: on the next replica in round-robin order, failing over
+        to the following ones, and on the primary when there are no (healthy) replicas or this handler has executed
+        a statement (it reads its own writes).
+        Replica connections are checked out of their process-wide pools for the one statement only.
+        served (list or None) gets the (host, port) of the replica that answered, nothing when the primary did.
+        """
+        run = self._guarded(run)
+        if self.replicas is None or self.primary_only:
+            return self._on_primary(run)
+        for host, port in self.replicas.candidates():
+            pool = get_pool(host, port, self.user, self.password, self.dbname, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+            try:
+                connection = pool.getconn()
+            except (OperationalError, PoolTimeout) as e:
+                print(f"Read replica {host}:{port} unavailable ({e}), trying the next one")
+                self.replicas.mark_down((host, port))
+                continue
+            lost = False
+            try:
+                result = run(connection)
+                if served is not None:
+                    served.append((host, port))
+                return result
+            except (psycopg2.DatabaseError, InterfaceError) as e:
+                # Lost replica (no SQLSTATE: the error did not come from the server), or a query cancelled
+                # by the replica (e.g. conflict with recovery): next one
+                lost = bool(connection.closed) or getattr(e, 'pgcode', None) is None
+                if lost:
+                    self.replicas.mark_down((host, port))
+                elif isinstance(e, QueryCanceled) or not isinstance(e, OperationalError):
+                    raise  # statement_timeout / cancel: another host would not do better
+                print(f"Read on replica {host}:{port} failed ({e}), trying the next one")
+            finally:
+                pool.putconn(connection, discard=lost or bool(connection.closed))
+        print("No read replica available, reading from the primary")
+        return self._on_primary(run)
+
+    def fetch_df(self, query, params=None, columns=None, dtypes=None, itersize=FETCH_ITERSIZE, read_only=False):
+        """
+        Run a SELECT through a named server-side cursor and return a DataFrame with typed columns.
+
+        Rows arrive itersize at a time and every batch is decoded into one NumPy array per column right away,
+        so only one batch of Python tuples is alive at any moment and NUMERIC values never become Decimal.
+
+        Parameters:
+        - query (str): SELECT statement, optionally with %s / %(name)s placeholders.
+        - params (tuple, dict or None): Query parameters.
+        - columns (list or None): Output column names, defaults to the names returned by the server.
+        - dtypes (dict or None): Output column name -> NumPy dtype (e.g. 'float32', 'float64', 'int32').
+          Float columns map NULL to NaN, integer columns must not contain NULLs.
+          Columns without a dtype are inferred (numbers become int64/float64, text stays object).
+        - itersize (int): Rows fetched per round trip.
+        - read_only (bool): The query has no side effect and may run on a read replica (read_hosts).
+        """
+        return self._cached(query, (params, columns, dtypes), query_tables(query),
+                            lambda connection: self._fetch_df(connection, query, params, columns, dtypes, itersize), read_only)
+
+    def _fetch_df(self, connection, query, params, columns, dtypes, itersize):
+        try:
+            with connection.cursor(name=f"iprism_fetch_{next(_cursor_names)}") as cursor:
+                psycopg2.extensions.register_type(_NUMERIC_AS_FLOAT, cursor)
+                cursor.itersize = itersize
+                cursor.execute(query, params)
+                return self._decode_rows(cursor, columns, dtypes or {}, itersize)
+        except Exception as e:
+            error_message = traceback.format_exc()
+            print(f"An error occurred: {e}\n{error_message}")
+            raise e
+        finally:
+            if not connection.closed:
+                connection.rollback()  # Close transaction (and the server-side cursor)
+
+    def fetch_query(self, query_def, params, itersize=FETCH_ITERSIZE, read_only=False, **identifiers):
+        """
+        Fetch a modules.db_queries.QueryDef as a DataFrame (columns and dtypes come from the definition).
+
+        The statement is PREPAREd the first time it runs on a connection, afterwards only EXECUTE with the
+        bound parameters is sent, so Postgres skips parsing and (once it settles on a generic plan) planning.
+        identifiers fill the {placeholders} of the definition and are validated against its whitelists.
+        read_only=True lets the statement run on a read replica (read_hosts), the default is the primary.
+        """
+        rendered = query_def.render(**identifiers)
+        values = rendered.values(params)
+        return self._cached(rendered.text, values, query_def.tables,
+                            lambda connection: self._fetch_prepared(connection, rendered, values, itersize), read_only)
+
+    def _fetch_prepared(self, connection, rendered, values, itersize):
+        query_def = rendered.query_def
+        for attempt in (1, 2):
+            try:
+                with connection.cursor() as cursor:
+                    psycopg2.extensions.register_type(_NUMERIC_AS_FLOAT, cursor)
+                    if rendered.name not in connection.prepared:
+                        cursor.execute(rendered.prepare_sql)
+                        connection.prepared.add(rendered.name)
+                    cursor.execute(rendered.execute_sql, values)
+                    return self._decode_rows(cursor, query_def.columns, query_def.dtypes, itersize)
+            except InvalidSqlStatementName:
+                # Session state was reset under us (e.g. DISCARD ALL): prepare again once
+                connection.rollback()
+                connection.prepared.discard(rendered.name)
+                if attempt == 2:
+                    raise
+            except Exception as e:
+                error_message = traceback.format_exc()
+                print(f"An error occurred: {e}\n{error_message}")
+                raise e
+            finally:
+                if not connection.closed:
+                    connection.rollback()  # Close transaction for SELECT queries
+
+    def _cached(self, query, params, tables, run, read_only):
+        # Versions are read before the query runs, so a write that lands meanwhile keeps the result out of the cache.
+        # They are the primary's: a result served by a replica, which may lag behind them, is returned but not cached
+        if self.cache is None:
+            return self._select(run, read_only)
+        key = self.cache.key(query, params)
+        frame = self.cache.get(key, tables)
+        if frame is None:
+            versions = self.cache.versions(tables)
+            served = []
+            frame = self._select(run, read_only, served)
+            if not served:
+                self.cache.put(key, tables, versions, frame)
+        return frame
+
+    def table_changed(self, table_name):
+        """Invalidate cached results that read table_name, in this process and (via NOTIFY) in every other one."""
+        self.primary_only = True
+        cache = get_cache(self.host, self.port, self.user, self.password, self.dbname, create=False)
+        if cache is not None:
+            cache.bump(table_name)
         try:
             with self.connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, table_name))
+            self.connection.commit()
+        except Exception as e:
+            print(f"Could not notify change of table {table_name}: {e}")
+            self.connection.rollback()
+
+    @staticmethod
+    def _decode_rows(cursor, columns, dtypes, itersize):
+        # Decode itersize rows at a time into one NumPy array per column
+        decoder = None
+        while True:
+            rows = cursor.fetchmany(itersize)
+            if decoder is None:
+                decoder = ColumnDecoder(columns or [desc[0] for desc in cursor.description], dtypes)
+            if not rows:
+                break
+            decoder.add(rows)
+        return decoder.frame()
+
+    def _execute(self, query, column_names=False, params=None, connection=None):
+        connection = connection or self.connection
+        try:
+            with connection.cursor() as cursor:
                 # Check if params is a list of tuples for bulk insert
                 if params and isinstance(params, list) and all(isinstance(p, tuple) for p in params):
                     cursor.executemany(query, params)
@@ -90,53 +687,150 @@ class DBHandler:
                         return cursor.fetchall()
     
         except Exception as e:
-            self.connection.rollback()
+            if not connection.closed:
+                connection.rollback()
             error_message = traceback.format_exc()
             print(f"An error occurred: {e}\n{error_message}")
             raise e
 
         else:
-            self.connection.commit()  # Only commit if there's no error
+            connection.commit()  # Only commit if there's no error
 
         finally:
-            if query.strip().lower().startswith("select"):
-                self.connection.rollback()  # Close transaction for SELECT queries
+            if query.strip().lower().startswith("select") and not connection.closed:
+                connection.rollback()  # Close transaction for SELECT queries
 
 
-    def df_to_sql(self, dataframe, table_name, if_exists='replace', index=False, chunksize=None):
+    def engine(self):
+        """SQLAlchemy engine for this handler's database, cached per DSN."""
+        if str(self.host).startswith('/'):
+            # Unix socket directory goes into the query string, as libpq expects
+            url = URL.create('postgresql', username=self.user, password=self.password, database=self.dbname,
+                             query={'host': self.host, 'port': str(self.port)})
+        else:
+            url = URL.create('postgresql', username=self.user, password=self.password, host=self.host,
+                             port=self.port, database=self.dbname)
+        return get_engine(url.render_as_string(hide_password=False))
+
+    def df_to_sql(self, dataframe, table_name, if_exists='replace', index=False, chunksize=None, method='multi', swap=False):
         """
-        Uploads a DataFrame to the specified SQL table using the to_sql method.
+        Uploads a DataFrame to the specified SQL table.
 
         Parameters:
         - dataframe (pd.DataFrame): The DataFrame to upload.
         - table_name (str): The name of the target SQL table.
-        - if_exists (str): What to do if the table already exists.
+        - if_exists (str): What to do if the table already exists. 'replace' truncates a partitioned table
+          instead of dropping it (every method).
         - index (bool): Whether to write the DataFrame's index as a column.
         - chunksize (int or None): Specifies the number of rows in each batch to be written at a time.
+        - method (str): 'multi' uses pandas to_sql with multi-row INSERTs, 'copy' streams CSV through
+          COPY FROM STDIN and 'copy_binary' streams the binary COPY format (fastest for numeric tables).
+        - swap (bool): COPY modes only. Load into <table_name>__staging, rebuild the target's indexes on it
+          and swap it in with a rename, so readers see the old table until the new one is complete.
         """
-        try:
-            # SQLAlchemy engine
-            engine_url = f'postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.dbname}'
-            engine = create_engine(engine_url)
-            Session = sessionmaker(bind=engine)
-            session = Session()
+        if method in ('copy', 'copy_binary'):
+            try:
+                self._copy_from_dataframe(dataframe, table_name, if_exists, index, chunksize, method == 'copy_binary', swap)
+                self.table_changed(table_name)
+                print(f'DataFrame uploaded to table {table_name} successfully.')
+            except Exception as e:
+                if not self.connection.closed:
+                    self.connection.rollback()
+                error_message = traceback.format_exc()
+                print(f"An error occurred: {e}\n{error_message}")
+            return
 
+        try:
             # Begin transaction
-            with engine.begin() as connection:
+            with self.engine().begin() as connection:
+                relkind = connection.exec_driver_sql("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)",
+                                                     (table_name,)).scalar()
+                if relkind == 'p' and if_exists == 'replace':
+                    # Partitioned table: keep it (partitions, indexes, dependent views) like the COPY modes do
+                    connection.exec_driver_sql(f"TRUNCATE {connection.dialect.identifier_preparer.quote(table_name)}")
+                    if_exists = 'append'
                 # Upload DataFrame to SQL within a transaction
-                dataframe.to_sql(table_name, connection, if_exists=if_exists, index=index, chunksize=chunksize, method='multi')
-            
-            # Commit transaction and close session
-            session.commit()
-            session.close()
+                dataframe.to_sql(table_name, connection, if_exists=if_exists, index=index, chunksize=chunksize, method=method)
+            self.table_changed(table_name)
             print(f'DataFrame uploaded to table {table_name} successfully.')
 
         except Exception as e:
-            session.rollback()  # Rollback in case of error
-            session.close()
             error_message = traceback.format_exc()
             print(f"An error occurred: {e}\n{error_message}")
-    
+
+    def _copy_from_dataframe(self, dataframe, table_name, if_exists, index, chunksize, binary, swap):
+        if index:
+            dataframe = dataframe.reset_index()
+        chunksize = chunksize or 100000
+        target = f"{table_name}__staging" if swap else table_name
+
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table_name,))
+            relkind = cursor.fetchone()
+            exists = relkind is not None
+            partitioned = exists and relkind[0] == 'p'
+            if exists and if_exists == 'fail':
+                raise ValueError(f"Table '{table_name}' already exists.")
+            if partitioned and swap:
+                raise ValueError(f"Table '{table_name}' is partitioned, swap is not supported.")
+
+            if swap:
+                cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(target)))
+            elif partitioned and if_exists == 'replace':
+                # Keep the partitions (and their indexes), new scenario combinations go to the default partition
+                cursor.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(table_name)))
+            elif exists and if_exists == 'replace':
+                cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(table_name)))
+            if swap or not exists or (if_exists == 'replace' and not partitioned):
+                cursor.execute(pd.io.sql.get_schema(dataframe, target, con=self.engine()))
+
+            copy_columns = sql.SQL(', ').join(sql.Identifier(str(c)) for c in dataframe.columns)
+            if binary:
+                cursor.execute(
+                    "SELECT a.attname, format_type(a.atttypid, a.atttypmod) FROM pg_attribute a "
+                    "WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped",
+                    (target,))
+                types_by_name = dict(cursor.fetchall())
+                pg_types = [types_by_name[str(c)] for c in dataframe.columns]
+                copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT binary)").format(sql.Identifier(target), copy_columns)
+            else:
+                copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')").format(sql.Identifier(target), copy_columns)
+            copy_sql = copy_sql.as_string(cursor)
+
+            # Stream chunk by chunk, every chunk is a separate COPY inside the same transaction
+            for start in range(0, len(dataframe), chunksize):
+                chunk = dataframe.iloc[start:start + chunksize]
+                if binary:
+                    buffer = io.BytesIO(_pgcopy_binary(chunk, pg_types))
+                else:
+                    buffer = io.StringIO()
+                    chunk.to_csv(buffer, index=False, header=False, na_rep='\\N')
+                    buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+
+            if swap:
+                self._swap_staging(cursor, table_name, target, exists)
+
+        self.connection.commit()
+
+    def _swap_staging(self, cursor, table_name, staging, exists):
+        # Indexes are built after the load (much faster than maintaining them row by row) and keep their names
+        renames = []
+        if exists:
+            cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+                           (table_name,))
+            for index_name, index_def in cursor.fetchall():
+                staging_index = f"{index_name}__staging"
+                index_def = index_def.replace(f"INDEX {index_name} ON ", f"INDEX {staging_index} ON ", 1)
+                index_def = re.sub(rf" ON (\S+\.)?{re.escape(table_name)} ", f" ON {staging} ", index_def, count=1)
+                cursor.execute(index_def)
+                renames.append((staging_index, index_name))
+            # No CASCADE on purpose: dependent views must be recreated explicitly, not silently dropped
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(table_name)))
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(staging), sql.Identifier(table_name)))
+        for staging_index, index_name in renames:
+            cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(staging_index), sql.Identifier(index_name)))
+
     
     def drop_table(self, table_name):
         """
@@ -149,26 +843,33 @@ class DBHandler:
             query = f"DROP TABLE IF EXISTS {table_name} CASCADE;"
             self.execute(query)
             self.connection.commit()
+            self.table_changed(table_name)
             print(f"Table {table_name} dropped successfully!")
         except Exception as e:
             print(f"Error dropping table {table_name}: {e}")
             self.rollback()
     
     def reconnect(self):
-        """Reconnect to the database."""
-        self.connection = psycopg2.connect(
-            host=self.host,
-            port=self.port,
-            user=self.user,
-            password=self.password,
-            dbname=self.dbname
-            )
+        """Reconnect to the database (a pooled handler swaps its connection for a fresh one)."""
+        if self.connection is not None:
+            if self.pool is not None:
+                self.pool.putconn(self.connection, discard=True)
+            elif not self.connection.closed:
+                self.connection.close()
+        self.connection = self._acquire()
         self.cursor = self.connection.cursor()
         
     def close(self):
-        """Close the cursor and the connection."""
-        self.cursor.close()
-        self.connection.close()
+        """Close the cursor and the connection, or return the connection to the pool."""
+        if self.connection is None:
+            return
+        if not self.cursor.closed:
+            self.cursor.close()
+        if self.pool is not None:
+            self.pool.putconn(self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
 
     def drop_database(self, dbname):
         """Drop the specified database after terminating its connections."""
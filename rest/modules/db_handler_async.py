@@ -0,0 +1,212 @@
+#Version 0.2
+#Change log:
+#18.10.2026 Async counterpart of DBHandler on psycopg 3 (AsyncConnectionPool), used by the async views
+#18.10.2026 statement_timeout per handler
+#18.10.2026 Pools registered per event loop object (weak keys, never by id()), closed with close_async_pools or dropped with their loop
+
+# Same query layer as DBHandler: modules.db_queries definitions are PREPAREd once per server session and
+# EXECUTEd with client-side bound values (so parameters get the types the statement declared, exactly like the
+# psycopg2 path), NUMERIC is decoded straight to float and rows go through the same ColumnDecoder.
+# Every fetch checks its own connection out of the pool, so independent queries of one request can run
+# concurrently with asyncio.gather.
+# Pools are bound to the event loop they were opened on. Under ASGI a worker runs one loop and keeps its pools until
+# close_async_pools() at lifespan shutdown (rest/asgi.py). Under WSGI Django runs each async view in a new loop, the
+# view closes that loop's pools before returning.
+
+import asyncio
+import os
+import traceback
+import weakref
+
+from psycopg import AsyncClientCursor
+from psycopg.conninfo import make_conninfo
+from psycopg.errors import InvalidSqlStatementName
+from psycopg.types.numeric import FloatLoader
+from psycopg_pool import AsyncConnectionPool
+
+from modules.db_cache import get_cache, query_tables
+from modules.db_handler import FETCH_ITERSIZE, POOL_MAXCONN, POOL_TIMEOUT, ColumnDecoder
+
+
+ASYNC_POOL_MINCONN = int(os.environ.get('IPRISM_DB_ASYNC_POOL_MIN', 1))
+
+_async_pools = weakref.WeakKeyDictionary()  # event loop -> {dsn: task opening the pool}
+
+
+async def _configure(connection):
+    # NUMERIC -> float for every cursor of the connection, and the set of statements PREPAREd on its session
+    connection.adapters.register_loader("numeric", FloatLoader)
+    connection.prepared = set()
+
+
+async def _open_pool(pool):
+    await pool.open()
+    return pool
+
+
+async def get_async_pool(host, port, user, password, dbname, maxconn=POOL_MAXCONN, timeout=POOL_TIMEOUT):
+    """Return the AsyncConnectionPool for the given database and the running event loop (opened on first use)."""
+    loop = asyncio.get_running_loop()
+    # Loops closed without close_async_pools (nothing can be awaited on them any more): their pools are dropped
+    for closed_loop in [other for other in list(_async_pools.keys()) if other.is_closed()]:
+        _async_pools.pop(closed_loop, None)
+    pools = _async_pools.setdefault(loop, {})
+    key = (host, int(port), user, password, dbname)
+    task = pools.get(key)
+    if task is None or (task.done() and not task.cancelled() and task.exception() is None and task.result().closed):
+        conninfo = make_conninfo(host=host, port=port, user=user, password=password, dbname=dbname)
+        pool = AsyncConnectionPool(conninfo, min_size=min(ASYNC_POOL_MINCONN, maxconn), max_size=maxconn,
+                                   timeout=timeout, configure=_configure, check=AsyncConnectionPool.check_connection,
+                                   open=False)
+        # Concurrent first callers all wait for the same open()
+        task = pools[key] = loop.create_task(_open_pool(pool))
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        pools.pop(key, None)
+        raise
+
+
+async def close_async_pools():
+    """Close the pools of the running event loop (end of a WSGI-served async view, ASGI lifespan shutdown)."""
+    pools = _async_pools.pop(asyncio.get_running_loop(), {})
+    for task in pools.values():
+        if task.cancelled():
+            continue
+        try:
+            pool = await asyncio.shield(task)  # a pool still opening is closed once open
+        except Exception:
+            continue  # never opened
+        await pool.close()
+
+
+class AsyncDBHandler:
+    """
+    Async database handler backed by a psycopg 3 connection pool.
+
+        async with AsyncDBHandler(password="smacap", dbname='geospatial') as db:
+            df = await db.fetch_query(queries.PIXEL_AGG_SLICE, params, kpi='geo_rsrp')
+
+    Unlike DBHandler it does not hold a connection: every call checks one out of the pool for its duration.
+    """
+
+    def __init__(self, host="iprism-postgres", port=5432, user="postgres", password="smacap", dbname="", cache=False,
+                 maxconn=POOL_MAXCONN, statement_timeout=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.dbname = dbname
+        self.maxconn = maxconn
+        self.statement_timeout = statement_timeout  # seconds, applied with SET LOCAL to every statement
+        self.pool = None
+        self.cache = get_cache(host, port, user, password, dbname) if cache else None
+
+    async def open(self):
+        if self.pool is None:
+            self.pool = await get_async_pool(self.host, self.port, self.user, self.password, self.dbname, self.maxconn)
+        return self
+
+    async def close(self):
+        # The pool is shared by the whole process, the handler only drops its reference
+        self.pool = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def execute(self, query, params=None):
+        """Run a statement in its own transaction, return the rows of a SELECT."""
+        await self.open()
+        try:
+            async with self.pool.connection() as connection:
+                await self._set_timeout(connection)
+                async with connection.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    if cursor.description is not None:
+                        return await cursor.fetchall()
+        except Exception as e:
+            error_message = traceback.format_exc()
+            print(f"An error occurred: {e}\n{error_message}")
+            raise e
+
+    async def fetch_df(self, query, params=None, columns=None, dtypes=None, itersize=FETCH_ITERSIZE):
+        """Async DBHandler.fetch_df: server-side cursor, decoded batch by batch into typed NumPy columns."""
+        return await self._cached(query, (params, columns, dtypes), query_tables(query),
+                                  lambda: self._fetch_df(query, params, columns, dtypes or {}, itersize))
+
+    async def _fetch_df(self, query, params, columns, dtypes, itersize):
+        await self.open()
+        try:
+            async with self.pool.connection() as connection:
+                await self._set_timeout(connection)
+                async with connection.cursor(name="iprism_fetch") as cursor:
+                    await cursor.execute(query, params)
+                    return await self._decode_rows(cursor, columns, dtypes, itersize)
+        except Exception as e:
+            error_message = traceback.format_exc()
+            print(f"An error occurred: {e}\n{error_message}")
+            raise e
+
+    async def fetch_query(self, query_def, params, itersize=FETCH_ITERSIZE, **identifiers):
+        """Async DBHandler.fetch_query: modules.db_queries definition PREPAREd once per connection, then EXECUTEd."""
+        rendered = query_def.render(**identifiers)
+        values = rendered.values(params)
+        return await self._cached(rendered.text, values, query_def.tables,
+                                  lambda: self._fetch_prepared(rendered, values, itersize))
+
+    async def _fetch_prepared(self, rendered, values, itersize):
+        query_def = rendered.query_def
+        await self.open()
+        try:
+            async with self.pool.connection() as connection:
+                for attempt in (1, 2):
+                    try:
+                        await self._set_timeout(connection)
+                        async with AsyncClientCursor(connection) as cursor:
+                            if rendered.name not in connection.prepared:
+                                await cursor.execute(rendered.prepare_sql)
+                                connection.prepared.add(rendered.name)
+                            await cursor.execute(rendered.execute_sql, values)
+                            return await self._decode_rows(cursor, query_def.columns, query_def.dtypes, itersize)
+                    except InvalidSqlStatementName:
+                        # Session state was reset under us (e.g. DISCARD ALL): prepare again once
+                        await connection.rollback()
+                        connection.prepared.discard(rendered.name)
+                        if attempt == 2:
+                            raise
+                    finally:
+                        await connection.rollback()  # Close transaction for SELECT queries
+        except Exception as e:
+            error_message = traceback.format_exc()
+            print(f"An error occurred: {e}\n{error_message}")
+            raise e
+
+    async def _set_timeout(self, connection):
+        # SET does not take bound parameters (psycopg 3 binds server-side), the value is a validated int
+        if self.statement_timeout is not None:
+            await connection.execute(f"SET LOCAL statement_timeout = {max(1, int(self.statement_timeout * 1000))}")
+
+    async def _cached(self, query, params, tables, load):
+        # Same versioned cache as DBHandler, versions are read before the query runs
+        if self.cache is None:
+            return await load()
+        key = self.cache.key(query, params)
+        frame = self.cache.get(key, tables)
+        if frame is None:
+            versions = self.cache.versions(tables)
+            frame = await load()
+            self.cache.put(key, tables, versions, frame)
+        return frame
+
+    @staticmethod
+    async def _decode_rows(cursor, columns, dtypes, itersize):
+        decoder = ColumnDecoder(columns or [desc.name for desc in cursor.description], dtypes)
+        while True:
+            rows = await cursor.fetchmany(itersize)
+            if not rows:
+                break
+            decoder.add(rows)
+        return decoder.frame()
@@ -0,0 +1,459 @@
+#Version 0.1
+#Change log:
+#18.10.2026 Query definitions for db_fetcher and dt_geosimulator: bound parameters, whitelisted identifiers, PREPARE once per connection
+#18.10.2026 scenario_traffic tolerance written as a range (index friendly) instead of ABS(scenario_traffic - x) < 0.0001
+#18.10.2026 Scenario loads of the in-memory switch-off engine (modules.dt_switchoff_engine)
+#18.10.2026 SWITCHOFF_AGG_SLICE: site switch-off aggregated on the server in one statement
+#18.10.2026 expand_kpis: several KPI columns from one {kpi} query
+#18.10.2026 SWITCHOFF_AGG_TILE / PIXEL_AGG_BOUNDS for spatially chunked switch-off runs
+#18.10.2026 RenderedQuery: %%(name)s stays a literal %(name)s in prepare_sql, it is not a parameter
+
+# Every statement used by db_fetcher / dt_geosimulator is defined here once.
+# - Values are bound as %(name)s parameters, lists are bound as arrays and matched with = ANY(%(name)s)
+# - Identifiers ({kpi}) are never taken from the request as-is: they are checked against a whitelist
+#   and inserted unquoted, so they keep the same case folding as the rest of the hand written SQL
+# - DBHandler.fetch_query PREPAREs the rendered text once per connection and then only sends EXECUTE,
+#   so repeated dashboard queries skip parsing and planning
+# - scenario_traffic is a float scenario key: the 0.0001 tolerance is written as an open range on the bare column,
+#   so the indexes from modules.db_schema can serve it (ABS(scenario_traffic - x) forces a sequential scan)
+
+import hashlib
+import re
+
+
+# Columns that can be requested as {kpi} from pixel_sector / pixel_agg
+PIXEL_KPI_COLUMNS = frozenset([
+    'geo_user_tput_dl', 'geo_churn_prob', 'geo_cap_demand', 'geo_served_demand', 'geo_latent_demand',
+    'geo_revenue_potential', 'geo_rsrp', 'geo_cqi', 'roi', 'npv', 'ttc', 'best_server', 'count_samples',
+])
+
+# Competitive tables carry one column per measured KPI/category, so their KPI is validated as a plain identifier
+_IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]{0,62}$')
+_PARAM_RE = re.compile(r'%%|%\((\w+)\)s')  # %% is a literal %, never the start of a placeholder
+
+LATLON_DTYPES = {'latitude_50': 'float64', 'longitude_50': 'float64'}
+
+
+class PlainIdentifier:
+    """Whitelist accepting any plain SQL identifier (letters, digits, underscore)."""
+
+    def __contains__(self, name):
+        return isinstance(name, str) and bool(_IDENTIFIER_RE.match(name))
+
+
+class RenderedQuery:
+    """A QueryDef with its identifiers filled in, ready to be PREPAREd and EXECUTEd."""
+
+    def __init__(self, query_def, text):
+        self.query_def = query_def
+        self.text = text
+        self.name = f"iprism_{query_def.name}_{hashlib.md5(text.encode()).hexdigest()[:10]}"
+
+        # PREPARE wants positional $n placeholders: every distinct %(name)s gets one, in order of appearance
+        self.param_names = []
+        for param in _PARAM_RE.findall(text):
+            if param and param not in self.param_names:
+                self.param_names.append(param)
+        self.prepare_sql = f"PREPARE {self.name} AS " + _PARAM_RE.sub(
+            lambda m: f"${self.param_names.index(m.group(1)) + 1}" if m.group(1) else '%', text)
+        self.execute_sql = f"EXECUTE {self.name}" + (f" ({', '.join(['%s'] * len(self.param_names))})" if self.param_names else "")
+
+    def values(self, params):
+        """Positional parameter values for execute_sql / prepare_sql."""
+        missing = [name for name in self.param_names if name not in params]
+        if missing:
+            raise ValueError(f"Query {self.query_def.name} is missing parameters {missing}")
+        return [params[name] for name in self.param_names]
+
+
+class QueryDef:
+    """
+    Named SQL statement with %(name)s value placeholders and {identifier} placeholders.
+
+    Parameters:
+    - name (str): Short statement name, used for the prepared statement name.
+    - text (str): SQL text.
+    - columns (list): Output column names of the DataFrame returned by DBHandler.fetch_query.
+    - dtypes (dict or None): Output column name -> NumPy dtype, see DBHandler.fetch_df.
+    - identifiers (dict or None): Identifier placeholder -> whitelist (any container supporting `in`).
+    - tables (tuple or None): Tables read by the statement.
+    """
+
+    def __init__(self, name, text, columns, dtypes=None, identifiers=None, tables=None):
+        self.name = name
+        self.text = text
+        self.columns = columns
+        self.dtypes = dtypes or {}
+        self.identifiers = identifiers or {}
+        self.tables = tables or ()
+        self._rendered = {}
+
+    def render(self, **identifiers):
+        """Validate identifiers against the whitelists and return the RenderedQuery (cached per identifier set)."""
+        key = tuple(sorted(identifiers.items()))
+        rendered = self._rendered.get(key)
+        if rendered is None:
+            if set(identifiers) != set(self.identifiers):
+                raise ValueError(f"Query {self.name} expects identifiers {sorted(self.identifiers)}, got {sorted(identifiers)}")
+            for placeholder, value in identifiers.items():
+                if value not in self.identifiers[placeholder]:
+                    raise ValueError(f"Invalid {placeholder} {value!r} for query {self.name}")
+            rendered = self._rendered[key] = RenderedQuery(self, self.text.format(**identifiers))
+        return rendered
+
+
+_KPI_PLACEHOLDER_RE = re.compile(r'(\w+\.)?\{kpi\}')
+_expanded = {}
+
+
+def kpi_column(kpi):
+    """Output column of kpi in expand_kpis queries (the KPI name alone would clash with geo_rsrp / geo_cqi)."""
+    return f"kpi_{kpi}"
+
+
+def expand_kpis(query_def, kpis):
+    """
+    Variant of a {kpi} query returning several KPI columns at once: every `{kpi}` (or `alias.{kpi}`) becomes the
+    list of kpis, the 'kpi' output column becomes one kpi_column(kpi) column per KPI (same dtype).
+    """
+    kpis = tuple(kpis)
+    key = (query_def.name, kpis)
+    expanded = _expanded.get(key)
+    if expanded is None:
+        if not kpis or len(set(kpis)) != len(kpis):
+            raise ValueError(f"Query {query_def.name} needs a list of distinct KPIs, got {list(kpis)}")
+        for kpi in kpis:
+            if kpi not in query_def.identifiers['kpi']:
+                raise ValueError(f"Invalid kpi {kpi!r} for query {query_def.name}")
+        text = _KPI_PLACEHOLDER_RE.sub(lambda m: ', '.join((m.group(1) or '') + kpi for kpi in kpis), query_def.text)
+        kpi_columns = [kpi_column(kpi) for kpi in kpis]
+        columns = [name for column in query_def.columns for name in (kpi_columns if column == 'kpi' else (column,))]
+        dtypes = {name: dtype for column, dtype in query_def.dtypes.items()
+                  for name in (kpi_columns if column == 'kpi' else (column,))}
+        identifiers = {placeholder: whitelist for placeholder, whitelist in query_def.identifiers.items() if placeholder != 'kpi'}
+        expanded = _expanded[key] = QueryDef(f"{query_def.name}_{len(kpis)}kpi", text, columns, dtypes, identifiers,
+                                             query_def.tables)
+    return expanded
+
+
+def as_list(values):
+    """Single value or list/tuple -> list, for = ANY(%(name)s) parameters."""
+    if isinstance(values, (list, tuple, set)):
+        return list(values)
+    return [values]
+
+
+### db_fetcher
+
+SECTOR_DATA_PIX = QueryDef('sector_data_pix', """
+    SELECT latitude_50, longitude_50, {kpi}
+    FROM pixel_sector
+    WHERE
+        sector_ID = ANY(%(sector_ids)s) AND
+        scenario_optim = %(scenario_optim)s AND
+        scenario_traffic > %(scenario_traffic)s - 0.0001 AND
+        scenario_traffic < %(scenario_traffic)s + 0.0001 AND
+        year = %(year)s AND
+        geo_rsrp >= %(rsrp_min)s AND
+        geo_rsrp <= %(rsrp_max)s AND
+        geo_cqi >= %(cqi_min)s AND
+        geo_cqi <= %(cqi_max)s
+    """, columns=['latitude_50', 'longitude_50', 'kpi'], dtypes=LATLON_DTYPES,
+    identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_sector',))
+
+COVERAGE_DATA_PIX = QueryDef('coverage_data_pix', """
+    SELECT latitude_50, longitude_50, geo_rsrp, geo_cqi, {kpi}
+    FROM pixel_agg
+    WHERE
+        scenario_optim = %(scenario_optim)s AND
+        scenario_traffic > %(scenario_traffic)s - 0.0001 AND
+        scenario_traffic < %(scenario_traffic)s + 0.0001 AND
+        year = %(year)s AND
+        geo_rsrp >= %(rsrp_min)s AND
+        geo_rsrp <= %(rsrp_max)s AND
+        geo_cqi >= %(cqi_min)s AND
+        geo_cqi <= %(cqi_max)s
+    """, columns=['latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi', 'kpi'],
+    dtypes=dict(LATLON_DTYPES, geo_rsrp='float32', geo_cqi='float32', kpi='float32'),
+    identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_agg',))
+
+SECTOR_DATA_PIX_EXT = QueryDef('sector_data_pix_ext', """
+    SELECT sector_ID, latitude_50, longitude_50, {kpi}, geo_rsrp, geo_cqi, geo_served_demand, geo_user_tput_dl, count_samples
+    FROM pixel_sector
+    WHERE
+        sector_ID = ANY(%(sector_ids)s) AND
+        scenario_optim = %(scenario_optim)s AND
+        scenario_traffic > %(scenario_traffic)s - 0.0001 AND
+        scenario_traffic < %(scenario_traffic)s + 0.0001 AND
+        year = %(year)s AND
+        geo_rsrp >= %(rsrp_min)s AND
+        geo_rsrp <= %(rsrp_max)s AND
+        geo_cqi >= %(cqi_min)s AND
+        geo_cqi <= %(cqi_max)s
+    """, columns=['sector_id', 'latitude_50', 'longitude_50', 'kpi', 'geo_rsrp', 'geo_cqi', 'geo_served_demand', 'geo_user_tput_dl', 'count_samples'],
+    dtypes=LATLON_DTYPES, identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_sector',))
+
+SITE_DATA_PIX_EXT = QueryDef('site_data_pix_ext', """
+    SELECT sector_ID, latitude_50, longitude_50, {kpi}, geo_rsrp, geo_cqi, geo_served_demand, geo_user_tput_dl, count_samples
+    FROM pixel_sector
+    WHERE
+        site_id = ANY(%(site_ids)s) AND
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s AND
+        geo_rsrp >= %(rsrp_min)s AND
+        geo_rsrp <= %(rsrp_max)s AND
+        geo_cqi >= %(cqi_min)s AND
+        geo_cqi <= %(cqi_max)s
+    """, columns=['sector_id', 'latitude_50', 'longitude_50', 'kpi', 'geo_rsrp', 'geo_cqi', 'geo_served_demand', 'geo_user_tput_dl', 'count_samples'],
+    dtypes=LATLON_DTYPES, identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_sector',))
+
+COMPET_CSP_DATA_PIX = QueryDef('compet_csp_data_pix', """
+    SELECT Latitude, Longitude, QOS_RSRP, population, {kpi}
+    FROM csp_details_pop
+    WHERE
+        Connection_ServiceProviderBrandName = %(csp_name)s AND
+        band_category = %(band_category)s AND
+        population >= %(population_min)s AND
+        population <= %(population_max)s AND
+        QOS_RSRP >= %(rsrp_min)s AND
+        QOS_RSRP <= %(rsrp_max)s
+    """, columns=['Latitude', 'Longitude', 'QOS_RSRP', 'population', 'kpi'],
+    identifiers={'kpi': PlainIdentifier()}, tables=('csp_details_pop',))
+
+COMPET_CSP_DATA_PIX_ROADS = QueryDef('compet_csp_data_pix_roads', """
+    SELECT Latitude, Longitude, QOS_RSRP, population, {kpi}
+    FROM csp_details_pop
+    WHERE
+        Connection_ServiceProviderBrandName = %(csp_name)s AND
+        band_category = %(band_category)s AND
+        roads_proximity = %(roads)s AND
+        population >= %(population_min)s AND
+        population <= %(population_max)s AND
+        QOS_RSRP >= %(rsrp_min)s AND
+        QOS_RSRP <= %(rsrp_max)s
+    """, columns=['Latitude', 'Longitude', 'QOS_RSRP', 'population', 'kpi'],
+    identifiers={'kpi': PlainIdentifier()}, tables=('csp_details_pop',))
+
+COMPET_CAT_DATA_PIX = QueryDef('compet_cat_data_pix', """
+    SELECT Latitude, Longitude, population, {kpi}
+    FROM compet_cat_pop
+    WHERE
+        target_csp = %(csp_name)s AND
+        band_category = %(band_category)s AND
+        population >= %(population_min)s AND
+        population <= %(population_max)s AND
+        {kpi} >= %(cat_min)s AND
+        {kpi} <= %(cat_max)s AND
+        {kpi} > 0
+    """, columns=['Latitude', 'Longitude', 'population', 'kpi'],
+    identifiers={'kpi': PlainIdentifier()}, tables=('compet_cat_pop',))
+
+COMPET_CAT_DATA_PIX_ROADS = QueryDef('compet_cat_data_pix_roads', """
+    SELECT Latitude, Longitude, population, {kpi}
+    FROM compet_cat_pop
+    WHERE
+        target_csp = %(csp_name)s AND
+        band_category = %(band_category)s AND
+        roads_proximity = %(roads)s AND
+        population >= %(population_min)s AND
+        population <= %(population_max)s AND
+        {kpi} >= %(cat_min)s AND
+        {kpi} <= %(cat_max)s AND
+        {kpi} > 0
+    """, columns=['Latitude', 'Longitude', 'population', 'kpi'],
+    identifiers={'kpi': PlainIdentifier()}, tables=('compet_cat_pop',))
+
+BESTSERVER_DATA_PIX = QueryDef('bestserver_data_pix', """
+    SELECT latitude_50, longitude_50, best_server
+    FROM pixel_agg
+    WHERE
+        scenario_optim = %(scenario_optim)s AND
+        scenario_traffic > %(scenario_traffic)s - 0.0001 AND
+        scenario_traffic < %(scenario_traffic)s + 0.0001 AND
+        year = %(year)s
+    """, columns=['latitude_50', 'longitude_50', 'best_server'], dtypes=LATLON_DTYPES, tables=('pixel_agg',))
+
+
+### dt_geosimulator
+
+# pixel_agg is large so its KPI columns are decoded as float32,
+# sector slices are small and keep float64 for the weighted sums
+SECTOR_COLUMNS = ['index', 'Site_ID', 'geo_user_tput_dl', 'geo_churn_prob', 'geo_cap_demand', 'geo_served_demand',
+                  'geo_latent_demand', 'geo_rsrp', 'geo_cqi', 'COUNT_SAMPLES']
+SECTOR_DTYPES = {col: 'float64' for col in SECTOR_COLUMNS[2:]}
+
+PIXEL_AGG_SLICE = QueryDef('pixel_agg_slice', """
+    SELECT index, latitude_50, longitude_50, geo_rsrp, geo_cqi, {kpi}
+    FROM pixel_agg
+    WHERE
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s AND
+        geo_rsrp >= %(rsrp_min)s AND
+        geo_rsrp <= %(rsrp_max)s AND
+        geo_cqi >= %(cqi_min)s AND
+        geo_cqi <= %(cqi_max)s
+    """, columns=['index', 'latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi', 'kpi'],
+    dtypes=dict(LATLON_DTYPES, geo_rsrp='float32', geo_cqi='float32', kpi='float32'),
+    identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_agg',))
+
+AFFECTED_INDICES = QueryDef('affected_indices', """
+    SELECT DISTINCT index
+    FROM pixel_sector
+    WHERE
+        Site_ID = ANY(%(site_ids)s) AND
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s
+    """, columns=['index'], tables=('pixel_sector',))
+
+SECTORS_BY_INDEX = QueryDef('sectors_by_index', """
+    SELECT ps.index,
+        ps.Site_ID,
+        ps.geo_user_tput_dl,
+        ps.geo_churn_prob,
+        ps.geo_cap_demand,
+        ps.geo_served_demand,
+        ps.geo_latent_demand,
+        ps.geo_rsrp,
+        ps.geo_cqi,
+        ps.COUNT_SAMPLES
+    FROM pixel_sector ps
+    WHERE
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s AND
+        ps.index = ANY(%(indices)s)
+    """, columns=SECTOR_COLUMNS, dtypes=SECTOR_DTYPES, tables=('pixel_sector',))
+
+# AFFECTED_INDICES + SECTORS_BY_INDEX + the pandas aggregation + PIXEL_AGG_SLICE in one statement: the server
+# aggregates the sectors of the affected pixels and returns the pixel_agg slice with the switch-off columns joined,
+# i.e. the frame dt_geosimulator.apply_switch_off expects (unaffected pixels have NULL switch-off columns).
+# NULL sums are treated as 0 and a NULL Site_ID as a remaining sector, like the pandas groupby sums.
+_SWITCHOFF_AGG_TEXT = """
+    WITH affected AS (
+        SELECT DISTINCT index
+        FROM pixel_sector
+        WHERE
+            Site_ID = ANY(%(site_ids)s) AND
+            scenario_traffic = %(scenario_traffic)s AND
+            scenario_optim = %(scenario_optim)s AND
+            year = %(year)s{sector_area}
+    ),
+    sectors AS (
+        SELECT ps.index,
+            COALESCE(ps.Site_ID = ANY(%(site_ids)s), false) AS sw_off,
+            ps.geo_served_demand,
+            ps.geo_rsrp,
+            ps.geo_cqi,
+            ps.COUNT_SAMPLES
+        FROM pixel_sector ps
+        JOIN affected USING (index)
+        WHERE
+            ps.scenario_traffic = %(scenario_traffic)s AND
+            ps.scenario_optim = %(scenario_optim)s AND
+            ps.year = %(year)s
+    ),
+    aggr AS (
+        SELECT index,
+            CASE WHEN bool_or(sw_off) THEN COALESCE(SUM(geo_served_demand) FILTER (WHERE sw_off), 0) END AS traffic_sw_off,
+            COALESCE(SUM(geo_served_demand) FILTER (WHERE NOT sw_off), 0) AS traffic_remain,
+            COALESCE(SUM(geo_rsrp * COUNT_SAMPLES) FILTER (WHERE NOT sw_off), 0)
+                / NULLIF(COALESCE(SUM(COUNT_SAMPLES) FILTER (WHERE NOT sw_off), 0), 0) AS new_rsrp,
+            COALESCE(SUM(geo_cqi * COUNT_SAMPLES) FILTER (WHERE NOT sw_off), 0)
+                / NULLIF(COALESCE(SUM(COUNT_SAMPLES) FILTER (WHERE NOT sw_off), 0), 0) AS new_cqi
+        FROM sectors
+        GROUP BY index
+    )
+    SELECT pa.index, pa.latitude_50, pa.longitude_50, pa.geo_rsrp, pa.geo_cqi, pa.{kpi},
+        CASE WHEN a.index IS NULL THEN NULL WHEN a.traffic_remain = 0 THEN 1 ELSE 0 END AS coverage_loss,
+        CASE WHEN a.index IS NULL THEN NULL
+             WHEN a.traffic_remain > 0 THEN (COALESCE(a.traffic_sw_off, 0) + a.traffic_remain) / a.traffic_remain
+             ELSE 0 END AS offload_coef,
+        a.traffic_sw_off, a.traffic_remain, a.new_rsrp, a.new_cqi
+    FROM pixel_agg pa
+    LEFT JOIN aggr a ON a.index = pa.index
+    WHERE
+        pa.scenario_traffic = %(scenario_traffic)s AND
+        pa.scenario_optim = %(scenario_optim)s AND
+        pa.year = %(year)s AND
+        pa.geo_rsrp >= %(rsrp_min)s AND
+        pa.geo_rsrp <= %(rsrp_max)s AND
+        pa.geo_cqi >= %(cqi_min)s AND
+        pa.geo_cqi <= %(cqi_max)s{pixel_area}
+    """
+
+_SWITCHOFF_AGG_COLUMNS = ['index', 'latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi', 'kpi', 'coverage_loss', 'offload_coef',
+                          'traffic_sw_off', 'traffic_remain', 'new_RSRP', 'new_CQI']
+_SWITCHOFF_AGG_DTYPES = dict(LATLON_DTYPES, geo_rsrp='float32', geo_cqi='float32', kpi='float32', coverage_loss='float64',
+                             offload_coef='float64', traffic_sw_off='float64', traffic_remain='float64', new_RSRP='float64',
+                             new_CQI='float64')
+
+SWITCHOFF_AGG_SLICE = QueryDef('switchoff_agg_slice', _SWITCHOFF_AGG_TEXT.replace('{sector_area}', '').replace('{pixel_area}', ''),
+                               columns=_SWITCHOFF_AGG_COLUMNS, dtypes=_SWITCHOFF_AGG_DTYPES,
+                               identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_sector', 'pixel_agg'))
+
+# SWITCHOFF_AGG_SLICE of the pixels inside one lat/lon box (spatially chunked runs): affected pixels are searched
+# in the box only, so memory and transfer per statement stay bounded by the box
+_AREA = """ AND
+        {alias}latitude_50 >= %(lat_min)s AND
+        {alias}latitude_50 <= %(lat_max)s AND
+        {alias}longitude_50 >= %(lon_min)s AND
+        {alias}longitude_50 <= %(lon_max)s"""
+
+SWITCHOFF_AGG_TILE = QueryDef('switchoff_agg_tile',
+                              _SWITCHOFF_AGG_TEXT.replace('{sector_area}', _AREA.replace('{alias}', '').replace('\n        ', '\n            '))
+                                                 .replace('{pixel_area}', _AREA.replace('{alias}', 'pa.')),
+                              columns=_SWITCHOFF_AGG_COLUMNS, dtypes=_SWITCHOFF_AGG_DTYPES,
+                              identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_sector', 'pixel_agg'))
+
+PIXEL_AGG_BOUNDS = QueryDef('pixel_agg_bounds', """
+    SELECT MIN(longitude_50), MIN(latitude_50), MAX(longitude_50), MAX(latitude_50), COUNT(*)
+    FROM pixel_agg
+    WHERE
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s AND
+        geo_rsrp >= %(rsrp_min)s AND
+        geo_rsrp <= %(rsrp_max)s AND
+        geo_cqi >= %(cqi_min)s AND
+        geo_cqi <= %(cqi_max)s AND
+        {kpi} IS NOT NULL
+    """, columns=['lon_min', 'lat_min', 'lon_max', 'lat_max', 'pixels'],
+    dtypes=dict(lon_min='float64', lat_min='float64', lon_max='float64', lat_max='float64', pixels='int64'),
+    identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_agg',))
+
+
+### dt_switchoff_engine: whole scenario loaded once, same scenario predicates as the switch-off queries above
+
+SWITCHOFF_SECTORS = QueryDef('switchoff_sectors', """
+    SELECT index, Site_ID, geo_served_demand, geo_rsrp, geo_cqi, COUNT_SAMPLES
+    FROM pixel_sector
+    WHERE
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s
+    """, columns=['index', 'Site_ID', 'geo_served_demand', 'geo_rsrp', 'geo_cqi', 'COUNT_SAMPLES'],
+    dtypes={'geo_served_demand': 'float64', 'geo_rsrp': 'float64', 'geo_cqi': 'float64', 'COUNT_SAMPLES': 'float64'},
+    tables=('pixel_sector',))
+
+SWITCHOFF_PIXELS = QueryDef('switchoff_pixels', """
+    SELECT index, latitude_50, longitude_50, geo_rsrp, geo_cqi
+    FROM pixel_agg
+    WHERE
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s
+    """, columns=['index', 'latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi'],
+    dtypes=dict(LATLON_DTYPES, geo_rsrp='float64', geo_cqi='float64'), tables=('pixel_agg',))
+
+SWITCHOFF_PIXEL_KPI = QueryDef('switchoff_pixel_kpi', """
+    SELECT index, {kpi}
+    FROM pixel_agg
+    WHERE
+        scenario_traffic = %(scenario_traffic)s AND
+        scenario_optim = %(scenario_optim)s AND
+        year = %(year)s
+    """, columns=['index', 'kpi'], dtypes={'kpi': 'float32'},
+    identifiers={'kpi': PIXEL_KPI_COLUMNS}, tables=('pixel_agg',))
@@ -0,0 +1,326 @@
+#Version 0.3
+#Change log:
+#18.10.2026 Index definitions for the pixel_sector / pixel_agg access patterns of db_fetcher and dt_geosimulator
+#18.10.2026 Declarative partitioning of pixel_sector / pixel_agg by scenario and year, per-partition summary views for pixel_agg
+#18.10.2026 lat/lon indexes for the tiles of the spatially chunked switch-off
+
+# Column order follows the predicates in modules.db_queries: equality columns (scenario_optim, year, then the
+# looked-up key) first and scenario_traffic last, because it is filtered with a +-0.0001 range and a range
+# column ends the usable part of a btree key.
+
+import json
+from decimal import Decimal
+
+from psycopg2 import sql
+
+
+class IndexDef:
+    """CREATE INDEX definition: name, table, key columns and optional INCLUDE (covering) columns."""
+
+    def __init__(self, name, table, columns, include=None, purpose=''):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.include = include or []
+        self.purpose = purpose
+
+    def create_sql(self, concurrently=True):
+        statement = sql.SQL("CREATE INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns}){include}").format(
+            concurrently=sql.SQL("CONCURRENTLY " if concurrently else ""),
+            name=sql.Identifier(self.name),
+            table=sql.Identifier(self.table),
+            columns=sql.SQL(', ').join(map(sql.Identifier, self.columns)),
+            include=sql.SQL(" INCLUDE ({})").format(sql.SQL(', ').join(map(sql.Identifier, self.include))) if self.include else sql.SQL(""),
+        )
+        return statement
+
+
+PIXEL_INDEXES = [
+    IndexDef('pixel_sector_scn_site_idx', 'pixel_sector', ['scenario_optim', 'year', 'site_id', 'scenario_traffic'],
+             include=['index'], purpose='affected pixels of switched-off sites (index-only scan), site_data_pix_ext'),
+    IndexDef('pixel_sector_scn_index_idx', 'pixel_sector', ['scenario_optim', 'year', 'index', 'scenario_traffic'],
+             purpose='all serving sectors of the affected pixels'),
+    IndexDef('pixel_sector_scn_sector_idx', 'pixel_sector', ['scenario_optim', 'year', 'sector_id', 'scenario_traffic'],
+             purpose='sector_data_pix, sector_data_pix_ext'),
+    IndexDef('pixel_agg_scn_idx', 'pixel_agg', ['scenario_optim', 'year', 'scenario_traffic'],
+             purpose='pixel_agg scenario slices (coverage_data_pix, bestserver_data_pix, switch-off)'),
+    IndexDef('pixel_agg_scn_index_idx', 'pixel_agg', ['scenario_optim', 'year', 'index', 'scenario_traffic'],
+             purpose='pixel_agg lookups by pixel index'),
+    IndexDef('pixel_sector_scn_area_idx', 'pixel_sector', ['scenario_optim', 'year', 'scenario_traffic', 'latitude_50', 'longitude_50'],
+             include=['site_id', 'index'], purpose='affected pixels of one tile (tiled switch-off)'),
+    IndexDef('pixel_agg_scn_area_idx', 'pixel_agg', ['scenario_optim', 'year', 'scenario_traffic', 'latitude_50', 'longitude_50'],
+             purpose='pixel_agg tiles (tiled switch-off)'),
+]
+
+
+def create_indexes(db, indexes=PIXEL_INDEXES, concurrently=True, dry_run=False):
+    """
+    Create the missing indexes on db (a DBHandler). CONCURRENTLY does not block the tables for writes,
+    it needs autocommit, which is switched on for the duration of the call.
+    Returns the executed (or, with dry_run, the planned) statements.
+    """
+    statements = []
+    autocommit = db.connection.autocommit
+    db.connection.autocommit = True
+    try:
+        with db.connection.cursor() as cursor:
+            for index in indexes:
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (index.table,))
+                if not cursor.fetchone()[0]:
+                    continue
+                # CONCURRENTLY is not supported on a partitioned parent, the index is built partition by partition
+                statement = index.create_sql(concurrently and not is_partitioned(db, index.table)).as_string(cursor)
+                statements.append(statement)
+                if not dry_run:
+                    cursor.execute(statement)
+            if not dry_run:
+                for table in sorted({index.table for index in indexes}):
+                    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+                    if cursor.fetchone()[0]:
+                        # Refresh statistics and the visibility map so index-only scans are considered
+                        cursor.execute(sql.SQL("VACUUM ANALYZE {}").format(sql.Identifier(table)))
+    finally:
+        db.connection.autocommit = autocommit
+    return statements
+
+
+def explain(db, query_def, params, **identifiers):
+    """Planner estimate for a modules.db_queries.QueryDef: (total cost, top plan node, scan nodes)."""
+    rendered = query_def.render(**identifiers)
+    with db.connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + rendered.text, params)
+        plan = cursor.fetchone()[0]
+    db.connection.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    plan = plan[0]['Plan']
+
+    scans = []
+    def walk(node):
+        if 'Scan' in node['Node Type']:
+            scans.append(f"{node['Node Type']} on {node.get('Index Name') or node.get('Relation Name')}")
+        for child in node.get('Plans', []):
+            walk(child)
+    walk(plan)
+    return plan['Total Cost'], plan['Node Type'], scans
+
+
+# Partitioning
+# Every request reads exactly one (scenario_traffic, scenario_optim, year) combination, so each combination gets
+# its own partition and the planner prunes all the others (at execution time for PREPAREd generic plans).
+# The key is RANGE (scenario_optim, year, scenario_traffic): the equality columns come first so that the
+# +-0.0001 range on scenario_traffic still prunes down to a single partition (with scenario_traffic first a range
+# predicate on it would stop pruning on the remaining columns). A partition covers scenario_traffic +-0.00005.
+# Rows of combinations without a partition land in <table>_default, add_partitions() moves them out.
+# Note that df_to_sql(if_exists='replace') keeps a partitioned table (TRUNCATE instead of DROP), whatever its method.
+
+PARTITION_KEY = ['scenario_optim', 'year', 'scenario_traffic']
+PARTITIONED_TABLES = ['pixel_sector', 'pixel_agg']
+TRAFFIC_HALF_WIDTH = Decimal('0.00005')
+SUMMARY_TABLES = ['pixel_agg']
+
+
+def _scenario_key(scenario_traffic, scenario_optim, year):
+    return Decimal(str(scenario_traffic)).quantize(Decimal('0.0001')), int(scenario_optim), int(year)
+
+
+def partition_name(table, scenario_traffic, scenario_optim, year):
+    """pixel_agg, 1.3, 0, 2 -> pixel_agg_o0_y2_t1p3"""
+    traffic, optim, year = _scenario_key(scenario_traffic, scenario_optim, year)
+    traffic = format(traffic.normalize(), 'f').replace('.', 'p').replace('-', 'm')
+    optim = str(optim).replace('-', 'm')
+    year = str(year).replace('-', 'm')
+    return f"{table}_o{optim}_y{year}_t{traffic}"
+
+
+def is_partitioned(db, table):
+    with db.connection.cursor() as cursor:
+        cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+def _combinations(cursor, table):
+    # Scenario combinations present in table, scenario_traffic rounded to the partition resolution
+    cursor.execute(sql.SQL(
+        "SELECT DISTINCT round(scenario_traffic::numeric, 4), scenario_optim, year FROM {} ORDER BY 2, 3, 1"
+    ).format(sql.Identifier(table)))
+    return [_scenario_key(*row) for row in cursor.fetchall()]
+
+
+def _create_partition_sql(parent, name, scenario_traffic, scenario_optim, year):
+    return sql.SQL("CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM ({o}, {y}, {lo}) TO ({o}, {y}, {hi})").format(
+        name=sql.Identifier(name), parent=sql.Identifier(parent),
+        o=sql.Literal(scenario_optim), y=sql.Literal(year),
+        lo=sql.Literal(scenario_traffic - TRAFFIC_HALF_WIDTH), hi=sql.Literal(scenario_traffic + TRAFFIC_HALF_WIDTH))
+
+
+def partition_table(db, table, drop_old=False, indexes=PIXEL_INDEXES):
+    """
+    Convert table into a partitioned table with one partition per scenario combination plus a DEFAULT partition.
+
+    The data is copied into <table>__partitioned, indexed, and swapped in with a rename inside one transaction.
+    The original table is kept as <table>_unpartitioned (dropped with drop_old=True).
+    Returns the names of the created partitions.
+    """
+    if is_partitioned(db, table):
+        print(f"{table} is already partitioned")
+        return []
+    new_table = f"{table}__partitioned"
+    old_table = f"{table}_unpartitioned"
+    table_indexes = [index for index in indexes if index.table == table]
+
+    with db.connection.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE").format(sql.Identifier(new_table)))
+        cursor.execute(sql.SQL("CREATE TABLE {new} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ({key})").format(
+            new=sql.Identifier(new_table), old=sql.Identifier(table),
+            key=sql.SQL(', ').join(map(sql.Identifier, PARTITION_KEY))))
+
+        partitions = []
+        for scenario_traffic, scenario_optim, year in _combinations(cursor, table):
+            name = partition_name(table, scenario_traffic, scenario_optim, year)
+            cursor.execute(_create_partition_sql(new_table, name, scenario_traffic, scenario_optim, year))
+            partitions.append(name)
+        cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} DEFAULT").format(
+            sql.Identifier(f"{table}_default"), sql.Identifier(new_table)))
+
+        # Load first and index afterwards, much faster than maintaining the indexes row by row
+        cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM {}").format(sql.Identifier(new_table), sql.Identifier(table)))
+        for index in table_indexes:
+            staged = IndexDef(f"{index.name}__partitioned", new_table, index.columns, index.include)
+            cursor.execute(staged.create_sql(concurrently=False))
+
+        # Swap: the old table and its indexes step aside under *_unpartitioned names
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table), sql.Identifier(old_table)))
+        for index in table_indexes:
+            cursor.execute(sql.SQL("ALTER INDEX IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(index.name), sql.Identifier(f"{index.name}__unpartitioned")))
+            cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                sql.Identifier(f"{index.name}__partitioned"), sql.Identifier(index.name)))
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(new_table), sql.Identifier(table)))
+        if drop_old:
+            cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old_table)))
+    db.connection.commit()
+
+    _analyze(db, table)
+    db.table_changed(table)
+    return partitions
+
+
+def add_partitions(db, table):
+    """
+    Create the partitions for scenario combinations that were loaded after partition_table() and ended up in
+    <table>_default. Their rows are moved into the new partitions. Returns the names of the created partitions.
+    """
+    default = f"{table}_default"
+    partitions = []
+    with db.connection.cursor() as cursor:
+        for scenario_traffic, scenario_optim, year in _combinations(cursor, default):
+            name = partition_name(table, scenario_traffic, scenario_optim, year)
+            in_range = sql.SQL("scenario_optim = %s AND year = %s AND scenario_traffic >= %s AND scenario_traffic < %s")
+            bounds = (scenario_optim, year, scenario_traffic - TRAFFIC_HALF_WIDTH, scenario_traffic + TRAFFIC_HALF_WIDTH)
+            # A partition can not be attached while the default partition still holds rows that belong to it
+            cursor.execute(sql.SQL("CREATE TEMP TABLE iprism_moved ON COMMIT DROP AS SELECT * FROM {} WHERE {}").format(
+                sql.Identifier(default), in_range), bounds)
+            cursor.execute(sql.SQL("DELETE FROM {} WHERE {}").format(sql.Identifier(default), in_range), bounds)
+            cursor.execute(_create_partition_sql(table, name, scenario_traffic, scenario_optim, year))
+            cursor.execute(sql.SQL("INSERT INTO {} SELECT * FROM iprism_moved").format(sql.Identifier(table)))
+            cursor.execute("DROP TABLE iprism_moved")
+            partitions.append(name)
+    db.connection.commit()
+
+    if partitions:
+        _analyze(db, table)
+        db.table_changed(table)
+    return partitions
+
+
+def list_partitions(db, table):
+    """Leaf partitions of table (without the default partition)."""
+    with db.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s) "
+            "AND pg_get_expr(c.relpartbound, c.oid) <> 'DEFAULT' ORDER BY c.relname", (table,))
+        partitions = [row[0] for row in cursor.fetchall()]
+    db.connection.rollback()
+    return partitions
+
+
+def _analyze(db, table):
+    autocommit = db.connection.autocommit
+    db.connection.autocommit = True
+    try:
+        with db.connection.cursor() as cursor:
+            cursor.execute(sql.SQL("VACUUM ANALYZE {}").format(sql.Identifier(table)))
+    finally:
+        db.connection.autocommit = autocommit
+
+
+# Summary views
+# One materialized view per pixel_agg partition (<partition>_summary) with pixel count, extent and per-KPI
+# aggregates, and a plain <table>_summary view over all of them. A reload of one scenario only needs the
+# refresh of its own view.
+
+SUMMARY_STATS = ['avg', 'min', 'max']
+SUMMARY_SUMS = ['geo_served_demand', 'geo_latent_demand', 'geo_revenue_potential']
+
+
+def _numeric_columns(cursor, table):
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s "
+        "AND data_type IN ('numeric', 'double precision', 'real', 'integer', 'bigint', 'smallint') "
+        "ORDER BY ordinal_position", (table,))
+    return [row[0] for row in cursor.fetchall() if row[0] not in PARTITION_KEY]
+
+
+def _summary_select(table, source, columns):
+    aggregates = [
+        sql.SQL("count(*) AS pixels"),
+        sql.SQL("min(latitude_50) AS lat_min, max(latitude_50) AS lat_max"),
+        sql.SQL("min(longitude_50) AS lon_min, max(longitude_50) AS lon_max"),
+    ]
+    for column in columns:
+        if column in ('latitude_50', 'longitude_50'):
+            continue
+        for stat in SUMMARY_STATS:
+            aggregates.append(sql.SQL("{stat}({column})::double precision AS {alias}").format(
+                stat=sql.SQL(stat), column=sql.Identifier(column), alias=sql.Identifier(f"{column}_{stat}")))
+        if column in SUMMARY_SUMS:
+            aggregates.append(sql.SQL("sum({column})::double precision AS {alias}").format(
+                column=sql.Identifier(column), alias=sql.Identifier(f"{column}_sum")))
+    return sql.SQL("SELECT scenario_traffic, scenario_optim, year, {aggregates} FROM {source} "
+                   "GROUP BY scenario_traffic, scenario_optim, year").format(
+        aggregates=sql.SQL(', ').join(aggregates), source=sql.Identifier(source))
+
+
+def create_summary_views(db, table='pixel_agg'):
+    """(Re)create the per-partition materialized summary views of table and the <table>_summary view over them."""
+    partitions = list_partitions(db, table)
+    view = f"{table}_summary"
+    with db.connection.cursor() as cursor:
+        columns = _numeric_columns(cursor, table)
+        cursor.execute(sql.SQL("DROP VIEW IF EXISTS {}").format(sql.Identifier(view)))
+        for partition in partitions:
+            cursor.execute(sql.SQL("DROP MATERIALIZED VIEW IF EXISTS {}").format(sql.Identifier(f"{partition}_summary")))
+            cursor.execute(sql.SQL("CREATE MATERIALIZED VIEW {} AS {}").format(
+                sql.Identifier(f"{partition}_summary"), _summary_select(table, partition, columns)))
+        if partitions:
+            cursor.execute(sql.SQL("CREATE VIEW {} AS {}").format(sql.Identifier(view), sql.SQL(' UNION ALL ').join(
+                sql.SQL("SELECT * FROM {}").format(sql.Identifier(f"{partition}_summary")) for partition in partitions)))
+    db.connection.commit()
+    db.table_changed(view)
+    return [f"{partition}_summary" for partition in partitions]
+
+
+def refresh_summary_views(db, table='pixel_agg', scenario_traffic=None, scenario_optim=None, year=None):
+    """Refresh the summary view of one scenario partition, or of all partitions when no scenario is given."""
+    if scenario_traffic is None:
+        partitions = list_partitions(db, table)
+    else:
+        partitions = [partition_name(table, scenario_traffic, scenario_optim, year)]
+    with db.connection.cursor() as cursor:
+        for partition in partitions:
+            cursor.execute(sql.SQL("REFRESH MATERIALIZED VIEW {}").format(sql.Identifier(f"{partition}_summary")))
+    db.connection.commit()
+    db.table_changed(f"{table}_summary")
@@ -0,0 +1,121 @@
+#Version 0.1
+#Change log:
+#18.10.2026 Request deadline shared by all stages of a request, cancels in-flight queries when it passes or the client leaves
+
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs past its deadline or was aborted (e.g. the client disconnected)."""
+
+
+class Deadline:
+    """
+    Overall time budget of one request.
+
+    Stages call check(stage) between steps and use remaining() to bound their own waits (statement_timeout,
+    HTTP timeouts). Connections running a query are registered with watch(connection): a watchdog thread calls
+    connection.cancel() on them as soon as the deadline passes or the request is aborted, so the server stops
+    working on a result nobody will read.
+
+    Parameters:
+    - seconds (float): Time budget from now.
+    - abort_check (callable or None): Polled by the watchdog, returning True aborts the request
+      (see client_disconnected).
+    - poll_interval (float): Watchdog period in seconds.
+    """
+
+    def __init__(self, seconds, abort_check=None, poll_interval=0.25):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.abort_check = abort_check
+        self.poll_interval = poll_interval
+        self.aborted = False
+        self.reason = None
+
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.aborted or self.remaining() <= 0
+
+    def check(self, stage=''):
+        """Raise DeadlineExceeded if the deadline passed or the request was aborted."""
+        if self.abort_check is not None and not self.aborted and self.abort_check():
+            self.abort('client disconnected')
+        if self.expired():
+            where = f" before {stage}" if stage else ""
+            raise DeadlineExceeded(f"Request {self.reason or f'deadline of {self.seconds}s exceeded'}{where}")
+
+    def abort(self, reason='aborted'):
+        """Abort the request: cancel the watched queries and fail every following check()."""
+        self.aborted = True
+        self.reason = self.reason or reason
+        self._cancel_all()
+
+    @contextmanager
+    def watch(self, connection):
+        """Context manager cancelling connection's running query when the deadline passes."""
+        self.check()
+        self._register(connection)
+        try:
+            yield connection
+        finally:
+            self._unregister(connection)
+
+    def close(self):
+        """Stop the watchdog (call when the request is done)."""
+        self._stop.set()
+
+    def _register(self, connection):
+        with self._lock:
+            self._connections.add(connection)
+            if self._watchdog is None:
+                self._watchdog = threading.Thread(target=self._watch_loop, name='iprism-deadline', daemon=True)
+                self._watchdog.start()
+
+    def _unregister(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+    def _watch_loop(self):
+        while not self._stop.wait(self.poll_interval):
+            if not self.aborted and self.abort_check is not None and self.abort_check():
+                self.abort('client disconnected')
+            elif self.expired():
+                self.reason = self.reason or f'deadline of {self.seconds}s exceeded'
+                self._cancel_all()
+
+    def _cancel_all(self):
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.cancel()
+            except Exception as e:
+                print(f"Could not cancel query: {e}")
+
+
+def client_disconnected(sock):
+    """
+    True if the peer of sock closed the connection (readable with nothing to read).
+    For an abort_check on a sync worker: the request body was already read, so any readable EOF means the client left.
+    """
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
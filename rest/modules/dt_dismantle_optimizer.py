@@ -0,0 +1,141 @@
+#Version 0.1
+#Change log:
+#18.10.2026 Least-impact dismantle optimizer on the in-memory switch-off store
+
+# Impact of switching off a set of sites S, summed over the pixels of the pixel_agg slice:
+# - 'geo_user_tput_dl': throughput lost. A pixel keeping coverage has its throughput divided by offload_coef, i.e. it
+#   loses kpi * off / total (off: served demand of the switched-off sectors, total: of all its sectors), a pixel losing
+#   coverage (no remaining sector with traffic) loses its whole kpi.
+# - 'coverage': served demand of the pixels losing coverage.
+# Both only depend on per (site, pixel) sums, so every single site is scored in one pass over the precomputed
+# SwitchOffStore.site_contributions. Greedy extension adds the site with the smallest marginal impact at each step,
+# recomputing only the pixels of the candidates. Pruning:
+# - only the `pool` best single sites are extension candidates;
+# - coverage loss only grows when more sites are off (a site's marginal impact is never below its single impact),
+#   so candidates are evaluated in ascending single impact and the scan stops once a single impact reaches the best
+#   marginal found so far.
+
+import time
+
+import numpy as np
+import pandas as pd
+
+
+OBJECTIVES = ('geo_user_tput_dl', 'coverage')
+
+
+class DismantleOptimizer:
+    """
+    Rank sites by the impact of dismantling them.
+
+    Parameters:
+    - store (SwitchOffStore): Scenario store.
+    - objective (str): One of OBJECTIVES.
+    - slice_mask (np.ndarray): SwitchOffStore.slice_mask of the RSRP / CQI thresholds.
+    - kpi_values (np.ndarray or None): store.kpi('geo_user_tput_dl'), required for that objective.
+    """
+
+    def __init__(self, store, objective, slice_mask, kpi_values=None):
+        if objective not in OBJECTIVES:
+            raise ValueError(f"Unknown dismantle objective {objective!r}, expected one of {OBJECTIVES}")
+        self.store = store
+        self.objective = objective
+        self.pair_served, self.pair_positive, self.total_served, self.positive_rows = store.site_contributions()
+        self.pair_pixel = store.site_pixels
+        self.pair_site = np.repeat(np.arange(len(store.site_labels)), np.diff(store.site_ptr))
+
+        # Per pixel weight: what the pixel loses with its coverage (0 outside the slice)
+        n_pixels = len(store.pixel_labels)
+        in_slice = store.agg_pixel[slice_mask]
+        self.in_slice = np.zeros(n_pixels, dtype=bool)
+        self.in_slice[in_slice] = True
+        self.weight = np.zeros(n_pixels)
+        if objective == 'geo_user_tput_dl':
+            self.weight[in_slice] = np.nan_to_num(kpi_values[slice_mask].astype(np.float64))
+        else:
+            self.weight[in_slice] = self.total_served[in_slice]
+
+    def _loss(self, pixels, off_served, off_positive):
+        # Impact on pixels touched by a switch-off with off_served / off_positive of their sectors switched off
+        weight = self.weight[pixels]
+        lost = self.positive_rows[pixels] - off_positive <= 0
+        if self.objective == 'coverage':
+            return np.where(lost, weight, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(lost, weight, weight * off_served / self.total_served[pixels])
+
+    def single_site_impacts(self):
+        """DataFrame of every site: impact, slice pixels it serves and slice pixels losing coverage without it."""
+        n_sites = len(self.store.site_labels)
+        loss = self._loss(self.pair_pixel, self.pair_served, self.pair_positive)
+        in_slice = self.in_slice[self.pair_pixel]
+        lost = in_slice & (self.positive_rows[self.pair_pixel] - self.pair_positive <= 0)
+        return pd.DataFrame({
+            'Site_ID': self.store.site_labels,
+            'impact': np.bincount(self.pair_site, weights=loss, minlength=n_sites),
+            'affected_pixels': np.bincount(self.pair_site, weights=in_slice, minlength=n_sites).astype(np.int64),
+            'coverage_loss_pixels': np.bincount(self.pair_site, weights=lost, minlength=n_sites).astype(np.int64),
+            'traffic_sw_off': np.bincount(self.pair_site, weights=self.pair_served * in_slice, minlength=n_sites),
+        })
+
+    def rank(self, top=None):
+        """Sites by ascending single-site impact (least impact first)."""
+        ranking = self.single_site_impacts().sort_values(['impact', 'traffic_sw_off'], kind='stable').reset_index(drop=True)
+        return ranking if top is None else ranking.head(top)
+
+    def greedy(self, size, pool=200, chunk=32):
+        """
+        Greedy set of `size` sites: each step adds the candidate with the smallest marginal impact.
+        Returns one dict per step (site, marginal and cumulative impact) and the number of candidates evaluated.
+        """
+        singles = self.single_site_impacts()
+        order = np.argsort(singles['impact'].to_numpy(), kind='stable')[:pool]
+        single_impact = singles['impact'].to_numpy()
+        candidates = list(order)
+
+        n_pixels = len(self.store.pixel_labels)
+        off_served = np.zeros(n_pixels)
+        off_positive = np.zeros(n_pixels, dtype=np.int32)
+        touched = np.zeros(n_pixels, dtype=bool)
+        steps, total, evaluated = [], 0.0, 0
+        site_ptr = self.store.site_ptr
+
+        while candidates and len(steps) < size:
+            best_site, best_marginal = None, np.inf
+            for start in range(0, len(candidates), chunk):
+                part = np.array(candidates[start:start + chunk])
+                if self.objective == 'coverage' and single_impact[part[0]] >= best_marginal:
+                    break  # marginal >= single impact for every remaining candidate
+                starts, counts = site_ptr[part], site_ptr[part + 1] - site_ptr[part]
+                pairs = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+                group = np.repeat(np.arange(len(part)), counts)
+                pixels = self.pair_pixel[pairs]
+                before = np.where(touched[pixels], self._loss(pixels, off_served[pixels], off_positive[pixels]), 0.0)
+                after = self._loss(pixels, off_served[pixels] + self.pair_served[pairs], off_positive[pixels] + self.pair_positive[pairs])
+                marginal = np.bincount(group, weights=after - before, minlength=len(part))
+                evaluated += len(part)
+                i = int(np.argmin(marginal))
+                if marginal[i] < best_marginal:
+                    best_site, best_marginal = int(part[i]), float(marginal[i])
+
+            pairs = np.arange(site_ptr[best_site], site_ptr[best_site + 1])
+            pixels = self.pair_pixel[pairs]
+            off_served[pixels] += self.pair_served[pairs]
+            off_positive[pixels] += self.pair_positive[pairs]
+            touched[pixels] = True
+            total += best_marginal
+            candidates.remove(best_site)
+            steps.append({'Site_ID': self.store.site_labels[best_site], 'marginal_impact': best_marginal,
+                          'cumulative_impact': total, 'single_impact': float(single_impact[best_site])})
+        return steps, evaluated
+
+
+def optimize_dismantle(store, objective, slice_mask, kpi_values=None, top=20, size=0, pool=200):
+    """Single-site ranking (top sites) and, if size > 0, a greedy multi-site plan of that many sites."""
+    ts = time.time()
+    optimizer = DismantleOptimizer(store, objective, slice_mask, kpi_values)
+    ranking = optimizer.rank(top)
+    steps, evaluated = optimizer.greedy(size, pool) if size > 0 else ([], 0)
+    print(f"Dismantle optimizer ({objective}): {len(store.site_labels)} sites ranked, {len(steps)} greedy step(s) "
+          f"with {evaluated} candidate evaluations in {time.time() - ts:.3f} seconds")
+    return ranking, steps
@@ -1,266 +1,356 @@
 from modules.db_handler import DBHandler
+from modules import db_queries as queries
+from modules.dt_switchoff_engine import SwitchOffStore, get_session, get_store
+from modules.dt_dismantle_optimizer import optimize_dismantle
+from modules.dt_switchoff_tiled import switch_off_raster_tiled
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import time as time
 import numpy as np
 
 
+# Threads running independent fetches next to the request thread (each on its own pooled connection, keep it below
+# IPRISM_DB_POOL_MAX)
+STAGE_WORKERS = int(os.environ.get('IPRISM_STAGE_WORKERS', 4))
+
+_stage_pool = None
+_stage_pool_lock = threading.Lock()
+
+
 class dt_geosimulator(DBHandler):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)  # Initializing the base class
+        self.stage_timings = {}  # seconds per stage of the last sql switch-off
    
-    def pix_data_site_switch_off(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi, sites_sw_off):
+    def pix_data_site_switch_off(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi, sites_sw_off,
+                                 engine='sql', session=None):
         #Method to fetch data from pixel_agg, pixel_sector table and simulate site switch-offs."""
-
+        # kpi is one KPI (adjusted values in column 'kpi') or a list of KPIs, all fetched and adjusted from the same
+        # simulation (one column per KPI, see db_queries.kpi_column)
+        # engine='sql' queries the affected sectors per request, engine='memory' runs on the scenario's
+        # in-memory store (modules.dt_switchoff_engine, loaded once per process and data version),
+        # engine='server' lets the database aggregate the switch-off and returns only the final pixel rows
+        # session (any hashable key, memory engine): the switch-off is updated incrementally from the site list of
+        # the previous call with the same key, only the pixels of the added / removed sites are recomputed
+
+        if engine == 'memory' or session is not None:
+            return self._switch_off_memory(rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi, sites_sw_off,
+                                           session)
+        if engine not in ('sql', 'server'):
+            raise ValueError(f"Unknown switch-off engine {engine!r}")
+
+        scenario = dict(scenario_traffic=scenario_traffic, scenario_optim=scenario_optim, year=year)
+        agg_params = dict(scenario, rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+
+        slice_query, slice_identifiers = kpi_query(queries.PIXEL_AGG_SLICE, kpi)
         if sites_sw_off is None or not sites_sw_off:
-            agg_query = f"""
-                SELECT index, latitude_50, longitude_50, geo_rsrp, geo_cqi, {kpi}
-                FROM pixel_agg
-                WHERE 
-                    scenario_traffic = {scenario_traffic} AND
-                    scenario_optim = {scenario_optim} AND
-                    year = {year} AND
-                    geo_rsrp >= {rsrp_min} AND
-                    geo_rsrp <= {rsrp_max} AND
-                    geo_cqi >= {cqi_min} AND
-                    geo_cqi <= {cqi_max}
-                """
-                
-            ts=time.time()
-            data_agg=self.execute(agg_query)
-            df = pd.DataFrame(data_agg, columns=['index', 'latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi', 'kpi'])
+            df = self.fetch_query(slice_query, agg_params, read_only=True, **slice_identifiers)
             return df
 
-        # Fetch detailed sector info
-        sector_query = f"""
-            SELECT ps.index, 
-                ps.Site_ID, 
-                ps.geo_user_tput_dl, 
-                ps.geo_churn_prob, 
-                ps.geo_cap_demand, 
-                ps.geo_served_demand, 
-                ps.geo_latent_demand, 
-                ps.geo_rsrp, 
-                ps.geo_cqi, 
-                ps.COUNT_SAMPLES
-            FROM pixel_sector ps
-            INNER JOIN (
-            SELECT DISTINCT index 
-            FROM pixel_sector 
-            WHERE 
-                Site_ID IN ({','.join(["'" + str(site) + "'" for site in sites_sw_off])}) AND
-                scenario_traffic = {scenario_traffic} AND
-                scenario_optim = {scenario_optim} AND
-                year = {year}
-            ) as affected_pixels ON ps.index = affected_pixels.index
-            WHERE
-                scenario_traffic = {scenario_traffic} AND
-                scenario_optim = {scenario_optim} AND
-                year = {year}
-            """
-        
-        sector_query2 = f"""
-        SELECT ps.index, 
-                ps.Site_ID, 
-                ps.geo_user_tput_dl, 
-                ps.geo_churn_prob, 
-                ps.geo_cap_demand, 
-                ps.geo_served_demand, 
-                ps.geo_latent_demand, 
-                ps.geo_rsrp, 
-                ps.geo_cqi, 
-                ps.COUNT_SAMPLES
-        FROM pixel_sector ps
-        WHERE 
-            ps.Site_ID IN ({','.join(["'" + str(site) + "'" for site in sites_sw_off])}) AND
-            ps.scenario_optim = {scenario_optim} AND
-            ps.scenario_traffic = {scenario_traffic} AND
-            ps.year = {year}  
-        """
+        if engine == 'server':
+            # One round trip: affected pixels, sector aggregation and the pixel_agg join run on the server
+            ts = time.time()
+            query, identifiers = kpi_query(queries.SWITCHOFF_AGG_SLICE, kpi)
+            df = self.fetch_query(query, dict(agg_params, site_ids=[str(site) for site in sites_sw_off]), read_only=True,
+                                  **identifiers)
+            print(f"Server-side switch-off query execution time: {time.time() - ts} seconds")
+            self.check_deadline('KPI adjustment')
+            return apply_switch_off(df, None, kpi)
 
         print('Fetching Switchoff Sectors data')
-        #slice of pixel_sector for Site_ID from switch off list
-        #ts=time.time()
-        #sector_data = self.execute(sector_query2)
-        #te=time.time()-ts
-        #detailed_sector_df = pd.DataFrame(sector_data, columns=['index', 'Site_ID', 'geo_user_tput_dl', 'geo_churn_prob', 'geo_cap_demand', 'geo_served_demand', 'geo_latent_demand', 'geo_rsrp', 'geo_cqi', 'COUNT_SAMPLES'])
-
-
-        #print('detailed_sector_df', detailed_sector_df)
-        #print('Done\n')
-        #print('Time SQL', te)
 
-
-        # Two part data fetching:
-        ### TEst part of the code with SQL queries split to 2 parts:
+        # Part1 -> Part2 -> simulation depend on each other, the pixel_agg slice does not: it is fetched on its own
+        # connection in a stage thread meanwhile, so the latency is the longer of the two chains, not their sum
+        timings = {}
+        ts = time.time()
+        slice_future = self._fetch_concurrently(timings, 'pixel_agg', slice_query, agg_params, **slice_identifiers)
 
         ## Part1
         # Query to fetch distinct indices affected by the sites to be switched off
-        affected_indices_query = f"""
-            SELECT DISTINCT index
-            FROM pixel_sector
-            WHERE 
-                Site_ID IN ({','.join(["'" + str(site) + "'" for site in sites_sw_off])}) AND
-                scenario_traffic = {scenario_traffic} AND
-                scenario_optim = {scenario_optim} AND
-                year = {year}      
-        """
-
-        # Execute the query and fetch data
-        ts = time.time()
-        affected_indices_data = self.execute(affected_indices_query)
-        te = time.time() - ts
-        print(f"Part1 Query execution time: {te} seconds")
-
-        # Convert the data to a DataFrame
-        affected_indices_df = pd.DataFrame(affected_indices_data, columns=['index'])
+        affected_indices_df = timed(timings, 'affected_indices', self.fetch_query, queries.AFFECTED_INDICES,
+                                    dict(scenario, site_ids=[str(site) for site in sites_sw_off]), read_only=True)
 
         # Extract the list of affected indices
         affected_indices = affected_indices_df['index'].tolist()
 
         ## Part2
-        # Construct the query to fetch full data using the affected indices
-        full_data_query = f"""
-            SELECT ps.index, 
-                ps.Site_ID, 
-                ps.geo_user_tput_dl, 
-                ps.geo_churn_prob, 
-                ps.geo_cap_demand, 
-                ps.geo_served_demand, 
-                ps.geo_latent_demand, 
-                ps.geo_rsrp, 
-                ps.geo_cqi, 
-                ps.COUNT_SAMPLES
-            FROM pixel_sector ps
-            WHERE 
-                scenario_traffic = {scenario_traffic} AND
-                scenario_optim = {scenario_optim} AND
-                year = {year} AND
-                ps.index IN ({','.join(["'" + idx + "'" for idx in affected_indices])})
-        """
+        # Fetch full sector data for the affected indices (bound as one array parameter)
+        detailed_sector_df = timed(timings, 'sectors', self.fetch_query, queries.SECTORS_BY_INDEX, dict(scenario, indices=affected_indices),
+                                   read_only=True)
+
+        # Request deadline (DBHandler(deadline=...)) is checked between the stages, the queries themselves are cancelled
+        self.check_deadline('switch-off simulation')
+        sw_off_aggr = timed(timings, 'simulation', switch_off_aggregates, detailed_sector_df, sites_sw_off)
+
+        # Fetch aggregated data from pixel_agg (normally done by now)
+        df = timed(timings, 'pixel_agg_wait', slice_future.result)
+
+        self.check_deadline('KPI adjustment')
+        df = timed(timings, 'adjustment', apply_switch_off, df, sw_off_aggr, kpi)
+        report_timings('Switch-off', timings, time.time() - ts)
+        self.stage_timings = timings
+
+        return df
+
+    def _fetch_concurrently(self, timings, stage, query_def, params, **identifiers):
+        """Future of fetch_query(query_def, params) run in a stage thread on a sibling connection, timed as `stage`."""
+        def fetch():
+            with self.sibling() as handler:
+                return timed(timings, stage, handler.fetch_query, query_def, params, read_only=True, **identifiers)
+        return get_stage_pool().submit(fetch)
+
+    def _switch_off_memory(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi, sites_sw_off,
+                           session=None):
+        store = get_store(self, scenario_traffic, scenario_optim, year)
+        self.check_deadline('switch-off simulation')
 
-        # Measure execution time
         ts = time.time()
-        sector_data = self.execute(full_data_query)
-        te = time.time() - ts
-        print(f"Part2 Query execution time: {te} seconds")
-
-        # Convert the data to a DataFrame
-        detailed_sector_df = pd.DataFrame(sector_data, columns=['index', 'Site_ID', 'geo_user_tput_dl', 'geo_churn_prob', 'geo_cap_demand', 'geo_served_demand', 'geo_latent_demand', 'geo_rsrp', 'geo_cqi', 'COUNT_SAMPLES'])
-
-        ### END OF TEST
-
-
-
-
-        print('Simulating Switch off')
-        # Create unique pixels list and initialize sw_off_aggr DataFrame
-        sw_off_pixels = detailed_sector_df['index'].unique()
-        sw_off_aggr = pd.DataFrame(sw_off_pixels, columns=['index'])
-        sw_off_aggr['coverage_loss'] = 0
-        #sw_off_aggr['new_RSRP'] = 0 #it is inserted during join later
-        #sw_off_aggr['new_CQI'] = 0 #it is inserted during join later
-        sw_off_aggr['offload_coef'] = 0
-
-
-        # Simulate site switch-offs and calculate new KPIs
-        # Separate data into switch-off and remain categories
-        switch_off_data = detailed_sector_df[detailed_sector_df['Site_ID'].isin(sites_sw_off)]
-        remain_data = detailed_sector_df[~detailed_sector_df['Site_ID'].isin(sites_sw_off)]
-
-        # Calculate aggregates for switch-off and remain data
-        agg_switch_off = switch_off_data.groupby('index')['geo_served_demand'].sum().fillna(0).rename('traffic_sw_off')
-        agg_remain = remain_data.groupby('index')['geo_served_demand'].sum().fillna(0).rename('traffic_remain')
-
-
-        # Calculate weighted averages for RSRP and CQI
-        weighted_rsrp = (remain_data['geo_rsrp'] * remain_data['COUNT_SAMPLES']).groupby(remain_data['index']).sum() / remain_data.groupby('index')['COUNT_SAMPLES'].sum()
-        weighted_cqi = (remain_data['geo_cqi'] * remain_data['COUNT_SAMPLES']).groupby(remain_data['index']).sum() / remain_data.groupby('index')['COUNT_SAMPLES'].sum()
-
-        # Combine aggregates into sw_off_aggr DataFrame
-        sw_off_aggr = sw_off_aggr.set_index('index')
-        sw_off_aggr = sw_off_aggr.join([agg_switch_off, agg_remain, weighted_rsrp.rename('new_RSRP'), weighted_cqi.rename('new_CQI')])
-        sw_off_aggr['traffic_remain'].fillna(0, inplace=True)    
-
-        sw_off_aggr['traffic_sw_off'] = sw_off_aggr['traffic_sw_off'].astype(float)
-        sw_off_aggr['traffic_remain'] = sw_off_aggr['traffic_remain'].astype(float)
-
-        # Calculate offload_coef and coverage_loss
-        # Calculate 'offload_coef' only where 'traffic_remain' is greater than 0
-        #print('sw_off_aggr.dtypes\n', sw_off_aggr.dtypes)
-        # sw_off_aggr.to_csv('temp_code/sw_off_aggr.csv')
-
-        sw_off_aggr['offload_coef'] = np.where(
-            sw_off_aggr['traffic_remain'] > 0, 
-            (sw_off_aggr['traffic_sw_off'].fillna(0) + sw_off_aggr['traffic_remain']) / sw_off_aggr['traffic_remain'], 
-            0
-        )
-
-        sw_off_aggr['coverage_loss'] = 0
-        sw_off_aggr.loc[(sw_off_aggr['traffic_remain'] == 0) | sw_off_aggr['traffic_remain'].isna(), 'coverage_loss'] = 1
-        sw_off_aggr['offload_coef'].fillna(0, inplace=True)  # Handle division by zero
-
-        #print('sw_off_aggr', sw_off_aggr)
-        #sw_off_aggr.to_csv('temp_code/sw_off_aggr.csv', index=False)
-        print('Done\n')
-
-        print('Fetch aggregated data from pixel_agg')
-        # Fetch aggregated data from pixel_agg
-        agg_query = f"""
-        SELECT index, latitude_50, longitude_50, geo_rsrp, geo_cqi, {kpi}
-        FROM pixel_agg
-        WHERE 
-            scenario_traffic = {scenario_traffic} AND
-            scenario_optim = {scenario_optim} AND
-            year = {year} AND
-            geo_rsrp >= {rsrp_min} AND
-            geo_rsrp <= {rsrp_max} AND
-            geo_cqi >= {cqi_min} AND
-            geo_cqi <= {cqi_max}
+        df = store.pixel_slice(kpi, rsrp_min, rsrp_max, cqi_min, cqi_max, db=self)
+        if session is not None:
+            # Sessions are per scenario, the same key can be reused for another scenario. An empty list resets it.
+            sw_off_aggr = get_session((session, scenario_traffic, scenario_optim, year), store).switch_off(sites_sw_off or [])
+        if sites_sw_off is None or not sites_sw_off:
+            return df
+        if session is None:
+            sw_off_aggr = store.switch_off(sites_sw_off)
+        df = apply_switch_off(df, sw_off_aggr, kpi)
+        print(f"In-memory switch-off of {len(sites_sw_off)} site(s): {len(sw_off_aggr)} affected pixels, {time.time() - ts:.3f} seconds")
+        return df
+
+    def pix_data_site_switch_off_batch(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi,
+                                       candidates, engine='sql', summary=False):
         """
+        pix_data_site_switch_off for several candidate site sets of one scenario.
 
-        
-        ts=time.time()
-        data_agg=self.execute(agg_query)
-        df = pd.DataFrame(data_agg, columns=['index', 'latitude_50', 'longitude_50', 'geo_rsrp', 'geo_cqi', 'kpi'])
-        print('Fetched df:', df)
-        te=time.time()-ts
-        #print('Fetched df:', df)
-        print('Done, SQL time is:,', te)
-
-        #print('---> sw_off_aggr:', sw_off_aggr)
-        # Adjust data in df for switched-off pixels
-        print('Adjusting data in df for switched-off pixels')
-        df = df.merge(sw_off_aggr, on='index', how='left')
+        The pixel_agg slice and the sectors of the union of the candidates' affected pixels are fetched once
+        (engine='sql', or taken from the in-memory store with engine='memory'), then all candidates are evaluated
+        in one vectorized pass (SwitchOffStore.switch_off_batch).
+
+        Returns a list with, per candidate, the adjusted pixel frame or with summary=True its switch_off_summary dict.
+        """
+        if summary and not isinstance(kpi, str):
+            raise ValueError("Batch summaries are computed for a single kpi")
+        candidates = [[str(site) for site in sites] for sites in candidates]
+        scenario = dict(scenario_traffic=scenario_traffic, scenario_optim=scenario_optim, year=year)
+        agg_params = dict(scenario, rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
 
-        #print('df datatypes:\n', df.dtypes)
-
-        #df.to_csv('temp_code/df_before.csv')
-        # Logic for adjusting the KPIs
-        df['kpi']=df['kpi'].astype(float)
-        df.loc[df['coverage_loss'] == 1, 'kpi'] = None
-        df.loc[df['coverage_loss'] == 1, 'coverage_loss'] = 1
-        if kpi == 'geo_user_tput_dl':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] /= df['offload_coef']
-        if kpi == 'geo_churn_prob':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] *= df['offload_coef']
-        if kpi == 'geo_served_demand':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] *= df['offload_coef']
-        if kpi == 'geo_latent_demand':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] *= df['offload_coef']
-        if kpi == 'geo_revenue_potential':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] *= df['offload_coef']
-        if kpi == 'geo_rsrp':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] = df['new_RSRP']
-        if kpi == 'geo_cqi':
-            df.loc[df['coverage_loss'] == 0, 'kpi'] = df['new_CQI']
-
-        #df.to_csv('temp_code/df_after.csv')
-
-        #print('---> output df:', df['kpi'])
+        ts = time.time()
+        if engine == 'memory':
+            store = get_store(self, scenario_traffic, scenario_optim, year)
+            self.check_deadline('switch-off simulation')
+            df = store.pixel_slice(kpi, rsrp_min, rsrp_max, cqi_min, cqi_max, db=self)
+        elif engine == 'sql':
+            all_sites = sorted(set(site for sites in candidates for site in sites))
+            timings = {}
+            query, identifiers = kpi_query(queries.PIXEL_AGG_SLICE, kpi)
+            slice_future = self._fetch_concurrently(timings, 'pixel_agg', query, agg_params, **identifiers)
+            affected_indices_df = timed(timings, 'affected_indices', self.fetch_query, queries.AFFECTED_INDICES,
+                                        dict(scenario, site_ids=all_sites), read_only=True)
+            detailed_sector_df = timed(timings, 'sectors', self.fetch_query, queries.SECTORS_BY_INDEX,
+                                       dict(scenario, indices=affected_indices_df['index'].tolist()), read_only=True)
+            df = timed(timings, 'pixel_agg_wait', slice_future.result)
+            report_timings('Batch switch-off fetch', timings, time.time() - ts)
+            self.stage_timings = timings
+            self.check_deadline('switch-off simulation')
+            # Store over the fetched union only, its CSR indexes drive the same vectorized pass as the memory engine
+            store = SwitchOffStore(detailed_sector_df, df)
+        else:
+            raise ValueError(f"Unknown switch-off engine {engine!r}")
+        print(f"Batch switch-off data for {len(candidates)} candidate(s) ready in {time.time() - ts:.3f} seconds")
 
-        return df
+        ts = time.time()
+        results = []
+        for sites, sw_off_aggr in zip(candidates, store.switch_off_batch(candidates)):
+            self.check_deadline('KPI adjustment')
+            adjusted = apply_switch_off(df, sw_off_aggr, kpi)
+            results.append(switch_off_summary(df, adjusted, sites) if summary else adjusted)
+        print(f"Batch switch-off of {len(candidates)} candidate(s) evaluated in {time.time() - ts:.3f} seconds")
+        return results
+
+    def pix_data_site_switch_off_tiled(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi,
+                                       sites_sw_off, tile_cells=None, raster_filename=None):
+        """
+        Out-of-core pix_data_site_switch_off for large areas: the switch-off runs tile by tile on the server and each
+        tile is rasterised into its window of the output GeoTIFF, see modules.dt_switchoff_tiled.
+        Returns the raster filename (a temporary file unless raster_filename is given, None for an empty slice) instead
+        of a DataFrame.
+        """
+        return switch_off_raster_tiled(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year,
+                                       kpi, sites_sw_off, tile_cells=tile_cells, raster_filename=raster_filename)
 
-    
+    def rank_dismantle_sites(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year,
+                             objective='geo_user_tput_dl', top=20, size=0, pool=200):
+        """
+        Sites whose dismantling costs the least geo_user_tput_dl ('geo_user_tput_dl') or coverage ('coverage')
+        within the RSRP / CQI thresholds, see modules.dt_dismantle_optimizer.
 
+        Returns (ranking DataFrame of the top single sites, greedy plan of `size` sites as a list of dicts).
+        """
+        store = get_store(self, scenario_traffic, scenario_optim, year)
+        self.check_deadline('dismantle optimization')
+        kpi_values = store.kpi('geo_user_tput_dl', self) if objective == 'geo_user_tput_dl' else None
+        return optimize_dismantle(store, objective, store.slice_mask(rsrp_min, rsrp_max, cqi_min, cqi_max), kpi_values,
+                                  top=top, size=size, pool=pool)
+
+
+def get_stage_pool():
+    """Process-wide thread pool running the independent fetch stages of the switch-off requests."""
+    global _stage_pool
+    with _stage_pool_lock:
+        if _stage_pool is None:
+            _stage_pool = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix='iprism-stage')
+        return _stage_pool
+
+
+def timed(timings, stage, run, *args, **kwargs):
+    """run(*args, **kwargs), its duration in seconds recorded as timings[stage]."""
+    ts = time.time()
+    try:
+        return run(*args, **kwargs)
+    finally:
+        timings[stage] = time.time() - ts
+
+
+def report_timings(name, timings, total):
+    stages = ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.items())
+    print(f"{name} stage timings: {stages}; total {total:.3f}s")
+
+
+def switch_off_summary(df, adjusted, sites_sw_off):
+    """
+    Impact of a switch-off in numbers: df is the pixel_agg slice, adjusted the apply_switch_off result of it.
+    Traffic is the geo_served_demand of the switched-off sectors, offloaded where the pixel keeps coverage.
+    """
+    affected = adjusted['coverage_loss'].notna().to_numpy()
+    lost = (adjusted['coverage_loss'] == 1).to_numpy()
+    traffic_sw_off = adjusted['traffic_sw_off'].fillna(0).to_numpy(np.float64)
+    kpi_before = df['kpi'].to_numpy(np.float64)
+    kpi_after = adjusted['kpi'].to_numpy(np.float64)
+    with np.errstate(invalid='ignore'):
+        mean_before = float(np.nanmean(kpi_before)) if np.isfinite(kpi_before).any() else None
+        mean_after = float(np.nanmean(kpi_after)) if np.isfinite(kpi_after).any() else None
+    return {
+        'sites': list(sites_sw_off),
+        'pixels': int(len(adjusted)),
+        'affected_pixels': int(affected.sum()),
+        'coverage_loss_pixels': int(lost.sum()),
+        'traffic_sw_off': float(traffic_sw_off.sum()),
+        'traffic_offloaded': float(traffic_sw_off[affected & ~lost].sum()),
+        'traffic_lost': float(traffic_sw_off[lost].sum()),
+        'kpi_mean_before': mean_before,
+        'kpi_mean_after': mean_after,
+        'kpi_mean_change': None if mean_before is None or mean_after is None else mean_after - mean_before,
+    }
+
+
+def switch_off_aggregates(detailed_sector_df, sites_sw_off):
+    """Per affected pixel: traffic of the switched-off and remaining sectors, new RSRP/CQI, offload_coef and coverage_loss."""
+    print('Simulating Switch off')
+    # Create unique pixels list and initialize sw_off_aggr DataFrame
+    sw_off_pixels = detailed_sector_df['index'].unique()
+    sw_off_aggr = pd.DataFrame(sw_off_pixels, columns=['index'])
+    sw_off_aggr['coverage_loss'] = 0
+    #sw_off_aggr['new_RSRP'] = 0 #it is inserted during join later
+    #sw_off_aggr['new_CQI'] = 0 #it is inserted during join later
+    sw_off_aggr['offload_coef'] = 0
+
+
+    # Simulate site switch-offs and calculate new KPIs
+    # Separate data into switch-off and remain categories
+    switch_off_data = detailed_sector_df[detailed_sector_df['Site_ID'].isin(sites_sw_off)]
+    remain_data = detailed_sector_df[~detailed_sector_df['Site_ID'].isin(sites_sw_off)]
+
+    # Calculate aggregates for switch-off and remain data
+    agg_switch_off = switch_off_data.groupby('index')['geo_served_demand'].sum().fillna(0).rename('traffic_sw_off')
+    agg_remain = remain_data.groupby('index')['geo_served_demand'].sum().fillna(0).rename('traffic_remain')
+
+
+    # Calculate weighted averages for RSRP and CQI
+    weighted_rsrp = (remain_data['geo_rsrp'] * remain_data['COUNT_SAMPLES']).groupby(remain_data['index']).sum() / remain_data.groupby('index')['COUNT_SAMPLES'].sum()
+    weighted_cqi = (remain_data['geo_cqi'] * remain_data['COUNT_SAMPLES']).groupby(remain_data['index']).sum() / remain_data.groupby('index')['COUNT_SAMPLES'].sum()
+
+    # Combine aggregates into sw_off_aggr DataFrame
+    sw_off_aggr = sw_off_aggr.set_index('index')
+    sw_off_aggr = sw_off_aggr.join([agg_switch_off, agg_remain, weighted_rsrp.rename('new_RSRP'), weighted_cqi.rename('new_CQI')])
+    sw_off_aggr['traffic_remain'].fillna(0, inplace=True)    
+
+    sw_off_aggr['traffic_sw_off'] = sw_off_aggr['traffic_sw_off'].astype(float)
+    sw_off_aggr['traffic_remain'] = sw_off_aggr['traffic_remain'].astype(float)
+
+    # Calculate offload_coef and coverage_loss
+    # Calculate 'offload_coef' only where 'traffic_remain' is greater than 0
+    #print('sw_off_aggr.dtypes\n', sw_off_aggr.dtypes)
+    # sw_off_aggr.to_csv('temp_code/sw_off_aggr.csv')
+
+    sw_off_aggr['offload_coef'] = np.where(
+        sw_off_aggr['traffic_remain'] > 0, 
+        (sw_off_aggr['traffic_sw_off'].fillna(0) + sw_off_aggr['traffic_remain']) / sw_off_aggr['traffic_remain'], 
+        0
+    )
+
+    sw_off_aggr['coverage_loss'] = 0
+    sw_off_aggr.loc[(sw_off_aggr['traffic_remain'] == 0) | sw_off_aggr['traffic_remain'].isna(), 'coverage_loss'] = 1
+    sw_off_aggr['offload_coef'].fillna(0, inplace=True)  # Handle division by zero
+
+    #print('sw_off_aggr', sw_off_aggr)
+    #sw_off_aggr.to_csv('temp_code/sw_off_aggr.csv', index=False)
+    print('Done\n')
+
+    return sw_off_aggr
+
+
+# KPI adjustment rules for pixels keeping coverage: (operation, switch-off column). Pixels losing coverage get no
+# value for every KPI, KPIs without a rule keep their value where coverage remains.
+KPI_ADJUSTMENTS = {
+    'geo_user_tput_dl': ('divide', 'offload_coef'),
+    'geo_churn_prob': ('multiply', 'offload_coef'),
+    'geo_served_demand': ('multiply', 'offload_coef'),
+    'geo_latent_demand': ('multiply', 'offload_coef'),
+    'geo_revenue_potential': ('multiply', 'offload_coef'),
+    'geo_rsrp': ('replace', 'new_RSRP'),
+    'geo_cqi': ('replace', 'new_CQI'),
+}
+
+ADJUSTMENT_OPERATIONS = {
+    'divide': np.divide,
+    'multiply': np.multiply,
+    'replace': lambda value, new_value: new_value,
+}
+
+
+def kpi_query(query_def, kpi):
+    """(query, identifiers) of a {kpi} query for one KPI or, for a list, its expand_kpis variant."""
+    if isinstance(kpi, str):
+        return query_def, {'kpi': kpi}
+    return queries.expand_kpis(query_def, kpi), {}
+
+
+def apply_switch_off(df, sw_off_aggr, kpi):
+    """
+    Adjust the pixel_agg KPI column(s) of df with the switch-off aggregates (None if df already carries them).
+    kpi is one KPI (column 'kpi') or a list of KPIs (columns db_queries.kpi_column(kpi)), see KPI_ADJUSTMENTS.
+    """
+    # Adjust data in df for switched-off pixels
+    print('Adjusting data in df for switched-off pixels')
+    # sw_off_aggr=None: the switch-off columns are already joined to df (SWITCHOFF_AGG_SLICE)
+    if sw_off_aggr is not None:
+        df = df.merge(sw_off_aggr, on='index', how='left')
 
+    columns = {'kpi': kpi} if isinstance(kpi, str) else {queries.kpi_column(name): name for name in kpi}
+    coverage_loss = df['coverage_loss'].to_numpy(np.float64)
+    lost = coverage_loss == 1
+    kept = coverage_loss == 0
+    for column, name in columns.items():
+        values = df[column].to_numpy(np.float64, copy=True)
+        rule = KPI_ADJUSTMENTS.get(name)
+        if rule is not None:
+            operation, by = rule
+            values[kept] = ADJUSTMENT_OPERATIONS[operation](values[kept], df[by].to_numpy(np.float64)[kept])
+        values[lost] = np.nan
+        df[column] = values
+
+    return df
@@ -0,0 +1,43 @@
+from modules.db_handler_async import AsyncDBHandler
+from modules import db_queries as queries
+from modules.dt_geosimulator import switch_off_aggregates, apply_switch_off, kpi_query
+
+import asyncio
+import time as time
+
+
+class dt_geosimulator_async(AsyncDBHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)  # Initializing the base class
+
+    async def pix_data_site_switch_off(self, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi, sites_sw_off):
+        #Async dt_geosimulator.pix_data_site_switch_off: the pixel_agg slice is fetched while the affected sectors are."""
+
+        scenario = dict(scenario_traffic=scenario_traffic, scenario_optim=scenario_optim, year=year)
+        agg_params = dict(scenario, rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+        slice_query, slice_identifiers = kpi_query(queries.PIXEL_AGG_SLICE, kpi)
+
+        if sites_sw_off is None or not sites_sw_off:
+            return await self.fetch_query(slice_query, agg_params, **slice_identifiers)
+
+        print('Fetching Switchoff Sectors data')
+        ts = time.time()
+        # Part1 -> Part2 depend on each other, the pixel_agg slice does not: both chains run on their own connection
+        detailed_sector_df, df = await asyncio.gather(
+            self._affected_sectors(scenario, sites_sw_off),
+            self.fetch_query(slice_query, agg_params, **slice_identifiers))
+        te = time.time() - ts
+        print(f"Switch-off queries execution time: {te} seconds")
+
+        # The pandas part is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(self._simulate, detailed_sector_df, df, sites_sw_off, kpi)
+
+    async def _affected_sectors(self, scenario, sites_sw_off):
+        affected_indices_df = await self.fetch_query(queries.AFFECTED_INDICES, dict(scenario, site_ids=[str(site) for site in sites_sw_off]))
+        affected_indices = affected_indices_df['index'].tolist()
+        return await self.fetch_query(queries.SECTORS_BY_INDEX, dict(scenario, indices=affected_indices))
+
+    @staticmethod
+    def _simulate(detailed_sector_df, df, sites_sw_off, kpi):
+        sw_off_aggr = switch_off_aggregates(detailed_sector_df, sites_sw_off)
+        return apply_switch_off(df, sw_off_aggr, kpi)
@@ -0,0 +1,120 @@
+#Version 0.1
+#Change log:
+#18.10.2026 Scenario / year sweep of the site switch-off on a process pool
+
+# Every grid point is one (year, scenario_traffic, scenario_optim) scenario. Workers only receive the connection
+# parameters, the scenario key, the thresholds and the site list: each worker process fetches the switch-off data of
+# its scenario itself (through its own connection pool and result cache) and sends back the switch_off_summary dict,
+# so no DataFrame is ever pickled in either direction.
+# engine='sql' is the default: a sweep touches more scenarios than the in-memory stores keep per process, and loading
+# a whole scenario costs more than fetching the affected sectors once.
+# The pool is started with 'spawn': a forked gunicorn worker would hand its open connections, pool locks and the
+# cache listener thread to the children.
+
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from concurrent.futures.process import BrokenProcessPool
+
+
+SWEEP_WORKERS = int(os.environ.get('IPRISM_SWEEP_WORKERS', os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sweep_pool():
+    """Process-wide sweep pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SWEEP_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def shutdown_sweep_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _run_point(db_params, point, thresholds, kpi, sites, engine, statement_timeout):
+    # Runs in a pool worker: imported here so the parent does not need the simulation stack loaded to submit
+    from modules.dt_geosimulator import dt_geosimulator
+
+    year, scenario_traffic, scenario_optim = point
+    ts = time.time()
+    with dt_geosimulator(**db_params, pooled=True, cache=True, statement_timeout=statement_timeout) as dt_geo:
+        summary = dt_geo.pix_data_site_switch_off_batch(*thresholds, scenario_traffic, scenario_optim, year, kpi, [sites],
+                                                        engine=engine, summary=True)[0]
+    summary.update(year=year, traffic_scenario=scenario_traffic, optim_scenario=scenario_optim,
+                   seconds=round(time.time() - ts, 3), worker=os.getpid())
+    return summary
+
+
+def sweep_switch_off(db_params, rsrp_min, rsrp_max, cqi_min, cqi_max, kpi, sites_sw_off, years, traffic_scenarios,
+                     optim_scenarios, engine='sql', timeout=None, statement_timeout=None):
+    """
+    Switch off sites_sw_off in every (year, traffic scenario, optim scenario) of the grid, in parallel.
+
+    Parameters:
+    - db_params (dict): DBHandler connection keyword arguments (host, port, user, password, dbname).
+    - years, traffic_scenarios, optim_scenarios (list): Grid axes.
+    - engine (str): dt_geosimulator.pix_data_site_switch_off_batch engine used by the workers.
+    - timeout (float or None): Overall limit in seconds, TimeoutError when it passes (pending points are cancelled).
+
+    Returns the impact statistics as time series, see sweep_series.
+    """
+    grid = list(itertools.product(years, traffic_scenarios, optim_scenarios))
+    thresholds = (rsrp_min, rsrp_max, cqi_min, cqi_max)
+    sites = [str(site) for site in sites_sw_off]
+
+    ts = time.time()
+    pool = get_sweep_pool()
+    futures = [pool.submit(_run_point, db_params, point, thresholds, kpi, sites, engine, statement_timeout) for point in grid]
+    done, pending = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+    for future in pending:
+        future.cancel()
+    try:
+        points = [future.result() for future in futures if future in done]
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory): start a fresh pool for the next sweep
+        shutdown_sweep_pool()
+        raise
+    if pending:
+        raise TimeoutError(f"Sweep of {len(grid)} scenarios exceeded {timeout} seconds ({len(pending)} not finished)")
+
+    print(f"Sweep of {len(grid)} scenarios on {len(set(point['worker'] for point in points))} worker(s) "
+          f"done in {time.time() - ts:.2f} seconds")
+    return sweep_series(points)
+
+
+def sweep_series(points):
+    """
+    Group sweep points into one time series per (traffic scenario, optim scenario), ordered by year,
+    with the min / max / mean of every numeric impact metric over the years.
+    """
+    metrics = ['affected_pixels', 'coverage_loss_pixels', 'traffic_sw_off', 'traffic_offloaded', 'traffic_lost',
+               'kpi_mean_before', 'kpi_mean_after', 'kpi_mean_change']
+    series = []
+    key = lambda point: (point['traffic_scenario'], point['optim_scenario'])
+    for (traffic_scenario, optim_scenario), group in itertools.groupby(sorted(points, key=key), key=key):
+        group = sorted(group, key=lambda point: point['year'])
+        stats = {}
+        for metric in metrics:
+            values = [point[metric] for point in group if point[metric] is not None]
+            if values:
+                stats[metric] = {'min': min(values), 'max': max(values), 'mean': sum(values) / len(values)}
+        series.append({
+            'traffic_scenario': traffic_scenario,
+            'optim_scenario': optim_scenario,
+            'years': [point['year'] for point in group],
+            'points': [{metric: point[metric] for metric in ['year', 'pixels'] + metrics} for point in group],
+            'stats': stats,
+        })
+    return series
@@ -0,0 +1,434 @@
+#Version 0.3
+#Change log:
+#18.10.2026 In-memory switch-off engine: per-scenario columnar store with CSR site->pixel and pixel->sector indexes
+#18.10.2026 switch_off_batch: several candidate site sets in one vectorized pass
+#18.10.2026 SwitchOffSession: incremental switch-off for interactive site list edits
+#18.10.2026 Store loads keep the statement timeout and deadline of the requesting handler (db.sibling)
+#18.10.2026 Sessions bounded by bytes (IPRISM_SWITCHOFF_SESSIONS_MB) as well as by count, int32 row counters
+#18.10.2026 Sectors with a NULL Site_ID are kept as remaining sectors (own site code, never switched off)
+
+# pixel_sector / pixel_agg of one (scenario_traffic, scenario_optim, year) are loaded once per process into NumPy
+# arrays. Rows of pixel_sector are sorted by pixel, so the serving sectors of pixel p are rows
+# pixel_ptr[p]:pixel_ptr[p + 1]; the pixels served by site s are site_pixels[site_ptr[s]:site_ptr[s + 1]].
+# A switch-off is then a gather of the affected pixels' rows and a few np.bincount reductions, no SQL is sent.
+# Stores are kept in a small LRU and reloaded when the data version of pixel_sector / pixel_agg changes
+# (the versions of modules.db_cache, bumped by DBHandler writes and NOTIFY from other processes).
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from modules.db_cache import get_cache
+from modules import db_queries as queries
+
+
+STORE_MAX_SCENARIOS = int(os.environ.get('IPRISM_SWITCHOFF_STORES', 4))
+STORE_TABLES = ('pixel_sector', 'pixel_agg')
+BATCH_CELLS = int(os.environ.get('IPRISM_SWITCHOFF_BATCH_CELLS', 4_000_000))
+SESSION_TTL = int(os.environ.get('IPRISM_SWITCHOFF_SESSION_TTL', 1800))  # seconds since last use
+SESSION_MAX = int(os.environ.get('IPRISM_SWITCHOFF_SESSIONS', 256))
+# A SwitchOffSession holds dense accumulators over all pixels of its scenario: 48 bytes per pixel (five float64 and
+# two int32 arrays) plus one byte per site, e.g. 4.3 MB for 90 000 pixels, 480 MB for 10 million (session.nbytes).
+# The sessions of a process are bounded by this budget as well as by SESSION_MAX, least recently used first out;
+# a session larger than the whole budget still runs but is not kept between requests.
+SESSION_MAX_BYTES = int(float(os.environ.get('IPRISM_SWITCHOFF_SESSIONS_MB', 512)) * 1024 * 1024)
+
+
+class SwitchOffStore:
+    """
+    Columnar copy of one scenario of pixel_sector (switch-off columns) and pixel_agg (pixel attributes).
+
+    Parameters:
+    - sectors (pd.DataFrame): modules.db_queries.SWITCHOFF_SECTORS result.
+    - pixels (pd.DataFrame): modules.db_queries.SWITCHOFF_PIXELS result (or another pixel_agg frame with its columns).
+    - kpi_loader (callable or None): (kpi, db) -> DataFrame(index, kpi) for pixel_agg, called once per KPI column with
+      the handler of the request that first needs it (see kpi).
+    """
+
+    def __init__(self, sectors, pixels, kpi_loader=None):
+        # Pixel codes cover the pixels of both tables, pixel_agg rows and pixel_sector rows share them
+        pixel_labels = pd.Index(pd.unique(np.concatenate([sectors['index'].to_numpy(object), pixels['index'].to_numpy(object)])))
+        self.pixel_labels = pixel_labels.to_numpy(object)
+        self._pixel_lookup = pixel_labels
+        n_pixels = len(pixel_labels)
+
+        sector_pixel = pixel_labels.get_indexer(sectors['index'])
+        site_codes, site_labels = pd.factorize(sectors['Site_ID'])
+        self.site_labels = np.asarray(site_labels, dtype=object)
+        self._site_lookup = {label: code for code, label in enumerate(self.site_labels)}
+        # Sectors without Site_ID get the code len(site_labels), no site list switches it off (a remaining sector, as
+        # in the SQL and server engines); row_site indexes masks of n_site_codes entries
+        self.n_site_codes = len(self.site_labels) + 1
+        site_codes = np.where(site_codes < 0, len(self.site_labels), site_codes)
+
+        # pixel -> serving sectors (rows sorted by pixel)
+        order = np.argsort(sector_pixel, kind='stable')
+        self.row_pixel = sector_pixel[order].astype(np.int32)
+        self.row_site = site_codes[order].astype(np.int32)
+        self.pixel_ptr = np.zeros(n_pixels + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.row_pixel, minlength=n_pixels), out=self.pixel_ptr[1:])
+
+        # Reduction inputs, NULLs count as 0 like the pandas groupby sums of the SQL engine
+        served = sectors['geo_served_demand'].to_numpy(np.float64)[order]
+        samples = sectors['COUNT_SAMPLES'].to_numpy(np.float64)[order]
+        self.served = np.nan_to_num(served)
+        self.samples = np.nan_to_num(samples)
+        self.rsrp_weighted = np.nan_to_num(sectors['geo_rsrp'].to_numpy(np.float64)[order] * samples)
+        self.cqi_weighted = np.nan_to_num(sectors['geo_cqi'].to_numpy(np.float64)[order] * samples)
+
+        # site -> served pixels: the distinct (site, pixel) pairs grouped by site, sectors without Site_ID left out
+        has_site = site_codes < len(self.site_labels)
+        pairs = np.unique(site_codes[has_site].astype(np.int64) * n_pixels + sector_pixel[has_site])
+        pair_site = pairs // n_pixels
+        self.site_pixels = (pairs % n_pixels).astype(np.int32)
+        self.site_ptr = np.zeros(len(self.site_labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_site, minlength=len(self.site_labels)), out=self.site_ptr[1:])
+
+        # pixel_agg attributes, row order of the pixels frame
+        self.agg_pixel = pixel_labels.get_indexer(pixels['index'])
+        self.agg_latitude = pixels['latitude_50'].to_numpy(np.float64)
+        self.agg_longitude = pixels['longitude_50'].to_numpy(np.float64)
+        self.agg_rsrp = pixels['geo_rsrp'].to_numpy(np.float64)
+        self.agg_cqi = pixels['geo_cqi'].to_numpy(np.float64)
+        self._kpis = {}
+        self._kpi_loader = kpi_loader
+        self._kpi_lock = threading.Lock()
+        self._contributions = None
+
+        self.nbytes = sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+
+    def site_codes(self, sites):
+        """Codes of the known sites (unknown Site_IDs are ignored, as the SQL engine does)."""
+        codes = [self._site_lookup.get(str(site)) for site in sites]
+        return np.array([code for code in codes if code is not None], dtype=np.int64)
+
+    def affected_pixels(self, site_codes):
+        """Distinct pixels served by any of site_codes (sorted pixel codes)."""
+        if len(site_codes) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.site_pixels[self.site_ptr[code]:self.site_ptr[code + 1]] for code in site_codes]))
+
+    def pixel_rows(self, pixels):
+        """(rows, group) of the sector rows serving pixels: group[i] is the position in pixels of rows[i]."""
+        starts = self.pixel_ptr[pixels]
+        counts = self.pixel_ptr[pixels + 1] - starts
+        group = np.repeat(np.arange(len(pixels)), counts)
+        rows = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return rows, group
+
+    def switch_off(self, sites):
+        """
+        Switch-off aggregates per affected pixel, the same frame as dt_geosimulator.switch_off_aggregates:
+        index -> coverage_loss, offload_coef, traffic_sw_off, traffic_remain, new_RSRP, new_CQI
+        """
+        return self.switch_off_batch([sites])[0]
+
+    def switch_off_batch(self, candidates):
+        """
+        switch_off for several site sets at once: the rows of the union of their affected pixels are gathered once
+        and every reduction runs on a (candidates x rows) switched-off mask. Returns one frame per candidate.
+        """
+        codes = [self.site_codes(sites) for sites in candidates]
+        pixels = self.affected_pixels(np.unique(np.concatenate(codes + [np.empty(0, dtype=np.int64)])))
+        rows, group = self.pixel_rows(pixels)
+        n = len(pixels)
+        row_site = self.row_site[rows]
+        served, samples = self.served[rows], self.samples[rows]
+        rsrp_weighted, cqi_weighted = self.rsrp_weighted[rows], self.cqi_weighted[rows]
+
+        frames = []
+        # Candidates per pass, bounded so the (candidates x rows) temporaries stay around BATCH_CELLS elements
+        chunk = max(1, BATCH_CELLS // max(1, len(rows)))
+        for start in range(0, len(codes), chunk):
+            part = codes[start:start + chunk]
+            site_off = np.zeros((len(part), self.n_site_codes), dtype=bool)
+            for i, candidate_codes in enumerate(part):
+                site_off[i, candidate_codes] = True
+            off = site_off[:, row_site]
+            remain = ~off
+            # Candidate i's sums of pixel j land in bin i * n + j
+            key = (np.arange(len(part))[:, None] * n + group).ravel()
+
+            def total(weights):
+                return np.bincount(key, weights=weights.ravel(), minlength=len(part) * n).reshape(len(part), n)
+
+            traffic_sw_off = total(served * off)
+            has_off = total(off) > 0
+            sums = (traffic_sw_off, total(served * remain), total(remain), total(samples * remain),
+                    total(rsrp_weighted * remain), total(cqi_weighted * remain))
+
+            # A candidate's affected pixels are the ones with at least one of its sectors switched off
+            for i in range(len(part)):
+                affected = has_off[i]
+                frames.append(self._aggregates_frame(pixels[affected], *(values[i, affected] for values in sums)))
+        return frames
+
+    def _aggregates_frame(self, pixels, traffic_sw_off, traffic_remain, remain_rows, remain_samples, rsrp_sum, cqi_sum):
+        """switch_off frame of pixels from their switched-off / remaining sector sums."""
+        has_remain = remain_rows > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_rsrp = np.where(has_remain, rsrp_sum / remain_samples, np.nan)
+            new_cqi = np.where(has_remain, cqi_sum / remain_samples, np.nan)
+            offload_coef = np.where(traffic_remain > 0, (traffic_sw_off + traffic_remain) / traffic_remain, 0.0)
+        return pd.DataFrame({
+            'coverage_loss': (traffic_remain == 0).astype(np.int64),
+            'offload_coef': offload_coef,
+            'traffic_sw_off': traffic_sw_off,
+            'traffic_remain': traffic_remain,
+            'new_RSRP': new_rsrp,
+            'new_CQI': new_cqi,
+        }, index=pd.Index(self.pixel_labels[pixels], name='index'))
+
+    def kpi(self, kpi, db=None):
+        """
+        pixel_agg KPI column aligned with the pixel_agg rows of the store (float32, loaded on first use).
+        db is the handler of the calling request: a column loaded now runs under its statement timeout and deadline.
+        """
+        values = self._kpis.get(kpi)
+        if values is None:
+            with self._kpi_lock:
+                values = self._kpis.get(kpi)
+                if values is None:
+                    loaded = self._kpi_loader(kpi, db)
+                    values = np.full(len(self.agg_pixel), np.nan, dtype=np.float32)
+                    position = pd.Index(self.pixel_labels[self.agg_pixel]).get_indexer(loaded['index'])
+                    values[position[position >= 0]] = loaded['kpi'].to_numpy(np.float32)[position >= 0]
+                    self._kpis[kpi] = values
+                    self.nbytes += values.nbytes
+        return values
+
+    def slice_mask(self, rsrp_min, rsrp_max, cqi_min, cqi_max):
+        """Mask of the pixel_agg rows inside the RSRP / CQI thresholds of PIXEL_AGG_SLICE."""
+        # NaN (NULL) fails every comparison, like the SQL predicates
+        with np.errstate(invalid='ignore'):
+            return (self.agg_rsrp >= rsrp_min) & (self.agg_rsrp <= rsrp_max) & (self.agg_cqi >= cqi_min) & (self.agg_cqi <= cqi_max)
+
+    def site_contributions(self):
+        """
+        Per (site, pixel) pair, aligned with site_pixels: geo_served_demand of the site's sectors in the pixel and
+        their number of sectors with traffic; per pixel: total geo_served_demand and sectors with traffic.
+        Computed on first use (dismantle optimizer).
+        """
+        if self._contributions is None:
+            n_pixels = len(self.pixel_labels)
+            has_site = self.row_site < len(self.site_labels)
+            _, pair = np.unique(self.row_site[has_site].astype(np.int64) * n_pixels + self.row_pixel[has_site],
+                                return_inverse=True)
+            positive = self.served > 0
+            self._contributions = (
+                np.bincount(pair, weights=self.served[has_site], minlength=len(self.site_pixels)),
+                np.bincount(pair, weights=positive[has_site], minlength=len(self.site_pixels)).astype(np.int32),
+                np.bincount(self.row_pixel, weights=self.served, minlength=n_pixels),
+                np.bincount(self.row_pixel, weights=positive, minlength=n_pixels).astype(np.int32),
+            )
+        return self._contributions
+
+    def pixel_slice(self, kpi, rsrp_min, rsrp_max, cqi_min, cqi_max, db=None):
+        """
+        The pixel_agg slice of modules.db_queries.PIXEL_AGG_SLICE, filtered in memory.
+        A list of KPIs gives the columns of expand_kpis(PIXEL_AGG_SLICE, kpi) instead of 'kpi'.
+        db: handler of the calling request, loads the KPI columns not in memory yet (see kpi).
+        """
+        mask = self.slice_mask(rsrp_min, rsrp_max, cqi_min, cqi_max)
+        columns = {'kpi': kpi} if isinstance(kpi, str) else {queries.kpi_column(name): name for name in kpi}
+        frame = {
+            'index': self.pixel_labels[self.agg_pixel[mask]],
+            'latitude_50': self.agg_latitude[mask],
+            'longitude_50': self.agg_longitude[mask],
+            'geo_rsrp': self.agg_rsrp[mask].astype(np.float32),
+            'geo_cqi': self.agg_cqi[mask].astype(np.float32),
+        }
+        for column, name in columns.items():
+            frame[column] = self.kpi(name, db)[mask]
+        return pd.DataFrame(frame)
+
+
+class SwitchOffSession:
+    """
+    Incremental switch-off over a SwitchOffStore for an interactive user editing one site list.
+
+    Keeps per-pixel accumulators (switched-off / remaining traffic, remaining sectors and samples, weighted RSRP/CQI
+    sums) for the current site list. set_sites only touches the pixels served by the added or removed sites:
+    their accumulators are recomputed from their sector rows, so one toggle costs O(pixels of one site) and the
+    sums never drift the way repeated += / -= would.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.site_off = np.zeros(store.n_site_codes, dtype=bool)
+        n_pixels = len(store.pixel_labels)
+        self.traffic_sw_off = np.zeros(n_pixels)
+        self.traffic_remain = np.zeros(n_pixels)
+        self.off_rows = np.zeros(n_pixels, dtype=np.int32)
+        self.remain_rows = np.zeros(n_pixels, dtype=np.int32)
+        self.remain_samples = np.zeros(n_pixels)
+        self.rsrp_sum = np.zeros(n_pixels)
+        self.cqi_sum = np.zeros(n_pixels)
+        self.nbytes = sum(value.nbytes for value in vars(self).values() if isinstance(value, np.ndarray))
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_sites(self, sites):
+        """Switch the session to the site list sites, applying only the difference to the current one."""
+        codes = np.zeros(len(self.site_off), dtype=bool)
+        codes[self.store.site_codes(sites)] = True
+        toggled = np.flatnonzero(codes != self.site_off)
+        if len(toggled):
+            self.site_off = codes
+            self._update(self.store.affected_pixels(toggled))
+        return toggled
+
+    def switch_off(self, sites):
+        """store.switch_off(sites), computed incrementally from the previous site list of the session."""
+        with self.lock:
+            self.last_used = time.monotonic()
+            self.set_sites(sites)
+            pixels = np.flatnonzero(self.off_rows)
+            return self.store._aggregates_frame(pixels, self.traffic_sw_off[pixels], self.traffic_remain[pixels],
+                                                self.remain_rows[pixels], self.remain_samples[pixels],
+                                                self.rsrp_sum[pixels], self.cqi_sum[pixels])
+
+    def _update(self, pixels):
+        store = self.store
+        rows, group = store.pixel_rows(pixels)
+        off = self.site_off[store.row_site[rows]]
+        remain = ~off
+        n = len(pixels)
+        self.traffic_sw_off[pixels] = np.bincount(group, weights=store.served[rows] * off, minlength=n)
+        self.traffic_remain[pixels] = np.bincount(group, weights=store.served[rows] * remain, minlength=n)
+        self.off_rows[pixels] = np.bincount(group, weights=off, minlength=n)
+        self.remain_rows[pixels] = np.bincount(group, weights=remain, minlength=n)
+        self.remain_samples[pixels] = np.bincount(group, weights=store.samples[rows] * remain, minlength=n)
+        self.rsrp_sum[pixels] = np.bincount(group, weights=store.rsrp_weighted[rows] * remain, minlength=n)
+        self.cqi_sum[pixels] = np.bincount(group, weights=store.cqi_weighted[rows] * remain, minlength=n)
+
+
+_sessions = OrderedDict()  # session key -> SwitchOffSession
+_sessions_lock = threading.Lock()
+_sessions_bytes = 0
+
+
+def _drop_session(key):
+    global _sessions_bytes
+    session = _sessions.pop(key, None)
+    if session is not None:
+        _sessions_bytes -= session.nbytes
+
+
+def get_session(key, store):
+    """
+    SwitchOffSession of key over store. A session opened on an older store of the scenario (data changed)
+    is replaced, the first set_sites of the new one then computes the whole site list.
+    """
+    global _sessions_bytes
+    now = time.monotonic()
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None or session.store is not store:
+            _drop_session(key)
+            session = SwitchOffSession(store)
+            if session.nbytes > SESSION_MAX_BYTES:
+                print(f"Switch-off session of {session.nbytes / 1e6:.1f} MB over IPRISM_SWITCHOFF_SESSIONS_MB, not kept")
+                return session
+            _sessions[key] = session
+            _sessions_bytes += session.nbytes
+        session.last_used = now
+        _sessions.move_to_end(key)
+        # Least recently used first: expired sessions, then as many as needed to fit SESSION_MAX and SESSION_MAX_BYTES
+        while len(_sessions) > 1:
+            oldest_key, oldest = next(iter(_sessions.items()))
+            if len(_sessions) <= SESSION_MAX and _sessions_bytes <= SESSION_MAX_BYTES and now - oldest.last_used <= SESSION_TTL:
+                break
+            _drop_session(oldest_key)
+        return session
+
+
+def close_session(key):
+    with _sessions_lock:
+        _drop_session(key)
+
+
+_stores = OrderedDict()  # (dsn, scenario) -> (versions, SwitchOffStore)
+_stores_lock = threading.Lock()
+_load_locks = {}
+_stores_pid = os.getpid()
+
+
+def _scenario_key(db, scenario_traffic, scenario_optim, year):
+    return (db.host, int(db.port), db.user, db.password, db.dbname, float(scenario_traffic), int(scenario_optim), int(year))
+
+
+def get_store(db, scenario_traffic, scenario_optim, year):
+    """
+    Process-wide SwitchOffStore of a scenario, loaded with a separate pooled connection of db's database
+    on first use and again whenever pixel_sector / pixel_agg changed.
+    """
+    global _stores_pid
+    key = _scenario_key(db, scenario_traffic, scenario_optim, year)
+    cache = get_cache(db.host, db.port, db.user, db.password, db.dbname)
+
+    with _stores_lock:
+        if _stores_pid != os.getpid():
+            _stores.clear()
+            _load_locks.clear()
+            _stores_pid = os.getpid()
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # One loader per scenario, other requests for it wait for the result instead of loading it again
+    with load_lock:
+        versions = cache.versions(STORE_TABLES)
+        with _stores_lock:
+            entry = _stores.get(key)
+            if entry is not None and entry[0] == versions:
+                _stores.move_to_end(key)
+                return entry[1]
+
+        store = load_store(db, scenario_traffic, scenario_optim, year)
+        with _stores_lock:
+            _stores[key] = (versions, store)
+            _stores.move_to_end(key)
+            while len(_stores) > STORE_MAX_SCENARIOS:
+                _stores.popitem(last=False)
+        return store
+
+
+def _loader(db, **settings):
+    # Own pooled connection: the load must not end up in the result cache nor in db's transaction, it keeps db's
+    # statement timeout and deadline. Reads stay on the primary (no read_only=True): the store is kept under the data
+    # versions of the primary, a lagging replica would pin stale rows to them
+    return db.sibling(pooled=True, cache=False, **settings)
+
+
+def load_store(db, scenario_traffic, scenario_optim, year):
+    """Read one scenario from the database of db into a SwitchOffStore."""
+    scenario = dict(scenario_traffic=scenario_traffic, scenario_optim=scenario_optim, year=year)
+    ts = time.time()
+    with _loader(db) as loader:
+        db.check_deadline('switch-off store sectors')
+        sectors = loader.fetch_query(queries.SWITCHOFF_SECTORS, scenario)
+        db.check_deadline('switch-off store pixels')
+        pixels = loader.fetch_query(queries.SWITCHOFF_PIXELS, scenario)
+
+    def load_kpi(kpi, requester=None):
+        # The store outlives the loading request, a KPI column is loaded under the deadline of the request using it
+        with _loader(requester) if requester is not None else _loader(db, deadline=None) as kpi_loader:
+            return kpi_loader.fetch_query(queries.SWITCHOFF_PIXEL_KPI, scenario, kpi=kpi)
+
+    db.check_deadline('switch-off store index')
+    store = SwitchOffStore(sectors, pixels, load_kpi)
+    print(f"Switch-off store for {scenario} loaded in {time.time() - ts:.2f} seconds "
+          f"({len(sectors)} sector rows, {len(pixels)} pixels, {store.nbytes / 1e6:.1f} MB)")
+    return store
+
+
+def clear_stores():
+    global _sessions_bytes
+    with _stores_lock:
+        _stores.clear()
+    with _sessions_lock:
+        _sessions.clear()
+        _sessions_bytes = 0
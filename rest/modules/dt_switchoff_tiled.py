@@ -0,0 +1,105 @@
+#Version 0.2
+#Change log:
+#18.10.2026 Spatially chunked (out-of-core) site switch-off written straight into the raster
+#18.10.2026 Grid and point placement shared with generate_raster (db_fetcher_geo.point_grid / rasterize_points)
+#18.10.2026 Default output is a tempfile.mkstemp file (not the working directory), removed if the switch-off fails
+
+# Country-scale switch-offs do not fit one DataFrame: the area is cut into square tiles of tile_cells x tile_cells
+# raster cells (latitude_50 / longitude_50 boxes) and every tile is streamed through
+#   fetch (SWITCHOFF_AGG_TILE, one statement per tile) -> KPI adjustment (apply_switch_off) -> rasterisation into the
+#   tile's window of the output GeoTIFF
+# so at most one tile of pixels and one tile of raster are held in memory, whatever the size of the area.
+# The raster grid (origin, size) is fixed up front from the bounds of the pixel_agg slice (PIXEL_AGG_BOUNDS), with
+# the same resolution and conventions as db_fetcher.generate_raster. Point cells are computed on that global grid
+# (not on a per-tile transform, whose rounded origin would move points lying on a cell edge), each tile is fetched
+# with a margin of one cell so no border point is missed.
+
+import os
+import tempfile
+import time
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from modules import db_queries as queries
+from modules.db_fetcher_geo import RASTER_CRS, point_grid, rasterize_points
+
+
+RASTER_RESOLUTION = 56.0 / 111000  # db_fetcher.generate_raster resolution (degrees)
+BLOCK_SIZE = 256  # GeoTIFF block size, tiles are a multiple of it so every window write covers whole blocks
+TILE_CELLS = int(os.environ.get('IPRISM_SWITCHOFF_TILE_CELLS', 1024))
+
+
+def tile_windows(rows, cols, tile_cells):
+    """Windows of tile_cells x tile_cells cells covering a rows x cols raster, row by row."""
+    for row in range(0, rows, tile_cells):
+        for col in range(0, cols, tile_cells):
+            yield Window(col, row, min(tile_cells, cols - col), min(tile_cells, rows - row))
+
+
+def switch_off_raster_tiled(dt_geo, rsrp_min, rsrp_max, cqi_min, cqi_max, scenario_traffic, scenario_optim, year, kpi,
+                            sites_sw_off, tile_cells=None, raster_filename=None):
+    """
+    Switch off sites_sw_off and write the adjusted kpi as a GeoTIFF, one spatial tile at a time.
+
+    Parameters:
+    - dt_geo (dt_geosimulator): Open handler, used for every tile query (and its deadline).
+    - kpi (str): One KPI.
+    - tile_cells (int or None): Tile side in raster cells, rounded up to BLOCK_SIZE (default TILE_CELLS).
+    - raster_filename (str or None): Output path, default a new sector_raster_switchoff_*.tif temporary file
+      (tempfile.mkstemp) that the caller removes.
+
+    Returns the raster filename, or None if the slice has no pixel.
+    """
+    from modules.dt_geosimulator import apply_switch_off
+
+    ts = time.time()
+    tile_cells = -(-(tile_cells or TILE_CELLS) // BLOCK_SIZE) * BLOCK_SIZE
+    agg_params = dict(scenario_traffic=scenario_traffic, scenario_optim=scenario_optim, year=year,
+                      rsrp_min=rsrp_min, rsrp_max=rsrp_max, cqi_min=cqi_min, cqi_max=cqi_max)
+    bounds = dt_geo.fetch_query(queries.PIXEL_AGG_BOUNDS, agg_params, kpi=kpi, read_only=True).iloc[0]
+    if not bounds['pixels']:
+        print('Tiled switch-off: no pixel in the slice')
+        return None
+
+    transform, rows, cols = point_grid(bounds[['lon_min', 'lat_min', 'lon_max', 'lat_max']].to_numpy(np.float64), RASTER_RESOLUTION)
+    xmin, ymax, res = transform.c, transform.f, transform.a
+    tile_params = dict(agg_params, site_ids=[str(site) for site in sites_sw_off])
+    if raster_filename is None:
+        fd, raster_filename = tempfile.mkstemp(prefix='sector_raster_switchoff_', suffix='.tif')
+        os.close(fd)
+
+    tiles, points = 0, 0
+    try:
+        with rasterio.open(raster_filename, 'w', driver='GTiff', height=rows, width=cols, count=1, dtype='float32',
+                           crs=RASTER_CRS, transform=transform, compress='deflate', tiled=True, predictor=2,
+                           blockxsize=BLOCK_SIZE, blockysize=BLOCK_SIZE, BIGTIFF='IF_SAFER') as dst:
+            for window in tile_windows(rows, cols, tile_cells):
+                dt_geo.check_deadline(f'switch-off tile {tiles}')
+                # Box of the tile plus one cell on every side
+                box = dict(lon_min=xmin + (window.col_off - 1) * res, lon_max=xmin + (window.col_off + window.width + 1) * res,
+                           lat_min=ymax - (window.row_off + window.height + 1) * res, lat_max=ymax - (window.row_off - 1) * res)
+                df = dt_geo.fetch_query(queries.SWITCHOFF_AGG_TILE, dict(tile_params, **box), kpi=kpi, read_only=True)
+                out_array = np.zeros((window.height, window.width), dtype=np.float32)
+                if len(df):
+                    df = apply_switch_off(df, None, kpi)
+                    # Row order of a tile depends on the plan of its statement: cells holding two pixels take the value
+                    # of the last one in pixel index order, whatever the tiling
+                    df = df[df['kpi'].notna()].sort_values('index', kind='stable')
+                    # Cells on the global grid, the margin points fall outside the window (they belong to the neighbours)
+                    out_array = rasterize_points(df['longitude_50'], df['latitude_50'], np.round(df['kpi'].to_numpy(np.float64), 2),
+                                                 transform, (window.height, window.width), offset=(window.row_off, window.col_off))
+                    points += len(df)
+                dst.write(out_array, 1, window=window)
+                tiles += 1
+    except BaseException:
+        # No half-written raster is left behind (deadline passed, query cancelled, failed tile)
+        if os.path.exists(raster_filename):
+            os.remove(raster_filename)
+        raise
+
+    print(f"Tiled switch-off: {tiles} tile(s) of {tile_cells} cells, {points} pixels fetched, {rows}x{cols} raster "
+          f"in {time.time() - ts:.2f} seconds")
+    print('Raster is ready', raster_filename)
+    return raster_filename
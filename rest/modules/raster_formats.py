@@ -0,0 +1,30 @@
+#Version 0.1
+#Change log:
+#18.10.2026 Raster file format settings shared by db_fetcher_geo (generate_raster*) and vis_geomaps (colorised outputs)
+
+# Kept apart from the DB and visualization modules so either one imports them without pulling in the other
+# (db_fetcher_geo brings DBHandler / psycopg2 / sqlalchemy, vis_geomaps matplotlib / branca).
+
+import os
+
+
+# Overview resampling of every Cloud-Optimized GeoTIFF output (generate_raster* and vis_geomaps.RASTER_FORMATS):
+# 'nearest' keeps the colormap colors of a colorised raster, any GDAL method ('average', 'mode', ...) can be set
+COG_RESAMPLING = os.environ.get('IPRISM_COG_RESAMPLING', 'nearest')
+
+# File formats of generate_raster*: the tiled deflate GeoTIFF, or a Cloud-Optimized GeoTIFF (same tiling, plus
+# overviews down to one tile, resampled with COG_RESAMPLING unless overview_resampling is given)
+RASTER_FILE_FORMATS = {
+    'GTiff': dict(driver='GTiff', compress='deflate', tiled=True, predictor=2),
+    'COG': dict(driver='COG', compress='deflate', predictor=2, blocksize=256, overviews='auto'),
+}
+
+
+def raster_file_options(raster_format='GTiff', overview_resampling=None):
+    """rasterio.open keyword arguments (driver and creation options) of a generate_raster* output format."""
+    if raster_format not in RASTER_FILE_FORMATS:
+        raise ValueError(f"Unknown raster format {raster_format!r}, expected one of {list(RASTER_FILE_FORMATS)}")
+    options = dict(RASTER_FILE_FORMATS[raster_format])
+    if raster_format == 'COG':
+        options['overview_resampling'] = overview_resampling or COG_RESAMPLING
+    return options
@@ -0,0 +1,4 @@
+# Tests of the modules package, plain unittest test cases. From the rest/ directory:
+#   python -m pytest modules/tests        or        python -m unittest discover -s modules/tests -t .
+# Tests that need PostgreSQL use the IPRISM_TEST_DB_* settings (see modules.tests.utils) and are skipped when the
+# server can not be reached.
@@ -0,0 +1,81 @@
+import unittest
+
+import matplotlib.cm as cm
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+
+from modules.db_fetcher_geo import RasterArray
+from modules.vis_geomaps import color_indices, color_lut, raster_transform, raster_transform_django_test
+
+
+CMAPS = ['RdYlGn', 'viridis', 'jet']
+VMIN, VMAX, NO_DATA = -5.0, 20.0, -9999.0
+
+
+def sample_raster(seed=0, shape=(37, 53)):
+    """KPI raster with values inside and outside [VMIN, VMAX], the bounds themselves, NaN and no_data cells."""
+    rng = np.random.default_rng(seed)
+    array = (rng.random(shape) * 40 - 12).astype(np.float32)
+    array[rng.random(shape) < 0.1] = np.nan
+    array[rng.random(shape) < 0.05] = NO_DATA
+    array[0, :4] = [VMIN, VMAX, np.nextafter(VMAX, 0), np.nextafter(VMIN, 0)]
+    return RasterArray(array, from_origin(46.0, 24.5, 0.0005, 0.0005), CRS.from_epsg(4326))
+
+
+def read_bands(memfile):
+    with rasterio.open(memfile) as src:
+        return src.read()
+
+
+class ColorLutTest(unittest.TestCase):
+
+    def test_django_lut_same_as_float(self):
+        raster = sample_raster()
+        for cmap_name in CMAPS:
+            lut = raster_transform_django_test(raster, VMIN, VMAX, cmap_name, 6, NO_DATA, colorize='lut')
+            ref = raster_transform_django_test(raster, VMIN, VMAX, cmap_name, 6, NO_DATA, colorize='float')
+            for lut_file, ref_file, bands in zip(lut[:2], ref[:2], (3, 4)):
+                self.assertEqual(lut_file.getvalue(), ref_file.getvalue(), cmap_name)
+                self.assertEqual(read_bands(lut_file).shape, (bands,) + raster.array.shape)
+            self.assertEqual(lut[2], ref[2], cmap_name)
+            self.assertEqual(lut[3], ref[3], cmap_name)
+
+    def test_lut_array_same_as_float(self):
+        raster = sample_raster(1)
+        for cmap_name in CMAPS:
+            colored, legend, bounds = raster_transform(raster, VMIN, VMAX, cmap_name, 5, NO_DATA, colorize='lut')
+            reference, ref_legend, ref_bounds = raster_transform(raster, VMIN, VMAX, cmap_name, 5, NO_DATA, colorize='float')
+            self.assertEqual(colored.dtype, np.uint8)
+            np.testing.assert_array_equal(colored, (reference * 255).astype(np.uint8), err_msg=cmap_name)
+            self.assertEqual((legend, bounds), (ref_legend, ref_bounds))
+
+    def test_color_indices(self):
+        array = sample_raster(2).array
+        n_colors = cm.get_cmap('viridis').N
+        indices = color_indices(array, VMIN, VMAX, NO_DATA, n_colors)
+        for chunk_rows in (1, 5, 1000):
+            np.testing.assert_array_equal(color_indices(array, VMIN, VMAX, NO_DATA, n_colors, chunk_rows=chunk_rows), indices)
+        missing = np.isnan(array) | (array == NO_DATA)
+        self.assertTrue((indices[missing] == n_colors).all())
+        self.assertTrue((indices[~missing] < n_colors).all())
+        self.assertEqual(indices[0, 0], 0)  # vmin
+        self.assertEqual(indices[0, 1], n_colors - 1)  # vmax
+
+    def test_color_lut(self):
+        for cmap_name in CMAPS:
+            cmap = cm.get_cmap(cmap_name)
+            lut = color_lut(cmap_name)
+            self.assertEqual(lut.shape, (cmap.N + 1, 4))
+            self.assertEqual(lut.dtype, np.uint8)
+            np.testing.assert_array_equal(lut[-1], [0, 0, 0, 0])
+            np.testing.assert_array_equal(lut[:-1], (cmap(np.arange(cmap.N)) * 255).astype(np.uint8))
+
+    def test_outputs(self):
+        raster = sample_raster()
+        rgb, rgba, _, _ = raster_transform_django_test(raster, VMIN, VMAX, 'RdYlGn', 6, NO_DATA, outputs=('rgba',))
+        self.assertIsNone(rgb)
+        self.assertEqual(read_bands(rgba).shape[0], 4)
+        with self.assertRaisesRegex(ValueError, 'png'):
+            raster_transform_django_test(raster, VMIN, VMAX, 'RdYlGn', 6, NO_DATA, outputs=('rgb', 'png'))
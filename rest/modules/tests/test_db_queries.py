@@ -0,0 +1,78 @@
+import unittest
+
+from psycopg2.extensions import adapt
+
+from modules import db_queries as queries
+from modules.db_queries import QueryDef, RenderedQuery, as_list
+
+
+def rendered(text, **identifiers):
+    return QueryDef('test', text, ['a'], identifiers={name: {value} for name, value in identifiers.items()}).render(**identifiers)
+
+
+class RenderedQueryTest(unittest.TestCase):
+
+    def body(self, query):
+        prefix = f"PREPARE {query.name} AS "
+        self.assertTrue(query.prepare_sql.startswith(prefix))
+        return query.prepare_sql[len(prefix):]
+
+    def test_placeholders_numbered_in_order_of_appearance(self):
+        query = rendered("SELECT a FROM t WHERE b = %(b)s AND a = %(a)s")
+        self.assertEqual(query.param_names, ['b', 'a'])
+        self.assertEqual(self.body(query), "SELECT a FROM t WHERE b = $1 AND a = $2")
+        self.assertEqual(query.execute_sql, f"EXECUTE {query.name} (%s, %s)")
+
+    def test_repeated_name_is_one_parameter(self):
+        query = rendered("SELECT a FROM t WHERE x > %(low)s AND y > %(low)s AND z < %(high)s AND w > %(low)s")
+        self.assertEqual(query.param_names, ['low', 'high'])
+        self.assertEqual(self.body(query), "SELECT a FROM t WHERE x > $1 AND y > $1 AND z < $2 AND w > $1")
+        self.assertEqual(query.values({'high': 9, 'low': 1, 'unused': 5}), [1, 9])
+
+    def test_percent_escape(self):
+        query = rendered("SELECT a FROM t WHERE name LIKE 'Site%%' AND b = %(b)s AND c = '100%%(b)s'")
+        self.assertEqual(query.param_names, ['b'])
+        self.assertEqual(self.body(query), "SELECT a FROM t WHERE name LIKE 'Site%' AND b = $1 AND c = '100%(b)s'")
+
+    def test_no_parameters(self):
+        query = rendered("SELECT a FROM t")
+        self.assertEqual(query.param_names, [])
+        self.assertEqual(query.execute_sql, f"EXECUTE {query.name}")
+        self.assertEqual(query.values({}), [])
+
+    def test_any_array_parameter(self):
+        query = rendered("SELECT a FROM t WHERE year = %(year)s AND site = ANY(%(site_ids)s)")
+        self.assertEqual(self.body(query), "SELECT a FROM t WHERE year = $1 AND site = ANY($2)")
+        values = query.values({'site_ids': as_list(['Site_1', 'Site_2']), 'year': 2})
+        self.assertEqual(values, [2, ['Site_1', 'Site_2']])
+        # A list is sent as one ARRAY value, not spread over several placeholders
+        self.assertEqual(adapt([3, 4]).getquoted(), b'ARRAY[3,4]')
+        self.assertEqual(as_list('Site_1'), ['Site_1'])
+
+    def test_missing_parameter(self):
+        query = rendered("SELECT a FROM t WHERE b = %(b)s AND c = %(c)s")
+        with self.assertRaisesRegex(ValueError, r"\['c'\]"):
+            query.values({'b': 1})
+
+    def test_identifiers(self):
+        query = rendered("SELECT {kpi} FROM t WHERE b = %(b)s", kpi='geo_rsrp')
+        self.assertEqual(self.body(query), "SELECT geo_rsrp FROM t WHERE b = $1")
+        # Statement names differ with the rendered text and a rendering is reused
+        self.assertNotEqual(query.name, rendered("SELECT {kpi} FROM t WHERE b = %(b)s", kpi='geo_cqi').name)
+        self.assertIs(queries.SECTOR_DATA_PIX.render(kpi='geo_rsrp'), queries.SECTOR_DATA_PIX.render(kpi='geo_rsrp'))
+        with self.assertRaises(ValueError):
+            queries.SECTOR_DATA_PIX.render(kpi='geo_rsrp; DROP TABLE pixel_agg')
+
+    def test_repo_queries(self):
+        # Every definition renders to a statement whose $n cover its parameters exactly once each
+        for query_def in vars(queries).values():
+            if not isinstance(query_def, QueryDef):
+                continue
+            identifiers = {name: next(iter(sorted(whitelist))) if isinstance(whitelist, (set, frozenset)) else 'a'
+                           for name, whitelist in query_def.identifiers.items()}
+            query = query_def.render(**identifiers)
+            self.assertIsInstance(query, RenderedQuery)
+            self.assertNotIn('%(', self.body(query), query_def.name)
+            for position in range(1, len(query.param_names) + 1):
+                self.assertIn(f"${position}", self.body(query), query_def.name)
+            self.assertNotIn(f"${len(query.param_names) + 1}", self.body(query), query_def.name)
@@ -0,0 +1,82 @@
+import unittest
+
+import numpy as np
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
+
+from modules.db_fetcher_geo import point_grid, points_raster, rasterize_points
+from modules.dt_switchoff_tiled import tile_windows
+
+
+RESOLUTION = 56.0 / 111000
+
+
+def reference_raster(lon, lat, kpi, resolution):
+    """The GeoPandas / rasterio.features.rasterize path generate_raster used before the NumPy rasterizer."""
+    valid = ~np.isnan(kpi)
+    lon, lat, kpi = lon[valid], lat[valid], np.round(kpi[valid], 2)
+    xmin, ymin, xmax, ymax = lon.min(), lat.min(), lon.max(), lat.max()
+    transform = from_origin(xmin, ymax, resolution, resolution)
+    shapes = [({'type': 'Point', 'coordinates': (x, y)}, value) for x, y, value in zip(lon, lat, kpi)]
+    out_shape = (int((ymax - ymin) / resolution), int((xmax - xmin) / resolution))
+    return rasterize(shapes=shapes, transform=transform, out_shape=out_shape, default_value=0), transform
+
+
+def random_points(seed, n, span=0.05):
+    rng = np.random.default_rng(seed)
+    lon, lat = 46 + rng.random(n) * span, 24 + rng.random(n) * span
+    kpi = np.where(rng.random(n) < 0.1, np.nan, rng.random(n) * 50 - 10)
+    return lon, lat, kpi
+
+
+class RasterizePointsTest(unittest.TestCase):
+
+    def test_same_as_rasterio(self):
+        # Dense points: many cells receive several points, the last one in input order must win in both
+        for seed, n, resolution in ((0, 5000, RESOLUTION), (1, 20000, RESOLUTION), (2, 3000, 315.0 / 111000)):
+            lon, lat, kpi = random_points(seed, n)
+            expected, expected_transform = reference_raster(lon, lat, kpi, resolution)
+            out_array, transform = points_raster(lon, lat, kpi, resolution)
+            self.assertEqual(transform, expected_transform)
+            self.assertEqual(out_array.dtype, np.float32)
+
+            # GDAL places points through the inverse geotransform, which can round the westernmost / northernmost
+            # point (exactly on the grid origin) just outside and drop it; rasterize_points keeps them
+            valid = ~np.isnan(kpi)
+            edge = valid & ((lon == lon[valid].min()) | (lat == lat[valid].max()))
+            edge_cells = {(int((transform.f - y) // resolution), int((x - transform.c) // resolution))
+                          for x, y in zip(lon[edge], lat[edge])}
+            same = np.ones(out_array.shape, dtype=bool)
+            for cell in edge_cells:
+                same[cell] = False
+            np.testing.assert_array_equal(out_array[same], expected.astype(np.float32)[same])
+            for row, col in edge_cells:
+                in_cell = valid & (np.floor((transform.f - lat) / resolution) == row) & (np.floor((lon - transform.c) / resolution) == col)
+                self.assertEqual(out_array[row, col], np.float32(np.round(kpi[in_cell][-1], 2)))
+
+    def test_last_point_wins(self):
+        transform = from_origin(0, 3, 1, 1)
+        out_array = rasterize_points([0.5, 1.5, 0.6, 2.5], [2.5, 1.5, 2.4, 0.5], [1, 2, 3, 4], transform, (3, 3))
+        np.testing.assert_array_equal(out_array, [[3, 0, 0], [0, 2, 0], [0, 0, 4]])
+
+    def test_points_outside_are_dropped(self):
+        transform = from_origin(0, 2, 1, 1)
+        out_array = rasterize_points([-0.5, 0.5, 2.5, 1.5, 0.5], [1.5, 1.5, 0.5, -0.5, 0.5], [1, 2, 3, 4, 5], transform, (2, 2))
+        np.testing.assert_array_equal(out_array, [[2, 0], [5, 0]])
+
+    def test_windows_match_full_grid(self):
+        # Windows rasterised with an offset on the global grid stitch back into the full raster (tiled switch-off)
+        lon, lat, kpi = random_points(3, 20000, span=0.2)
+        valid = ~np.isnan(kpi)
+        lon, lat, kpi = lon[valid], lat[valid], kpi[valid]
+        transform, rows, cols = point_grid((lon.min(), lat.min(), lon.max(), lat.max()), RESOLUTION)
+        full = rasterize_points(lon, lat, kpi, transform, (rows, cols))
+        stitched = np.full((rows, cols), np.nan, dtype=np.float32)
+        for window in tile_windows(rows, cols, 100):
+            stitched[window.toslices()] = rasterize_points(lon, lat, kpi, transform, (window.height, window.width),
+                                                            offset=(window.row_off, window.col_off))
+        np.testing.assert_array_equal(stitched, full)
+
+    def test_empty(self):
+        out_array = rasterize_points([], [], [], from_origin(0, 2, 1, 1), (2, 2))
+        np.testing.assert_array_equal(out_array, np.zeros((2, 2), dtype=np.float32))
@@ -0,0 +1,210 @@
+import contextlib
+import io
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from modules.db_handler import DBHandler
+from modules.dt_geosimulator import dt_geosimulator, switch_off_aggregates
+from modules.dt_switchoff_engine import SwitchOffSession, SwitchOffStore, clear_stores
+from modules.tests.utils import TEST_DB, requires_db
+
+
+SCENARIO = dict(scenario_traffic=1.3, scenario_optim=0, year=0)
+SLICE = (-130, -50, 5, 13)  # rsrp_min, rsrp_max, cqi_min, cqi_max
+KPI = 'geo_user_tput_dl'
+N_SITES = 6
+GRID = 8
+
+# Production pixel_sector / pixel_agg columns, the scenario keys and coordinates are NUMERIC there
+KPI_COLUMNS = ['geo_user_tput_dl', 'geo_churn_prob', 'geo_cap_demand', 'geo_served_demand', 'geo_latent_demand',
+               'geo_revenue_potential', 'geo_rsrp', 'geo_cqi']
+PIXEL_SECTOR_DDL = ("CREATE TABLE pixel_sector (index text, site_id text, sector_id text, latitude_50 numeric, "
+                    "longitude_50 numeric, scenario_traffic numeric, scenario_optim integer, year integer, "
+                    + ', '.join(f"{column} numeric" for column in KPI_COLUMNS) + ", count_samples integer)")
+PIXEL_AGG_DDL = ("CREATE TABLE pixel_agg (index text, latitude_50 numeric, longitude_50 numeric, scenario_traffic numeric, "
+                 "scenario_optim integer, year integer, "
+                 + ', '.join(f"{column} numeric" for column in KPI_COLUMNS) + ", best_server text)")
+
+
+def synthetic_scenario(seed=0):
+    """
+    pixel_sector / pixel_agg rows of a GRID x GRID area served by N_SITES sites, for SCENARIO and one other year.
+
+    Pixel 0 is served by Site_0 alone (all its sectors go off with Site_0), pixel 1 by two sectors of Site_0 and
+    one of Site_1 (sites overlapping in a pixel); the others by 1 to 3 random sites. Pixel 2 has one more sector
+    with a NULL site_id (never switched off), one sector has a NULL geo_served_demand, one pixel a NULL KPI and some
+    pixels fall outside the RSRP / CQI slice.
+    """
+    rng = np.random.default_rng(seed)
+    res = 56.0 / 111000
+    sectors, pixels = [], []
+    for year in (SCENARIO['year'], SCENARIO['year'] + 1):
+        for pixel in range(GRID * GRID):
+            lat, lon = round(24.0 + (pixel // GRID + 0.5) * res, 6), round(46.0 + (pixel % GRID + 0.5) * res, 6)
+            if pixel == 0:
+                sites = [0]
+            elif pixel == 1:
+                sites = [0, 0, 1]
+            else:
+                sites = list(rng.choice(N_SITES, size=rng.integers(1, 4), replace=False))
+            if pixel == 2:
+                sites.append(None)
+            rows = []
+            for rank, site in enumerate(sites):
+                site_id = None if site is None else f"Site_{site}"
+                rows.append(dict(index=f"{lat}_{lon}", site_id=site_id, sector_id=f"{site_id or 'NoSite'}_{rank}",
+                                 latitude_50=lat, longitude_50=lon, year=year,
+                                 geo_user_tput_dl=rng.random() * 13, geo_churn_prob=rng.random() * 0.5,
+                                 geo_cap_demand=rng.random() - 0.5, geo_served_demand=rng.random() * 2,
+                                 geo_latent_demand=rng.random() * 0.2, geo_revenue_potential=rng.random() * 2000,
+                                 geo_rsrp=-125 + rng.random() * 70, geo_cqi=4 + rng.random() * 10,
+                                 count_samples=int(rng.integers(1, 50))))
+            if pixel == 5:
+                rows[0]['geo_served_demand'] = None
+            sectors += rows
+            frame = pd.DataFrame(rows)
+            pixels.append(dict(index=f"{lat}_{lon}", latitude_50=lat, longitude_50=lon, year=year,
+                               **{column: frame[column].mean() for column in KPI_COLUMNS},
+                               best_server=rows[0]['sector_id']))
+            pixels[-1].update(geo_served_demand=frame['geo_served_demand'].sum(), geo_rsrp=frame['geo_rsrp'].max(),
+                              geo_cqi=frame['geo_cqi'].max())
+            if pixel == 7:
+                pixels[-1][KPI] = None
+    sectors, pixels = pd.DataFrame(sectors), pd.DataFrame(pixels)
+    for frame in (sectors, pixels):
+        frame['scenario_traffic'] = SCENARIO['scenario_traffic']
+        frame['scenario_optim'] = SCENARIO['scenario_optim']
+    return sectors, pixels
+
+
+# Site lists covering single sites, overlapping sites, every site (all sectors of every pixel off), unknown and
+# repeated sites
+CANDIDATES = [['Site_0'], ['Site_0', 'Site_1'], ['Site_2', 'Site_3', 'Site_4'], [f"Site_{site}" for site in range(N_SITES)],
+              ['Site_nope', 'Site_5'], ['Site_1', 'Site_1']]
+
+
+@requires_db
+class SwitchOffParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        sectors, pixels = synthetic_scenario()
+        with DBHandler(**TEST_DB) as db, contextlib.redirect_stdout(io.StringIO()):
+            for table, ddl, frame in (('pixel_sector', PIXEL_SECTOR_DDL, sectors), ('pixel_agg', PIXEL_AGG_DDL, pixels)):
+                db.execute(f"DROP TABLE IF EXISTS {table}")
+                db.execute(ddl)
+                db.df_to_sql(frame, table, if_exists='append', method='copy')
+        clear_stores()
+        cls.geo = dt_geosimulator(**TEST_DB)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geo.close()
+        clear_stores()
+        with DBHandler(**TEST_DB) as db:
+            db.execute("DROP TABLE IF EXISTS pixel_sector")
+            db.execute("DROP TABLE IF EXISTS pixel_agg")
+
+    def switch_off(self, sites, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.geo.pix_data_site_switch_off(*SLICE, SCENARIO['scenario_traffic'], SCENARIO['scenario_optim'],
+                                                     SCENARIO['year'], KPI, sites, **kwargs)
+
+    def batch(self, candidates, engine):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.geo.pix_data_site_switch_off_batch(*SLICE, SCENARIO['scenario_traffic'], SCENARIO['scenario_optim'],
+                                                           SCENARIO['year'], KPI, candidates, engine=engine)
+
+    def assertSameFrame(self, expected, actual, label):
+        self.assertEqual(list(expected.columns), list(actual.columns), label)
+        expected = expected.sort_values('index').reset_index(drop=True)
+        actual = actual.sort_values('index').reset_index(drop=True)
+        self.assertEqual(expected['index'].tolist(), actual['index'].tolist(), label)
+        for column in expected.columns.drop('index'):
+            np.testing.assert_allclose(pd.to_numeric(actual[column]).astype(float), pd.to_numeric(expected[column]).astype(float),
+                                       rtol=1e-5, atol=1e-6, equal_nan=True, err_msg=f"{label}: {column}")
+
+    def test_scenario_cases(self):
+        # The reference result contains the cases the parity checks are about
+        result = self.switch_off(['Site_0', 'Site_1'], engine='sql').set_index('index')
+        affected = result[result['coverage_loss'].notna()]
+        self.assertGreater(len(affected), 2)
+        self.assertTrue((affected['coverage_loss'] == 1).any())  # every sector of the pixel is off
+        self.assertTrue((affected['coverage_loss'] == 0).any())
+        self.assertTrue(result['kpi'].isna().any())  # NULL KPI pixel
+        everything = self.switch_off(CANDIDATES[3], engine='sql').set_index('index')
+        everything = everything[everything['coverage_loss'].notna()]
+        sectors = synthetic_scenario()[0]
+        no_site = sectors.loc[sectors['site_id'].isna(), 'index'].iloc[0]
+        self.assertEqual(everything.loc[no_site, 'coverage_loss'], 0)  # the sector without site stays on air
+        self.assertTrue((everything.drop(no_site)['coverage_loss'] == 1).all())
+
+    def test_engines(self):
+        for sites in CANDIDATES:
+            expected = self.switch_off(sites, engine='sql')
+            for engine in ('memory', 'server'):
+                self.assertSameFrame(expected, self.switch_off(sites, engine=engine), f"{engine} {sites}")
+
+    def test_batch(self):
+        expected = [self.switch_off(sites, engine='sql') for sites in CANDIDATES]
+        for engine in ('sql', 'memory'):
+            for sites, reference, frame in zip(CANDIDATES, expected, self.batch(CANDIDATES, engine)):
+                self.assertSameFrame(reference, frame, f"batch {engine} {sites}")
+
+    def test_session(self):
+        # One interactive user adding and removing sites, then resetting the list
+        edits = [['Site_0'], ['Site_0', 'Site_1'], ['Site_1'], ['Site_1', 'Site_2', 'Site_3'], CANDIDATES[3], ['Site_4'], []]
+        for sites in edits:
+            session = self.switch_off(sites, engine='memory', session=('test', 1))
+            self.assertSameFrame(self.switch_off(sites, engine='sql'), session, f"session {sites}")
+
+
+class SwitchOffStoreNullSiteTest(unittest.TestCase):
+    """Sectors with a NULL Site_ID remain on air in the store, as in switch_off_aggregates (no database needed)."""
+
+    def setUp(self):
+        sectors, pixels = synthetic_scenario()
+        sectors = sectors[sectors['year'] == SCENARIO['year']].rename(columns={'site_id': 'Site_ID', 'count_samples': 'COUNT_SAMPLES'})
+        sectors = sectors.reset_index(drop=True).astype({'COUNT_SAMPLES': 'float64'})
+        # Pixel 1 also served by a sector without site, pixel 2 by it alone
+        labels = sectors['index'].unique()
+        sectors.loc[sectors.index[sectors['index'] == labels[1]][0], 'Site_ID'] = None
+        sectors.loc[sectors['index'] == labels[2], 'Site_ID'] = None
+        self.sectors = sectors
+        self.store = SwitchOffStore(sectors, pixels[pixels['year'] == SCENARIO['year']])
+
+    def expected(self, sites):
+        affected = self.sectors.loc[self.sectors['Site_ID'].isin(sites), 'index'].unique()
+        with contextlib.redirect_stdout(io.StringIO()):
+            return switch_off_aggregates(self.sectors[self.sectors['index'].isin(affected)], sites)
+
+    def assertSameAggregates(self, expected, actual, label):
+        self.assertEqual(sorted(expected.index), sorted(actual.index), label)
+        actual = actual.loc[expected.index, expected.columns]
+        for column in expected.columns:
+            np.testing.assert_allclose(actual[column].astype(float), expected[column].astype(float), rtol=1e-9,
+                                       equal_nan=True, err_msg=f"{label}: {column}")
+
+    def test_null_site(self):
+        self.assertEqual(len(self.store.site_labels), N_SITES)
+        session = SwitchOffSession(self.store)
+        frames = self.store.switch_off_batch(CANDIDATES)
+        for sites, frame in zip(CANDIDATES, frames):
+            expected = self.expected(sites)
+            self.assertSameAggregates(expected, self.store.switch_off(sites), f"store {sites}")
+            self.assertSameAggregates(expected, frame, f"batch {sites}")
+            self.assertSameAggregates(expected, session.switch_off(sites), f"session {sites}")
+        # Every site off: the pixel keeping its sector without site keeps its coverage
+        everything = self.store.switch_off(CANDIDATES[3])
+        pixel = self.sectors['index'].unique()[1]
+        self.assertEqual(everything.loc[pixel, 'coverage_loss'], 0)
+        self.assertNotIn(self.sectors['index'].unique()[2], everything.index)
+
+    def test_site_contributions(self):
+        pair_served, pair_positive, total_served, positive_rows = self.store.site_contributions()
+        self.assertEqual(len(pair_served), len(self.store.site_pixels))
+        self.assertEqual(len(pair_positive), len(self.store.site_pixels))
+        self.assertAlmostEqual(total_served.sum(), self.sectors['geo_served_demand'].sum())
+        self.assertAlmostEqual(pair_served.sum(), self.sectors.loc[self.sectors['Site_ID'].notna(), 'geo_served_demand'].sum())
@@ -0,0 +1,36 @@
+import os
+import unittest
+
+import psycopg2
+
+from modules.db_handler import connect
+
+
+# Database of the tests that need PostgreSQL (created on first connection). The tests create and drop their own
+# tables in it, never point it to a database holding real data.
+TEST_DB = dict(
+    host=os.environ.get('IPRISM_TEST_DB_HOST', 'iprism-postgres'),
+    port=int(os.environ.get('IPRISM_TEST_DB_PORT', 5432)),
+    user=os.environ.get('IPRISM_TEST_DB_USER', 'postgres'),
+    password=os.environ.get('IPRISM_TEST_DB_PASSWORD', 'smacap'),
+    dbname=os.environ.get('IPRISM_TEST_DB_NAME', 'iprism_test'),
+)
+
+_available = None
+
+
+def db_available():
+    global _available
+    if _available is None:
+        try:
+            connect(**TEST_DB, connect_timeout=3).close()
+            _available = True
+        except psycopg2.Error as e:
+            print(f"Test database unavailable: {e}")
+            _available = False
+    return _available
+
+
+def requires_db(test):
+    """Skip test (case or method) when the IPRISM_TEST_DB_* server can not be reached."""
+    return unittest.skipUnless(db_available(), 'PostgreSQL test database unavailable (IPRISM_TEST_DB_*)')(test)
@@ -3,9 +3,13 @@ import pandas as pd
 import matplotlib.cm as cm
 import matplotlib.colors as mcolors
 import rasterio
+from rasterio.transform import array_bounds
 import branca.colormap as bm
+from functools import lru_cache
 from io import BytesIO
 
+from modules.raster_formats import COG_RESAMPLING
+
 
 
 def create_legend_dict(cmap_str, vmin, vmax, values_num=6):
@@ -211,51 +215,156 @@ def get_visualization_params_kpi(kpi):
 
 
 
-def raster_transform_django_test(raster_file, vmin, vmax, cmap_name, n_legend_entries, no_data):
-    # This is temp copy of raster_transform function used in django test
-    # It returns colorized raster as a file and its path
-    # [Visualization/Folium]
-    # Function returning colorized raster for the folium map engine
-    # It returns colored_raster_as_a_file, colored raster_as_a_path, legend, and bounds
-
-    # Read the raster data
+def read_raster(raster_file):
+    """
+    Band 1 of a raster as (array, transform, crs, (xmin, ymin, xmax, ymax)).
+    raster_file is anything rasterio.open reads (path, file object) or an in-memory
+    db_fetcher_geo.RasterArray, which is used as is (no encode / decode round trip).
+    """
+    if hasattr(raster_file, 'array'):
+        height, width = raster_file.array.shape
+        return raster_file.array, raster_file.transform, raster_file.crs, array_bounds(height, width, raster_file.transform)
     with rasterio.open(raster_file) as src:
-        raster_data = src.read(1)  # Read the first band
-        
-        # Get bounds from the raster file
         bounds = src.bounds
-        ymin, xmin, ymax, xmax = bounds.bottom, bounds.left, bounds.top, bounds.right
-
-        ### TEMP: 3 and 4 channel rasters
-        transform = src.transform  # Get the affine transform (pixel to CRS)
-        crs = src.crs  # Get the coordinate reference system
-        ### END TEMP
-
-    # Ensure the raster data is a numpy array with a numeric type
-    raster_data = np.array(raster_data, dtype=float)  # Convert to float for safe operations
-
-    # Replace no_data values with NaN before clipping
-    raster_data[raster_data == no_data] = np.nan
-
-    # Clipping raster values above and below the max and min
-    raster_data = np.clip(raster_data, vmin, vmax)
-    #print_raster_value_distribution(raster_data, 15)
+        return src.read(1), src.transform, src.crs, (bounds.left, bounds.bottom, bounds.right, bounds.top)
+
+
+# Lookup table colorisation: every cell becomes one index into a (N + 1) x 4 uint8 RGBA table of the colormap
+# (N colors, last entry transparent for NaN / no data) and the bands are gathered from the table directly, instead
+# of an H x W x 4 float64 RGBA intermediate (32 bytes per cell). The indices are computed like matplotlib's
+# Colormap.__call__ (int(normalized * N), 1.0 -> N - 1) and the table holds its colors * 255 truncated, so the
+# result is the same as the float path.
+LUT_CHUNK_ROWS = 512
+
+_color_luts = {}
+
+
+def color_lut(cmap_name):
+    """(N + 1) x 4 uint8 RGBA lookup table of a matplotlib colormap, the last entry transparent."""
+    lut = _color_luts.get(cmap_name)
+    if lut is None:
+        cmap = cm.get_cmap(cmap_name)
+        lut = np.zeros((cmap.N + 1, 4), dtype=np.uint8)
+        lut[:cmap.N] = (cmap(np.arange(cmap.N)) * 255).astype(np.uint8)
+        _color_luts[cmap_name] = lut
+    return lut
+
+
+def color_indices(raster_data, vmin, vmax, no_data, n_colors, chunk_rows=LUT_CHUNK_ROWS):
+    """color_lut index of every cell (n_colors for NaN and no_data), normalized in float64 a few rows at a time."""
+    indices = np.empty(raster_data.shape, dtype=np.uint16)
+    for start in range(0, raster_data.shape[0], chunk_rows):
+        block = raster_data[start:start + chunk_rows].astype(np.float64)
+        missing = np.isnan(block) | (block == no_data)
+        scaled = (np.clip(block, vmin, vmax) - vmin) / (vmax - vmin) * n_colors
+        with np.errstate(invalid='ignore'):
+            block_indices = np.minimum(scaled, n_colors - 1).astype(np.uint16)  # NaN cells are overwritten below
+        block_indices[missing] = n_colors
+        indices[start:start + chunk_rows] = block_indices
+    return indices
+
+
+# Output formats of raster_transform_django_test: GDAL driver and its default creation options (compression). PNG and
+# WebP carry no georeferencing, the caller places them with the returned bounds. COG is a GeoTIFF with internal
+# 256 x 256 tiles and overviews down to one tile, so a viewer at low zoom reads a few overview blocks only.
+RASTER_FORMATS = {
+    'GTiff': ('GTiff', {}),
+    'COG': ('COG', {'blocksize': 256, 'compress': 'deflate', 'overviews': 'auto', 'overview_resampling': COG_RESAMPLING}),
+    'PNG': ('PNG', {'zlevel': 6}),
+    'WEBP': ('WEBP', {'lossless': 'YES'}),
+}
+
+
+def encode_raster(band, bands, height, width, crs, transform, image_format='GTiff', creation_options=None):
+    """
+    In-memory file (BytesIO) of the uint8 bands band(0) .. band(bands - 1), written one at a time.
+    creation_options override the format's defaults, e.g. {'compress': 'deflate'} (GTiff), {'zlevel': 9} (PNG),
+    {'quality': 85} (lossy WebP), {'overview_resampling': 'average', 'blocksize': 512} (COG).
+    """
+    if image_format not in RASTER_FORMATS:
+        raise ValueError(f"Unknown raster format {image_format!r}, expected one of {list(RASTER_FORMATS)}")
+    driver, options = RASTER_FORMATS[image_format]
+    options = dict(options, **(creation_options or {}))
+    if driver == 'GTiff':
+        options = dict(encoding="utf-8", name='dismantle.tif', **options)
+    memfile = BytesIO()
+    with rasterio.open(
+            memfile, 'w', driver=driver,
+            height=height, width=width,
+            count=bands, dtype=rasterio.uint8,
+            crs=crs, transform=transform, **options) as dst:
+        for i in range(bands):
+            dst.write(band(i), i + 1)
+    memfile.seek(0)
+    return memfile
+
+
+@lru_cache(maxsize=256)
+def _color_legend(cmap_name, vmin, vmax, n_legend_entries):
+    cmap = cm.get_cmap(cmap_name)
+    legend = {}
+    for i in range(n_legend_entries):
+        value = vmin + (vmax - vmin) * i / (n_legend_entries - 1)
+        color = cmap(i / (n_legend_entries - 1))
+        legend[f"{value:.2f}"] = color
+    return legend
 
-    # Normalize the raster
-    normalized_raster = (raster_data - vmin) / (vmax - vmin)
 
-    # Increase the number of colors in the colormap
-    #n_colors = 256  # Increase this number for higher resolution
-    #cmap = cm.get_cmap(cmap_name, n_colors)
-    #colored_raster = cmap(normalized_raster)
+def color_legend(cmap_name, vmin, vmax, n_legend_entries):
+    """Legend of raster_transform*: value label -> RGBA color of n_legend_entries evenly spaced values (cached)."""
+    return dict(_color_legend(cmap_name, vmin, vmax, n_legend_entries))
 
-    # Apply colormap
-    cmap = cm.get_cmap(cmap_name)
-    colored_raster = cmap(normalized_raster)
 
-    # Handle NaN values by setting them to transparent
-    nan_mask = np.isnan(normalized_raster)
-    colored_raster[nan_mask] = [0, 0, 0, 0]  # RGBA for transparent
+def raster_transform_django_test(raster_file, vmin, vmax, cmap_name, n_legend_entries, no_data, colorize='lut',
+                                 outputs=('rgb', 'rgba'), image_format='GTiff', creation_options=None):
+    # This is temp copy of raster_transform function used in django test
+    # It returns colorized raster as a file and its path
+    # [Visualization/Folium]
+    # Function returning colorized raster for the folium map engine
+    # It returns colored_raster_as_a_file, colored raster_as_a_path, legend, and bounds
+    # colorize='lut' maps the band through the uint8 lookup table of the colormap (same bytes as 'float', the
+    # original matplotlib float RGBA path, at a fraction of its memory)
+    # Only the outputs asked for ('rgb' and / or 'rgba') are encoded, the others are returned as None;
+    # image_format is one of RASTER_FORMATS, creation_options tune its compression (see encode_raster)
+
+    # Read the raster data (file or in-memory raster)
+    raster_data, transform, crs, (xmin, ymin, xmax, ymax) = read_raster(raster_file)
+    height, width = raster_data.shape
+    unknown = set(outputs) - {'rgb', 'rgba'}
+    if unknown:
+        raise ValueError(f"Unknown raster outputs {sorted(unknown)}, expected 'rgb' and / or 'rgba'")
+
+    if colorize == 'lut':
+        indices = color_indices(raster_data, vmin, vmax, no_data, cm.get_cmap(cmap_name).N)
+        lut = color_lut(cmap_name)
+        band = lambda i: lut[indices, i]
+    else:
+        # Ensure the raster data is a numpy array with a numeric type
+        raster_data = np.array(raster_data, dtype=float)  # Convert to float for safe operations
+
+        # Replace no_data values with NaN before clipping
+        raster_data[raster_data == no_data] = np.nan
+
+        # Clipping raster values above and below the max and min
+        raster_data = np.clip(raster_data, vmin, vmax)
+        #print_raster_value_distribution(raster_data, 15)
+
+        # Normalize the raster
+        normalized_raster = (raster_data - vmin) / (vmax - vmin)
+
+        # Increase the number of colors in the colormap
+        #n_colors = 256  # Increase this number for higher resolution
+        #cmap = cm.get_cmap(cmap_name, n_colors)
+        #colored_raster = cmap(normalized_raster)
+
+        # Apply colormap
+        cmap = cm.get_cmap(cmap_name)
+        colored_raster = cmap(normalized_raster)
+
+        # Handle NaN values by setting them to transparent
+        nan_mask = np.isnan(normalized_raster)
+        colored_raster[nan_mask] = [0, 0, 0, 0]  # RGBA for transparent
+        band = lambda i: (colored_raster[:, :, i] * 255).astype(rasterio.uint8)
 
     ### TEMP Save colored rasters (3 and 4 channels)
     def save_colored_raster_disk(colored_raster, output_file, crs, transform, bands):
@@ -272,45 +381,9 @@ def raster_transform_django_test(raster_file, vmin, vmax, cmap_name, n_legend_en
                 # Write each band; note that rasterio expects bands in the order 1, 2, 3,...
                 dst.write((colored_raster[:, :, i] * 255).astype(dtype), i + 1)
 
-    # Save colored raster to an in-memory file
-    def save_colored_raster_to_memory(colored_raster, crs, transform, bands):
-        height, width = colored_raster.shape[:2]
-        dtype = rasterio.uint8
-        memfile = BytesIO()
-        with rasterio.open(
-                memfile, 'w', driver='GTiff',
-                height=height, width=width,
-                count=bands, dtype=dtype,
-                crs=crs, transform=transform) as dst:
-
-            for i in range(bands):
-                dst.write((colored_raster[:, :, i] * 255).astype(dtype), i + 1)
-        
-        memfile.seek(0)  # Rewind the file pointer to the beginning
-        return memfile
-
-    # save to memory option
-    # Save colored raster to an in-memory file
-    def save_colored_raster_to_memory(colored_raster, crs, transform, bands):
-        height, width = colored_raster.shape[:2]
-        dtype = rasterio.uint8
-        memfile = BytesIO()
-        with rasterio.open(
-                memfile, 'w', driver='GTiff',encoding="utf-8",name='dismantle.tif',
-                height=height, width=width,
-                count=bands, dtype=dtype,
-                crs=crs, transform=transform) as dst:
-
-            for i in range(bands):
-                dst.write((colored_raster[:, :, i] * 255).astype(dtype), i + 1)
-        
-        memfile.seek(0)  # Rewind the file pointer to the beginning
-        return memfile
-
-
-    # Save the raster to memory
-    memfile_rgb = save_colored_raster_to_memory(colored_raster, crs, transform, 3)
-    memfile_rgba = save_colored_raster_to_memory(colored_raster, crs, transform, 4)
+    # Save the asked raster(s) to memory
+    memfile_rgb = encode_raster(band, 3, height, width, crs, transform, image_format, creation_options) if 'rgb' in outputs else None
+    memfile_rgba = encode_raster(band, 4, height, width, crs, transform, image_format, creation_options) if 'rgba' in outputs else None
 
     
     # disk save option
@@ -325,34 +398,27 @@ def raster_transform_django_test(raster_file, vmin, vmax, cmap_name, n_legend_en
     ### END TEMP section
 
     # Create legend
-    legend = {}
-    for i in range(n_legend_entries):
-        value = vmin + (vmax - vmin) * i / (n_legend_entries - 1)
-        color = cmap(i / (n_legend_entries - 1))
-        legend[f"{value:.2f}"] = color
+    legend = color_legend(cmap_name, vmin, vmax, n_legend_entries)
 
     return memfile_rgb, memfile_rgba, legend, [[ymin, xmin], [ymax, xmax]]
 
 
 
 
-def raster_transform(raster_file, vmin, vmax, cmap_name, n_legend_entries, no_data):
+def raster_transform(raster_file, vmin, vmax, cmap_name, n_legend_entries, no_data, colorize='float'):
     # [Visualization/Folium]
     # Function returning colorized raster for the folium map engine
     # It returns colored_raster_as_a_file, colored raster_as_a_path, legend, and bounds
+    # colorize='lut' returns the colored raster as an H x W x 4 uint8 array (the float path values * 255)
+    # instead of the H x W x 4 float64 one
 
-    # Read the raster data
-    with rasterio.open(raster_file) as src:
-        raster_data = src.read(1)  # Read the first band
-        
-        # Get bounds from the raster file
-        bounds = src.bounds
-        ymin, xmin, ymax, xmax = bounds.bottom, bounds.left, bounds.top, bounds.right
+    # Read the raster data (file or in-memory raster)
+    raster_data, transform, crs, (xmin, ymin, xmax, ymax) = read_raster(raster_file)
 
-        ### TEMP: 3 and 4 channel rasters
-        transform = src.transform  # Get the affine transform (pixel to CRS)
-        crs = src.crs  # Get the coordinate reference system
-        ### END TEMP
+    if colorize == 'lut':
+        cmap = cm.get_cmap(cmap_name)
+        colored_raster = color_lut(cmap_name)[color_indices(raster_data, vmin, vmax, no_data, cmap.N)]
+        return colored_raster, color_legend(cmap_name, vmin, vmax, n_legend_entries), [[ymin, xmin], [ymax, xmax]]
 
     # Ensure the raster data is a numpy array with a numeric type
     raster_data = np.array(raster_data, dtype=float)  # Convert to float for safe operations
@@ -405,11 +471,7 @@ def raster_transform(raster_file, vmin, vmax, cmap_name, n_legend_entries, no_da
     ### END TEMP section
 
     # Create legend
-    legend = {}
-    for i in range(n_legend_entries):
-        value = vmin + (vmax - vmin) * i / (n_legend_entries - 1)
-        color = cmap(i / (n_legend_entries - 1))
-        legend[f"{value:.2f}"] = color
+    legend = color_legend(cmap_name, vmin, vmax, n_legend_entries)
 
     return colored_raster, legend, [[ymin, xmin], [ymax, xmax]]
 
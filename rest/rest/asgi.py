@@ -13,4 +13,23 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rest.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from modules.db_handler_async import close_async_pools  # noqa: E402 (settings first)
+
+
+async def application(scope, receive, send):
+    """
+    Django's ASGI application plus the lifespan protocol, which Django does not handle: the async database pools
+    of the worker's event loop are closed when the server shuts the worker down.
+    """
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_pools()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -117,6 +120,25 @@ DATABASES = {
 
 }
 
+# iPrism endpoint time limits in seconds: 'statement' caps every SQL statement of a request (statement_timeout),
+# 'request' is the overall deadline shared by its fetch, raster and publish stages (HTTP 504 when exceeded)
+IPRISM_ENDPOINT_TIMEOUTS = {
+    'default': {'statement': 30, 'request': 120},
+    'dismantle_site': {'statement': 20, 'request': 60},
+    'dismantle_site_summary': {'statement': 20, 'request': 30},
+    'dismantle_site_batch': {'statement': 30, 'request': 120},
+    'dismantle_site_sweep': {'statement': 60, 'request': 300},
+}
+
+# Format of the colorised rasters published to GeoServer (modules.vis_geomaps.RASTER_FORMATS): 'COG' carries internal
+# tiles and overviews (resampled with IPRISM_COG_RESAMPLING), so low zoom levels only read small overview blocks.
+# Only GeoTIFF formats: publish_raster uploads a GeoServer GeoTIFF coverage store (file.geotiff, image/tiff)
+IPRISM_PUBLISH_RASTER_FORMATS = ('GTiff', 'COG')
+IPRISM_PUBLISH_RASTER_FORMAT = os.environ.get('IPRISM_PUBLISH_RASTER_FORMAT', 'COG')
+if IPRISM_PUBLISH_RASTER_FORMAT not in IPRISM_PUBLISH_RASTER_FORMATS:
+    raise ImproperlyConfigured(f"IPRISM_PUBLISH_RASTER_FORMAT must be one of {IPRISM_PUBLISH_RASTER_FORMATS}, "
+                               f"got '{IPRISM_PUBLISH_RASTER_FORMAT}'")
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators